@@ -0,0 +1,284 @@
+# coding: utf-8
+"""
+分析流程的基准测试集
+
+覆盖 KlineAnalyze 批量初始化、逐根 update、update_many、KlineSignals.get_signals（完整计算与命中缓存）、find_zs、
+KlineGeneratorBy1Min / KlineGeneratorByTick 的吞吐量、czsc.utils.ta 中的技术指标以及 replay_signals 历史回放。
+每一项都在不同的历史长度 n 下运行，并用 log(耗时) 对 log(n) 做线性回归得到增长指数 slope：
+单次操作的耗时理想情况下 slope 接近 0，批量计算接近 1；slope 明显变大说明出现了 O(n²) 之类的退化。
+
+结果保存为 JSON 文件，包括运行环境、git 版本以及每一项的 p50/p99/mean，可以在不同提交之间对比。
+
+用法：
+    python benchmarks/bench_suite.py                          # 运行全部基准测试
+    python benchmarks/bench_suite.py --sizes 1000,5000 --only update,find_zs
+    python benchmarks/bench_suite.py --compare base.json new.json
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, '..')
+
+import json
+import time
+import platform
+import argparse
+import subprocess
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+from czsc.analyze import KlineAnalyze, find_zs, ta as ta_backend
+from czsc.signals import KlineSignals
+from czsc.engine import replay_signals
+from czsc.utils import ta
+from czsc.utils.kline_generator import KlineGeneratorBy1Min, KlineGeneratorByTick
+from bench_update import mock_bars
+
+SIZES = (1000, 5000, 20000)
+
+
+def market_bars(n, seed=2020):
+    """mock_bars 生成的K线，时间替换为A股交易时间（每个交易日 240 根1分钟K线）"""
+    bars = mock_bars(n, seed)
+    minutes = np.concatenate([np.arange(9 * 60 + 31, 11 * 60 + 31), np.arange(13 * 60 + 1, 15 * 60 + 1)])
+    days = pd.bdate_range("2010-01-04", periods=n // len(minutes) + 1)
+    dt = pd.DatetimeIndex((days.values[:, None] + pd.to_timedelta(minutes, unit="m").values[None, :]).ravel())
+    for k, t in zip(bars, dt[:n]):
+        k['dt'] = t
+    return bars
+
+
+def timeit(func, repeat):
+    """重复执行 func，返回每次的耗时（微秒）"""
+    cost = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        cost.append(time.perf_counter() - t0)
+    return np.array(cost) * 1e6
+
+
+def bench_init(bars, n, repeat):
+    """用 n 根K线初始化 KlineAnalyze，use_xd=True，use_ta=True"""
+    return timeit(lambda: KlineAnalyze(bars[:n], max_count=n, use_xd=True, use_ta=True), repeat)
+
+
+def bench_init_frame(bars, n, repeat):
+    """用 n 行 DataFrame 初始化 KlineAnalyze"""
+    df = pd.DataFrame(bars[:n])
+    return timeit(lambda: KlineAnalyze(df, max_count=n, use_xd=True, use_ta=True), repeat)
+
+
+def bench_update(bars, n, repeat, count=1000):
+    """max_count=n 时单次 update 的耗时"""
+    ka = KlineAnalyze(bars[:n], max_count=n, use_xd=True, use_ta=True)
+    rest = iter(bars[n: n + count])
+    return timeit(lambda: ka.update(next(rest)), count)
+
+
+def bench_update_many(bars, n, repeat, count=1000):
+    """max_count=n 时 update_many 一次输入 count 根K线的耗时"""
+    cost = []
+    for _ in range(repeat):
+        ka = KlineAnalyze(bars[:n], max_count=n, use_xd=True, use_ta=True)
+        cost.extend(timeit(lambda: ka.update_many(bars[n: n + count]), 1))
+    return np.array(cost)
+
+
+def bench_get_signals(bars, n, repeat):
+    """max_count=n 的 KlineSignals 计算一次信号的耗时；每次计算之前清空信号缓存，测量的是完整的计算"""
+    ks = KlineSignals(bars[:n], name="1分钟", max_count=n, use_xd=True)
+
+    def run():
+        ks.__dict__.pop('_signal_cache', None)
+        ks.get_signals()
+    return timeit(run, max(repeat, 20))
+
+
+def bench_get_signals_cached(bars, n, repeat):
+    """分析结果没有变化时，KlineSignals.get_signals 命中缓存的耗时"""
+    ks = KlineSignals(bars[:n], name="1分钟", max_count=n, use_xd=True)
+    ks.get_signals()
+    return timeit(ks.get_signals, max(repeat, 20))
+
+
+def bench_find_zs(bars, n, repeat):
+    """对 n 根K线识别出的全部笔标记识别中枢"""
+    points = KlineAnalyze(bars[:n], max_count=n).bi_list
+    return timeit(lambda: find_zs(points), max(repeat, 20))
+
+
+def bench_generator_1min(bars, n, repeat, count=2000):
+    """max_count=n 的 KlineGeneratorBy1Min 单次 update 的耗时"""
+    kg = KlineGeneratorBy1Min(max_count=n)
+    for k in bars[:n]:
+        kg.update(k)
+    rest = iter(bars[n: n + count])
+    return timeit(lambda: kg.update(next(rest)), count)
+
+
+def bench_generator_tick(bars, n, repeat, count=2000):
+    """max_count=n 的 KlineGeneratorByTick 单次 update 的耗时，每根1分钟K线拆成开高低收4个 tick"""
+    ticks = []
+    for k in bars[: n + count // 4 + 1]:
+        for i, p in enumerate((k['open'], k['high'], k['low'], k['close'])):
+            ticks.append({"symbol": k['symbol'], "dt": k['dt'] - pd.Timedelta(seconds=45 - i * 15),
+                          "price": p, "vol": k['vol'] / 4})
+    kg = KlineGeneratorByTick(max_count=n)
+    for tick in ticks[:n]:
+        kg.update(tick)
+    rest = iter(ticks[n: n + count])
+    return timeit(lambda: kg.update(next(rest)), count)
+
+
+def bench_ta(bars, n, repeat):
+    """czsc.utils.ta 对 n 根K线计算 SMA、EMA、MACD、KDJ 的总耗时"""
+    close = np.array([x['close'] for x in bars[:n]])
+    high = np.array([x['high'] for x in bars[:n]])
+    low = np.array([x['low'] for x in bars[:n]])
+
+    def run():
+        ta.SMA(close, 20)
+        ta.EMA(close, 20)
+        ta.MACD(close)
+        ta.KDJ(close, high, low)
+    return timeit(run, max(repeat, 5))
+
+
+def bench_replay(bars, n, repeat, count=2000):
+    """replay_signals 回放 count 根1分钟K线时每根K线的耗时：4个级别的 KlineSignals，max_count=n，
+    初始化用 n 根K线，从总耗时中减去只初始化的耗时"""
+    cost = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        replay_signals(bars[:n], init_count=n, max_count=n)
+        t1 = time.perf_counter()
+        replay_signals(bars[:n + count], init_count=n, max_count=n)
+        t2 = time.perf_counter()
+        cost.append(max(t2 - t1 - (t1 - t0), 0) / count)
+    return np.array(cost) * 1e6
+
+
+BENCHMARKS = {
+    "init": bench_init,
+    "init_frame": bench_init_frame,
+    "update": bench_update,
+    "update_many": bench_update_many,
+    "get_signals": bench_get_signals,
+    "get_signals_cached": bench_get_signals_cached,
+    "find_zs": bench_find_zs,
+    "generator_1min": bench_generator_1min,
+    "generator_tick": bench_generator_tick,
+    "ta": bench_ta,
+    "replay": bench_replay,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def scaling(rows):
+    """log(p50) 对 log(n) 的回归斜率"""
+    rows = [x for x in rows if x['p50'] > 0]
+    if len(rows) < 2:
+        return None
+    x = np.log([r['n'] for r in rows])
+    y = np.log([r['p50'] for r in rows])
+    return round(float(np.polyfit(x, y, 1)[0]), 3)
+
+
+def run(names, sizes, repeat=3):
+    bars = market_bars(max(sizes) + 5000)
+    # 预热 numba 内核（包括 signal_kernel），避免把编译时间计入第一项
+    KlineSignals(bars[:500], name="1分钟", max_count=500, use_xd=True).get_signals()
+    bench_ta(bars, 100, 1)
+
+    results = []
+    for name in names:
+        func = BENCHMARKS[name]
+        rows = []
+        for n in sizes:
+            cost = func(bars, n, repeat)
+            row = {"name": name, "n": n, "unit": "us", "runs": len(cost),
+                   "mean": float(cost.mean()), "p50": float(np.percentile(cost, 50)),
+                   "p99": float(np.percentile(cost, 99)), "min": float(cost.min())}
+            rows.append(row)
+            print("{name:>18} n={n:<8} p50={p50:>12.1f} p99={p99:>12.1f} mean={mean:>12.1f} us".format(**row))
+        slope = scaling(rows)
+        for row in rows:
+            row['slope'] = slope
+        print("{:>18} slope={}".format(name, slope))
+        results.extend(rows)
+    return results
+
+
+def meta():
+    import numba
+    return {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "numba": numba.__version__,
+        "ta_backend": ta_backend.__name__,
+    }
+
+
+def compare(file_base, file_new, threshold=1.2):
+    """对比两次运行的结果，输出 p50 的变化倍数，超过 threshold 的标记为退化"""
+    with open(file_base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(file_new, encoding="utf-8") as f:
+        new = json.load(f)
+    base_rows = {(r['name'], r['n']): r for r in base['results']}
+    print("base: {}  new: {}".format(base['meta'].get('commit'), new['meta'].get('commit')))
+    print("{:>18} {:>8} {:>12} {:>12} {:>8}".format("name", "n", "base p50", "new p50", "ratio"))
+    regressions = 0
+    for r in new['results']:
+        b = base_rows.get((r['name'], r['n']))
+        if b is None:
+            continue
+        ratio = r['p50'] / b['p50'] if b['p50'] else float('nan')
+        flag = " <- 退化" if ratio > threshold else ""
+        regressions += ratio > threshold
+        print("{:>18} {:>8} {:>12.1f} {:>12.1f} {:>8.2f}{}".format(r['name'], r['n'], b['p50'], r['p50'], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="czsc 基准测试")
+    parser.add_argument("--sizes", default=",".join(str(x) for x in SIZES), help="历史长度，逗号分隔")
+    parser.add_argument("--only", default=None, help="只运行指定的基准测试，逗号分隔：" + ",".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="批量计算类基准测试的重复次数")
+    parser.add_argument("--output", default=None, help="结果文件，默认为 bench_<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="对比两个结果文件")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [x for x in names if x not in BENCHMARKS]
+    if unknown:
+        parser.error("未知的基准测试：{}".format(unknown))
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    data = {"meta": meta(), "sizes": sizes, "results": run(names, sizes, args.repeat)}
+    file_output = args.output or "bench_{}.json".format(data['meta']['commit'] or "local")
+    with open(file_output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print("结果已保存到 {}".format(file_output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# coding: utf-8
+"""
+KlineAnalyze.update 单根K线更新耗时与 max_count 的关系
+
+K线数量超过 max_count 之后，每次 update 都要淘汰最早的K线，理想情况下单次更新耗时不随 max_count 变化。
+
+用法：python benchmarks/bench_update.py
+"""
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, '..')
+
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+from czsc.analyze import KlineAnalyze
+
+
+def mock_bars(n, seed=2020):
+    """用随机游走生成 n 根1分钟K线，固定随机种子保证结果可复现"""
+    rng = np.random.RandomState(seed)
+    close = 3000 * np.exp(np.cumsum(rng.normal(0, 0.001, n)))
+    open_ = np.concatenate([[3000], close[:-1]])
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.0005, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.0005, n)))
+    vol = rng.randint(10000, 1000000, n).astype(np.double)
+    dt = pd.date_range("2010-01-04 09:31:00", periods=n, freq="1min")
+    return [{"symbol": "MOCK", "dt": dt[i], "open": open_[i], "close": close[i],
+             "high": high[i], "low": low[i], "vol": vol[i]} for i in range(n)]
+
+
+def bench_update(bars, max_count, n_update=2000, **kwargs):
+    """用 max_count 根K线初始化，再逐根输入 n_update 根K线，统计单次 update 的耗时（微秒）"""
+    ka = KlineAnalyze(bars[:max_count], max_count=max_count, **kwargs)
+    cost = []
+    for k in bars[max_count: max_count + n_update]:
+        t0 = time.perf_counter()
+        ka.update(k)
+        cost.append(time.perf_counter() - t0)
+    cost = np.array(cost) * 1e6
+    return {"max_count": max_count, "mean": cost.mean(),
+            "p50": np.percentile(cost, 50), "p99": np.percentile(cost, 99)}
+
+
+def main(max_counts=(500, 1000, 2000, 5000, 10000, 20000, 50000), n_update=2000):
+    bars = mock_bars(max(max_counts) + n_update)
+    for columnar in (False, True):
+        print("\ncolumnar={}，use_xd=True，use_ta=True，单位：微秒".format(columnar))
+        print("{:>10} {:>10} {:>10} {:>10}".format("max_count", "mean", "p50", "p99"))
+        for max_count in max_counts:
+            res = bench_update(bars, max_count, n_update, use_xd=True, use_ta=True, columnar=columnar)
+            print("{max_count:>10} {mean:>10.1f} {p50:>10.1f} {p99:>10.1f}".format(**res))
+
+
+if __name__ == '__main__':
+    main()
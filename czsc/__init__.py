@@ -1,7 +1,10 @@
 # coding: utf-8
 
 from .analyze import KlineAnalyze, find_zs
-from .signals import KlineSignals
+from .objects import RawBar, NewBar, FX, BI, XD
+from .signals import KlineSignals, SignalSchema
+from .universe import analyze_universe, iter_universe, screen_universe
+from .engine import MultiLevelAnalyze, replay_signals
 from .utils.ta import SMA, EMA, MACD, KDJ
 
 __version__ = "0.5.8"
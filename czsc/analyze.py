@@ -1,30 +1,135 @@
 # coding: utf-8
 
+import pickle
+import struct
+import sys
 import warnings
+from collections import deque
 
 try:
     import talib as ta
+    # ta-lib 的 MACD 柱子为 diff - dea
+    MACD_FACTOR = 1
 except ImportError:
     ta_lib_hint = "没有安装 ta-lib !!! 请到 https://www.lfd.uci.edu/~gohlke/pythonlibs/#ta-lib " \
                   "下载对应版本安装，预计分析速度提升2倍"
     warnings.warn(ta_lib_hint)
     from .utils import ta
+    # czsc.utils.ta 的 MACD 柱子为 (diff - dea) * 2
+    MACD_FACTOR = 2
 import pandas as pd
 import numpy as np
 from .utils.plot import ka_to_image
+from .objects import RawBar, NewBar, FX, BI, XD
+from .utils.store import ColumnStore, PrefixSumIndex, pack_records, unpack_records, to_ns
+from .utils.structure import remove_include, find_fx, find_bi
+from .utils.perf import StageTimer
+from .utils.ta import EMA, SMA
+
+# save_state 保存的状态文件的文件头与格式版本，格式变化时递增版本号
+STATE_MAGIC = b"CZSC-KA\x00"
+STATE_VERSION = 1
+
+# 状态文件中允许出现的函数与内置类型，其余只允许 czsc、numpy、pandas 中的数据类型，见 _StateUnpickler
+STATE_GLOBALS = {
+    ("builtins", name) for name in ("bool", "int", "float", "complex", "str", "bytes", "bytearray",
+                                    "list", "tuple", "dict", "set", "frozenset", "slice", "range")
+} | {
+    ("datetime", name) for name in ("date", "time", "datetime", "timedelta", "timezone")
+} | {
+    ("collections", "deque"), ("collections", "OrderedDict"),
+    ("numpy.core.multiarray", "_reconstruct"), ("numpy.core.multiarray", "scalar"),
+    ("numpy._core.multiarray", "_reconstruct"), ("numpy._core.multiarray", "scalar"),
+}
+
+
+class _StateUnpickler(pickle.Unpickler):
+    """只恢复白名单中的对象，状态文件中引用其他函数、类时抛出 pickle.UnpicklingError
+
+    pickle.load 会调用数据中引用的任意函数，直接加载来源不明的文件等同于执行其中的代码
+    """
 
+    def find_class(self, module, name):
+        if (module, name) in STATE_GLOBALS:
+            return super().find_class(module, name)
+
+        root = module.split(".")[0]
+        if "." in name:
+            # 不允许通过属性访问取得其他对象
+            pass
+        elif root in ("czsc", "numpy", "pandas"):
+            obj = super().find_class(module, name)
+            if root == "czsc" and isinstance(obj, type) and module.startswith(
+                    ("czsc.analyze", "czsc.objects", "czsc.signals", "czsc.utils.")):
+                return obj
+            if root == "numpy" and isinstance(obj, type) and (
+                    obj is np.ndarray or issubclass(obj, (np.generic, np.dtype))):
+                return obj
+            if root == "pandas" and module.startswith(("pandas.core.", "pandas._libs.")) and (
+                    isinstance(obj, type) or name.startswith(("_unpickle", "__pyx_unpickle", "_new_"))):
+                return obj
+        elif module in sys.modules:
+            # 已经导入的模块中自定义的 KlineAnalyze 子类，不会为此导入新的模块
+            obj = super().find_class(module, name)
+            if isinstance(obj, type) and issubclass(obj, KlineAnalyze):
+                return obj
+        raise pickle.UnpicklingError("状态文件中引用了不允许加载的对象：{}.{}".format(module, name))
+
+
+def get_zs_value(point):
+    """获取笔或线段标记点的价格：笔标记点取 bi，线段标记点取 xd"""
+    return point['bi'] if point.get("bi", 0) else point['xd']
+
+
+class ZsTracker:
+    """中枢识别器
+
+    逐个输入笔或线段标记点，增量识别中枢，识别结果与 find_zs 一致。每个标记点只处理一次，
+    ZD、ZG、G、GG、D、DD 随标记点的加入即时更新；尾部标记点发生变化时，按操作日志回退后重新输入。
+    识别出的中枢直接引用输入的标记点，不会复制或者修改它们。
+    """
 
-def find_zs(points):
-    """输入笔或线段标记点，输出中枢识别结果"""
-    if len(points) < 5:
-        return []
+    def __init__(self, key=get_zs_value, max_undo=64):
+        """
 
-    # 当输入为笔的标记点时，新增 xd 值
-    for j, x in enumerate(points):
-        if x.get("bi", 0):
-            points[j]['xd'] = x["bi"]
+        :param key: str or callable
+            标记点价格的字段名，如 'bi'、'xd'；也可以是从标记点中获取价格的函数
+        :param max_undo: int
+            最多可以回退的标记点数量，超出后回退需要从头识别
+        """
+        self.key = key
+        self.max_undo = max_undo
+        self.zs_list = []  # 已经确认（出现第三类买卖点）的中枢
+        self.points = []  # 正在识别的标记点，对应 find_zs 中的 zs_xd
+        self._stats = None  # points 中的 (G, GG, D, DD)
+        self._last = None  # 最后一个输入的标记点
+        self._undo = deque(maxlen=max_undo)
+
+    def _value(self, point):
+        return point[self.key] if isinstance(self.key, str) else self.key(point)
+
+    def _window(self):
+        """前4个标记点决定的 (ZD, ZG)，ZG > ZD 时 points 构成中枢"""
+        head = self.points[:4]
+        zs_d = max([self._value(x) for x in head if x['fx_mark'] == 'd'])
+        zs_g = min([self._value(x) for x in head if x['fx_mark'] == 'g'])
+        return zs_d, zs_g
+
+    def _add_stats(self, point):
+        """把标记点计入 (G, GG, D, DD)"""
+        v = self._value(point)
+        if self._stats is None:
+            self._stats = (None, None, None, None)
+        g, gg, d, dd = self._stats
+        if point['fx_mark'] == 'g':
+            g = v if g is None else min(g, v)
+            gg = v if gg is None else max(gg, v)
+        else:
+            d = v if d is None else max(d, v)
+            dd = v if dd is None else min(dd, v)
+        self._stats = (g, gg, d, dd)
 
-    def __get_zn(zn_points_):
+    def _get_zn(self, zn_points_):
         """把与中枢方向一致的次级别走势类型称为Z走势段，按中枢中的时间顺序，
         分别记为Zn等，而相应的高、低点分别记为gn、dn"""
         if len(zn_points_) % 2 != 0:
@@ -37,90 +142,141 @@ def find_zs(points):
 
         zn = []
         for i in range(0, len(zn_points_), 2):
+            v1, v2 = self._value(zn_points_[i]), self._value(zn_points_[i + 1])
             zn_ = {
                 "start_dt": zn_points_[i]['dt'],
                 "end_dt": zn_points_[i + 1]['dt'],
-                "high": max(zn_points_[i]['xd'], zn_points_[i + 1]['xd']),
-                "low": min(zn_points_[i]['xd'], zn_points_[i + 1]['xd']),
+                "high": max(v1, v2),
+                "low": min(v1, v2),
                 "direction": z_direction
             }
             zn_['mid'] = zn_['low'] + (zn_['high'] - zn_['low']) / 2
             zn.append(zn_)
         return zn
 
-    k_xd = points
-    k_zs = []
-    zs_xd = []
-
-    for i in range(len(k_xd)):
-        if len(zs_xd) < 5:
-            zs_xd.append(k_xd[i])
-            continue
-        xd_p = k_xd[i]
-        zs_d = max([x['xd'] for x in zs_xd[:4] if x['fx_mark'] == 'd'])
-        zs_g = min([x['xd'] for x in zs_xd[:4] if x['fx_mark'] == 'g'])
+    def _make_zs(self, zs_d, zs_g, end_point):
+        g, gg, d, dd = self._stats
+        return {
+            'ZD': zs_d,
+            "ZG": zs_g,
+            'G': g,
+            'GG': gg,
+            'D': d,
+            'DD': dd,
+            'start_point': self.points[1],
+            'end_point': end_point,
+            "zn": self._get_zn(self.points[3:]),
+            "points": self.points,
+        }
+
+    @property
+    def current_zs(self):
+        """正在延伸、还没有出现第三类买卖点的中枢，不存在时返回 None"""
+        if len(self.points) < 5:
+            return None
+        zs_d, zs_g = self._window()
         if zs_g <= zs_d:
-            zs_xd.append(k_xd[i])
-            zs_xd.pop(0)
-            continue
-
-        # 定义四个指标,GG=max(gn),G=min(gn),D=max(dn),DD=min(dn)，n遍历中枢中所有Zn。
-        # 定义ZG=min(g1、g2), ZD=max(d1、d2)，显然，[ZD，ZG]就是缠中说禅走势中枢的区间
-        if xd_p['fx_mark'] == "d" and xd_p['xd'] > zs_g:
-            zn_points = zs_xd[3:]
-            # 线段在中枢上方结束，形成三买
-            k_zs.append({
-                'ZD': zs_d,
-                "ZG": zs_g,
-                'G': min([x['xd'] for x in zs_xd if x['fx_mark'] == 'g']),
-                'GG': max([x['xd'] for x in zs_xd if x['fx_mark'] == 'g']),
-                'D': max([x['xd'] for x in zs_xd if x['fx_mark'] == 'd']),
-                'DD': min([x['xd'] for x in zs_xd if x['fx_mark'] == 'd']),
-                'start_point': zs_xd[1],
-                'end_point': zs_xd[-2],
-                "zn": __get_zn(zn_points),
-                "points": zs_xd,
-                "third_buy": xd_p
-            })
-            zs_xd = []
-        elif xd_p['fx_mark'] == "g" and xd_p['xd'] < zs_d:
-            zn_points = zs_xd[3:]
-            # 线段在中枢下方结束，形成三卖
-            k_zs.append({
-                'ZD': zs_d,
-                "ZG": zs_g,
-                'G': min([x['xd'] for x in zs_xd if x['fx_mark'] == 'g']),
-                'GG': max([x['xd'] for x in zs_xd if x['fx_mark'] == 'g']),
-                'D': max([x['xd'] for x in zs_xd if x['fx_mark'] == 'd']),
-                'DD': min([x['xd'] for x in zs_xd if x['fx_mark'] == 'd']),
-                'start_point': zs_xd[1],
-                'end_point': zs_xd[-2],
-                "points": zs_xd,
-                "zn": __get_zn(zn_points),
-                "third_sell": xd_p
-            })
-            zs_xd = []
+            return None
+        return self._make_zs(zs_d, zs_g, end_point=None)
+
+    @property
+    def all_zs(self):
+        """全部中枢，包括正在延伸的中枢"""
+        current = self.current_zs
+        return self.zs_list + [current] if current else list(self.zs_list)
+
+    def push(self, point):
+        """输入一个新的标记点"""
+        stats, last = self._stats, self._last
+        self._last = point
+        if len(self.points) >= 5:
+            zs_d, zs_g = self._window()
+            if zs_g <= zs_d:
+                # 前4个标记点不构成中枢，窗口向后滑动
+                self.points.append(point)
+                head = self.points.pop(0)
+                self._stats = None
+                for x in self.points:
+                    self._add_stats(x)
+                self._undo.append((last, 'slide', head, stats))
+                return
+
+            value = self._value(point)
+            if (point['fx_mark'] == "d" and value > zs_g) or (point['fx_mark'] == "g" and value < zs_d):
+                # 标记点在中枢上方结束，形成三买；在中枢下方结束，形成三卖
+                zs = self._make_zs(zs_d, zs_g, end_point=self.points[-2])
+                zs["third_buy" if point['fx_mark'] == "d" else "third_sell"] = point
+                self.zs_list.append(zs)
+                self.points = []
+                self._stats = None
+                self._undo.append((last, 'emit', zs, stats))
+                return
+
+        self.points.append(point)
+        self._add_stats(point)
+        self._undo.append((last, 'append', None, stats))
+
+    def pop(self):
+        """撤销最后一次输入"""
+        last, action, payload, stats = self._undo.pop()
+        if action == 'append':
+            self.points.pop()
+        elif action == 'slide':
+            self.points.pop()
+            self.points.insert(0, payload)
         else:
-            zs_xd.append(xd_p)
-
-    if len(zs_xd) >= 5:
-        zs_d = max([x['xd'] for x in zs_xd[:4] if x['fx_mark'] == 'd'])
-        zs_g = min([x['xd'] for x in zs_xd[:4] if x['fx_mark'] == 'g'])
-        if zs_g > zs_d:
-            zn_points = zs_xd[3:]
-            k_zs.append({
-                'ZD': zs_d,
-                "ZG": zs_g,
-                'G': min([x['xd'] for x in zs_xd if x['fx_mark'] == 'g']),
-                'GG': max([x['xd'] for x in zs_xd if x['fx_mark'] == 'g']),
-                'D': max([x['xd'] for x in zs_xd if x['fx_mark'] == 'd']),
-                'DD': min([x['xd'] for x in zs_xd if x['fx_mark'] == 'd']),
-                'start_point': zs_xd[1],
-                'end_point': None,
-                "zn": __get_zn(zn_points),
-                "points": zs_xd,
-            })
-    return k_zs
+            self.zs_list.pop()
+            self.points = payload['points']
+        self._stats = stats
+        self._last = last
+
+    def reset(self):
+        """清空识别结果"""
+        self.zs_list = []
+        self.points = []
+        self._stats = None
+        self._last = None
+        self._undo.clear()
+
+    def update(self, points):
+        """输入最新的标记点序列，回退已经变化的尾部标记点，再输入新的标记点
+
+        :param points: list
+            按时间升序排列的笔或线段标记点，头部可以已经被淘汰
+        """
+        i = len(points) if self._last is not None else 0
+        while self._last is not None:
+            while i > 0 and points[i - 1]['dt'] > self._last['dt']:
+                i -= 1
+            if i > 0 and (points[i - 1] is self._last or points[i - 1] == self._last):
+                break
+            if not self._undo:
+                # 超出可以回退的范围，从头识别
+                self.reset()
+                i = 0
+                break
+            self.pop()
+        for point in points[i:]:
+            self.push(point)
+
+    def trim(self, last_dt):
+        """淘汰结束时间不晚于 last_dt 的中枢"""
+        n = 0
+        while n < len(self.zs_list) and self.zs_list[n]['end_point']['dt'] <= last_dt:
+            n += 1
+        if n:
+            del self.zs_list[:n]
+
+
+def find_zs(points):
+    """输入笔或线段标记点，输出中枢识别结果；不会修改输入的标记点"""
+    if len(points) < 5:
+        return []
+
+    tracker = ZsTracker()
+    for point in points:
+        tracker.push(point)
+    return tracker.all_zs
 
 
 def has_gap(k1, k2, min_gap=0.002):
@@ -136,38 +292,84 @@ def has_gap(k1, k2, min_gap=0.002):
 def get_potential_xd(bi_points):
     """获取潜在线段标记点
 
-    :param bi_points: list of dict
+    :param bi_points: list of BI
         笔标记点
-    :return: list of dict
+    :return: list of BI
         潜在线段标记点
     """
     xd_p = []
-    bi_d = [x for x in bi_points if x['fx_mark'] == 'd']
-    bi_g = [x for x in bi_points if x['fx_mark'] == 'g']
+    bi_d = [x for x in bi_points if x.fx_mark == 'd']
+    bi_g = [x for x in bi_points if x.fx_mark == 'g']
     for i in range(1, len(bi_d) - 1):
         d1, d2, d3 = bi_d[i - 1: i + 2]
-        if d1['bi'] > d2['bi'] < d3['bi']:
+        if d1.bi > d2.bi < d3.bi:
             xd_p.append(d2)
     for j in range(1, len(bi_g) - 1):
         g1, g2, g3 = bi_g[j - 1: j + 2]
-        if g1['bi'] < g2['bi'] > g3['bi']:
+        if g1.bi < g2.bi > g3.bi:
             xd_p.append(g2)
 
-    xd_p = sorted(xd_p, key=lambda x: x['dt'], reverse=False)
+    xd_p = sorted(xd_p, key=lambda x: x.dt, reverse=False)
     return xd_p
 
 
+def get_tail(seq, dt, include=False):
+    """从尾部向前查找，返回按时间升序排列的序列中 dt 之后的全部元素
+
+    :param seq: list of dict
+    :param dt: datetime
+    :param include: bool
+        是否包含时间等于 dt 的元素
+    :return: list of dict
+    """
+    i = len(seq)
+    if include:
+        while i > 0 and seq[i - 1]['dt'] >= dt:
+            i -= 1
+    else:
+        while i > 0 and seq[i - 1]['dt'] > dt:
+            i -= 1
+    return seq[i:]
+
+
+def frame_to_records(df, index=None):
+    """把 DataFrame 转换成 list of dict，逐列转换成 Python 对象，避免按行读取时的类型转换
+
+    :param df: pd.DataFrame
+    :param index: np.array
+        需要转换的行下标，为 None 时转换全部行
+    :return: list of dict
+    """
+    columns = df.columns.to_list()
+    if index is None:
+        values = [df[c].tolist() for c in columns]
+    else:
+        values = [df[c].take(index).tolist() for c in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def trim_head(seq, last_dt):
+    """删除按时间升序排列的序列头部所有 dt <= last_dt 的元素"""
+    n = 0
+    while n < len(seq) and seq[n]['dt'] <= last_dt:
+        n += 1
+    if n:
+        del seq[:n]
+
+
 class KlineAnalyze:
     def __init__(self, kline, name="本级别", bi_mode="new", max_count=1000,
-                 use_xd=False, use_ta=True, ma_params=(5, 34, 120), verbose=False):
+                 use_xd=False, use_ta=True, ma_params=(5, 34, 120), verbose=False, columnar=False):
         """
 
         :param kline: list or pd.DataFrame
+            输入 dt 列为时间类型的 DataFrame 时，直接使用各列的数组进行计算，kline_raw 在第一次读取时才构造；
+            在此之前不要修改这个 DataFrame
         :param name: str
         :param bi_mode: str
             new 新笔；old 老笔；默认值为 new
         :param max_count: int
-            最大保存的K线数量
+            最大保存的K线数量，超出后分块淘汰最早的K线，保存的K线数量在 max_count 的 90% ~ 100% 之间
         :param use_xd: bool
             是否进行线段识别，对于以笔作为 f0 的交易策略而言，不进行线段识别可以加快分析速度
         :param use_ta: bool
@@ -175,6 +377,9 @@ class KlineAnalyze:
         :param ma_params: tuple of int
             均线系统参数
         :param verbose: bool
+        :param columnar: bool
+            是否使用列式存储保存 kline_raw / kline_new / ma / macd，品种数量多时可以大幅降低内存占用；
+            此时按下标读取到的 K 线等都是临时构造的 dict，修改它们不会影响分析结果
         """
         self.name = name
         self.verbose = verbose
@@ -183,6 +388,8 @@ class KlineAnalyze:
         self.use_xd = use_xd
         self.use_ta = use_ta
         self.ma_params = ma_params
+        self.columnar = columnar
+        self._frame = None  # 使用 DataFrame 初始化时，kline_raw 构造之前的原始数据
         self.kline_raw = []  # 原始K线序列
         self.kline_new = []  # 去除包含关系的K线序列
 
@@ -194,114 +401,323 @@ class KlineAnalyze:
         self.fx_list = []
         self.bi_list = []
         self.xd_list = []
+        self._xd_checkpoint = None  # 线段增量识别的检查点
+        self._tails = {}  # 识别结构时各序列被改动的尾部：{key: (起始下标, 改动前的尾部元素)}
+
+        # 笔中枢、线段中枢
+        self.bi_zs = ZsTracker('bi')
+        self.xd_zs = ZsTracker('xd')
+
+        # 结构变化事件的订阅者：(callback, events)
+        self._subscribers = []
+        # 分阶段耗时统计，默认关闭，见 enable_timer
+        self.timer = None
+        # 结构版本号：序列的尾部发生变化（同样的元素重新创建不算）或者头部被淘汰时加 1，
+        # 用于缓存只依赖部分序列的计算结果，见 KlineSignals
+        self.versions = {"kline_new": 0, "fx_list": 0, "bi_list": 0, "xd_list": 0}
 
         # 根据输入K线初始化
-        if isinstance(kline, pd.DataFrame):
+        if columnar:
+            self._init_columnar(kline)
+        elif isinstance(kline, pd.DataFrame) and pd.api.types.is_datetime64_any_dtype(kline['dt']):
+            # 直接使用 DataFrame 中的各列进行计算，kline_raw 在第一次读取时才构造
+            self._kline_raw, self._frame = None, kline
+        elif isinstance(kline, pd.DataFrame):
             columns = kline.columns.to_list()
             self.kline_raw = [{k: v for k, v in zip(columns, row)} for row in kline.values]
         else:
-            self.kline_raw = kline
-
-        self.symbol = self.kline_raw[0]['symbol']
-        self.start_dt = self.kline_raw[0]['dt']
-        self.end_dt = self.kline_raw[-1]['dt']
-        self.latest_price = self.kline_raw[-1]['close']
+            self.kline_raw = list(kline)
 
-        self._update_kline_new()
+        if self._frame is not None:
+            self.symbol = kline['symbol'].iat[0]
+            self.start_dt = kline['dt'].iat[0]
+            self.end_dt = kline['dt'].iat[-1]
+            self.latest_price = kline['close'].iat[-1].item()
+        else:
+            self.symbol = self.kline_raw[0]['symbol']
+            self.start_dt = self.kline_raw[0]['dt']
+            self.end_dt = self.kline_raw[-1]['dt']
+            self.latest_price = self.kline_raw[-1]['close']
 
         if self.use_ta:
             self._update_ta()
+        self._init_power_index()
 
-        self._update_fx_list()
-        self._update_bi_list()
+        if self.verbose:
+            # 逐根识别，输出识别过程
+            self._update_kline_new()
+            self._update_fx_list()
+            self._update_bi_list()
+        else:
+            self._init_structure()
 
         if self.use_xd:
             self._update_xd_list()
+        self._update_zs()
 
-    def _update_ta(self):
-        """更新辅助技术指标"""
-        if not self.ma:
-            ma_temp = dict()
-            close_ = np.array([x["close"] for x in self.kline_raw], dtype=np.double)
+    def _init_columnar(self, kline):
+        """使用列式存储初始化 kline_raw / kline_new / ma / macd"""
+        fields = ('open', 'close', 'high', 'low', 'vol')
+        if isinstance(kline, pd.DataFrame):
+            symbol = kline['symbol'].iloc[0]
+            dt = pd.to_datetime(kline['dt']).values
+            self.kline_raw = ColumnStore.from_arrays(dt, {f: kline[f].values for f in fields},
+                                                     symbol=symbol, row_type=RawBar)
+        else:
+            self.kline_raw = ColumnStore.from_records(kline, fields, symbol=kline[0]['symbol'], row_type=RawBar)
+
+        capacity = len(self.kline_raw) * 3 // 2
+        self.kline_new = ColumnStore(fields, symbol=self.kline_raw.symbol, capacity=capacity, row_type=NewBar)
+        self.ma = ColumnStore(['ma%i' % p for p in self.ma_params], capacity=capacity)
+        self.macd = ColumnStore(('diff', 'dea', 'macd'), capacity=capacity)
+
+    @property
+    def kline_raw(self):
+        """原始K线序列；使用 DataFrame 初始化时，第一次读取才把每一行转换成 dict"""
+        if self._frame is not None:
+            self._kline_raw = frame_to_records(self._frame)
+            self._frame = None
+        return self._kline_raw
+
+    @kline_raw.setter
+    def kline_raw(self, value):
+        self._kline_raw = value
+        self._frame = None
+
+    def _raw_dt(self):
+        """获取 kline_raw 中全部K线的时间"""
+        if self._frame is not None:
+            return self._frame['dt'].tolist()
+        return [x['dt'] for x in self.kline_raw]
+
+    def _raw_values(self, key, count=None):
+        """获取 kline_raw 中最近 count 根K线某一列的 numpy 数组，count 为 None 时取全部；dt 列为 int64 纳秒时间戳"""
+        if self._frame is not None:
+            values = self._frame[key].values
+            if key == 'dt':
+                values = values.view(np.int64)
+            else:
+                values = values.astype(np.double, copy=False)
+            return values[-count:] if count else values
+        if isinstance(self.kline_raw, ColumnStore):
+            values = self.kline_raw.values(key)
+            return values[-count:] if count else values
+        bars = self.kline_raw[-count:] if count else self.kline_raw
+        if key == 'dt':
+            return np.array([to_ns(x['dt']) for x in bars], dtype=np.int64)
+        return np.array([x[key] for x in bars], dtype=np.double)
+
+    def _init_ta_state(self, close_):
+        """根据全部收盘价计算均线、MACD 序列，同时初始化流式计算状态
+
+        序列与状态使用同一组 EMA 递推（czsc.utils.ta），之后逐根更新的结果与用全部K线重新计算完全一致
+
+        :return: (dict, tuple)
+            {'ma5': np.array, ...}, (diff, dea, macd)
+        """
+        self._ta_closes = deque(close_[-(max(self.ma_params) + 1):].tolist(), maxlen=max(self.ma_params) + 1)
+        self._ma_sums = {p: float(close_[-p:].sum()) for p in self.ma_params}
+        ma = {'ma%i' % p: SMA(close_, p) for p in self.ma_params}
+
+        ema_fast = EMA(close_, timeperiod=12)
+        ema_slow = EMA(close_, timeperiod=26)
+        diff = ema_fast - ema_slow
+        dea = EMA(diff, timeperiod=9)
+        # 分别是倒数第二根、最后一根K线对应的 (ema_fast, ema_slow, dea)
+        self._macd_state = [(ema_fast[i], ema_slow[i], dea[i]) for i in (-2, -1)]
+        return ma, (diff, dea, (diff - dea) * MACD_FACTOR)
+
+    def _update_ta_state(self, is_new):
+        """用最后一根K线的收盘价更新流式计算状态，返回最新的 ma 与 macd
+
+        :param is_new: bool
+            最后一根K线是否是新K线，不是新K线时，回退掉被替换的K线对状态的影响后再更新
+        :return: (dict, dict)
+        """
+        close = self.kline_raw[-1]['close']
+        closes = self._ta_closes
+        if is_new:
+            closes.append(close)
             for p in self.ma_params:
-                ma_temp['ma%i' % p] = ta.SMA(close_, p)
-
-            for i in range(len(self.kline_raw)):
-                ma_ = {'ma%i' % p: ma_temp['ma%i' % p][i] for p in self.ma_params}
-                ma_.update({"dt": self.kline_raw[i]['dt']})
-                self.ma.append(ma_)
+                self._ma_sums[p] += close
+                if len(closes) > p:
+                    self._ma_sums[p] -= closes[-p - 1]
+            self._macd_state[0] = self._macd_state[1]
         else:
-            ma_ = {'ma%i' % p: sum([x['close'] for x in self.kline_raw[-p:]]) / p
-                   for p in self.ma_params}
-            ma_.update({"dt": self.kline_raw[-1]['dt']})
-            if self.verbose:
-                print("ma new: %s" % str(ma_))
+            for p in self.ma_params:
+                self._ma_sums[p] += close - closes[-1]
+            closes[-1] = close
 
-            if self.kline_raw[-2]['dt'] == self.ma[-1]['dt']:
-                self.ma.append(ma_)
-            else:
-                self.ma[-1] = ma_
+        ema_fast, ema_slow, dea = self._macd_state[0]
+        ema_fast = (2 * close + ema_fast * 11) / 13
+        ema_slow = (2 * close + ema_slow * 25) / 27
+        diff = ema_fast - ema_slow
+        dea = (2 * diff + dea * 8) / 10
+        self._macd_state[1] = (ema_fast, ema_slow, dea)
 
-        assert self.ma[-2]['dt'] == self.kline_raw[-2]['dt']
+        # K线数量不足 p 根时取全部K线的均值，与 SMA 一致
+        ma_ = {'ma%i' % p: self._ma_sums[p] / min(p, len(closes)) for p in self.ma_params}
+        macd_ = {"diff": diff, "dea": dea, "macd": (diff - dea) * MACD_FACTOR}
+        return ma_, macd_
+
+    def _update_ta(self):
+        """更新辅助技术指标
 
-        if not self.macd:
-            close_ = np.array([x["close"] for x in self.kline_raw], dtype=np.double)
+        首次计算使用全部K线；之后维护均线的滚动求和与 MACD 的 EMA 状态，每次更新的计算量与K线数量无关
+        """
+        if not self.ma:
             # m1 is diff; m2 is dea; m3 is macd
-            m1, m2, m3 = ta.MACD(close_, fastperiod=12, slowperiod=26, signalperiod=9)
-            for i in range(len(self.kline_raw)):
-                self.macd.append({
-                    "dt": self.kline_raw[i]['dt'],
-                    "diff": m1[i],
-                    "dea": m2[i],
-                    "macd": m3[i]
-                })
+            ma_temp, (m1, m2, m3) = self._init_ta_state(self._raw_values('close'))
+            if isinstance(self.ma, ColumnStore):
+                self.ma.extend_arrays(self.kline_raw.values('dt'), ma_temp)
+                self.macd.extend_arrays(self.kline_raw.values('dt'), {"diff": m1, "dea": m2, "macd": m3})
+            else:
+                dt = self._raw_dt()
+                keys = list(ma_temp.keys()) + ['dt']
+                self.ma = [dict(zip(keys, row)) for row in zip(*ma_temp.values(), dt)]
+                self.macd = [{"dt": x[0], "diff": x[1], "dea": x[2], "macd": x[3]} for x in zip(dt, m1, m2, m3)]
+            return
         else:
-            close_ = np.array([x["close"] for x in self.kline_raw[-200:]], dtype=np.double)
-            # m1 is diff; m2 is dea; m3 is macd
-            m1, m2, m3 = ta.MACD(close_, fastperiod=12, slowperiod=26, signalperiod=9)
-            macd_ = {
-                "dt": self.kline_raw[-1]['dt'],
-                "diff": m1[-1],
-                "dea": m2[-1],
-                "macd": m3[-1]
-            }
+            is_new = self.kline_raw[-2]['dt'] == self.ma[-1]['dt']
+            ma_, macd_ = self._update_ta_state(is_new)
+            ma_.update({"dt": self.kline_raw[-1]['dt']})
+            macd_.update({"dt": self.kline_raw[-1]['dt']})
             if self.verbose:
+                print("ma new: %s" % str(ma_))
                 print("macd new: %s" % str(macd_))
 
-            if self.kline_raw[-2]['dt'] == self.macd[-1]['dt']:
+            if is_new:
+                self.ma.append(ma_)
                 self.macd.append(macd_)
             else:
+                self.ma[-1] = ma_
                 self.macd[-1] = macd_
 
+        assert self.ma[-2]['dt'] == self.kline_raw[-2]['dt']
         assert self.macd[-2]['dt'] == self.kline_raw[-2]['dt']
 
+    def _init_power_index(self):
+        """初始化计算走势力度的前缀和索引，索引中的元素与 kline_raw 一一对应"""
+        columns = {"vol": self._raw_values('vol')}
+        if self.use_ta:
+            if isinstance(self.macd, ColumnStore):
+                macd = self.macd.values('macd')
+            else:
+                macd = np.array([x['macd'] for x in self.macd], dtype=np.double)
+            columns.update({
+                "macd_abs": np.abs(macd),
+                "macd_pos": np.where(macd > 0, macd, 0),
+                "macd_neg": np.where(macd < 0, -macd, 0),
+            })
+        self._power_index = PrefixSumIndex.from_arrays(self._raw_values('dt'), columns)
+
+    def _update_power_index(self, is_new):
+        """用最后一根K线更新前缀和索引"""
+        k = self.kline_raw[-1]
+        values = {"vol": k['vol']}
+        if self.use_ta:
+            macd = self.macd[-1]['macd']
+            values.update({
+                "macd_abs": abs(macd),
+                "macd_pos": macd if macd > 0 else 0,
+                "macd_neg": -macd if macd < 0 else 0,
+            })
+        if is_new:
+            self._power_index.append(k['dt'], values)
+        else:
+            self._power_index.replace_last(k['dt'], values)
+
+    def _init_structure(self):
+        """用 numba 内核批量识别无包含K线、分型、笔，结果与逐根K线识别完全一致"""
+        high, low = self._raw_values('high'), self._raw_values('low')
+        src, high_src, low_src, merged = remove_include(high, low)
+        kn_high, kn_low = high[high_src], low[low_src]
+
+        if isinstance(self._kline_raw, ColumnStore):
+            raw_dt = self.kline_raw.values('dt')
+            open_, close_ = self._raw_values('open'), self._raw_values('close')
+            down = open_[src] >= close_[src]
+            self.kline_new.extend_arrays(raw_dt[src], {
+                "open": np.where(merged, np.where(down, kn_high, kn_low), open_[src]),
+                "close": np.where(merged, np.where(down, kn_low, kn_high), close_[src]),
+                "high": kn_high,
+                "low": kn_low,
+                "vol": self._raw_values('vol')[src],
+            })
+            kn_dt = pd.to_datetime(raw_dt[src]).tolist()
+        else:
+            if self._frame is not None:
+                columns = [self._frame[c].take(src).tolist() for c in NewBar._fields]
+                bars = [NewBar(*row) for row in zip(*columns)]
+                raw_high, raw_low = high.tolist(), low.tolist()
+            else:
+                bars = [NewBar.from_bar(self.kline_raw[i]) for i in src.tolist()]
+                raw_high = [x['high'] for x in self.kline_raw]
+                raw_low = [x['low'] for x in self.kline_raw]
+            for k, hs, ls, is_merged in zip(bars, high_src.tolist(), low_src.tolist(), merged.tolist()):
+                if is_merged:
+                    k.high, k.low = raw_high[hs], raw_low[ls]
+                    # 保留红绿不变
+                    if k.open >= k.close:
+                        k.open, k.close = k.high, k.low
+                    else:
+                        k.open, k.close = k.low, k.high
+            self.kline_new.extend(bars)
+            kn_dt = [x.dt for x in bars]
+
+        pos, mark, gap = find_fx(kn_high, kn_low)
+        high_, low_ = kn_high.tolist(), kn_low.tolist()
+        for i, is_g, is_gap in zip(pos.tolist(), (mark == 1).tolist(), gap.tolist()):
+            self.fx_list.append(FX(
+                dt=kn_dt[i],
+                fx_mark="g" if is_g else "d",
+                fx=high_[i] if is_g else low_[i],
+                start_dt=kn_dt[i - 1],
+                end_dt=kn_dt[i + 1],
+                fx_high=high_[i] if is_g or is_gap else high_[i - 1],
+                fx_low=low_[i] if not is_g or is_gap else low_[i - 1],
+            ))
+
+        if self.bi_mode == 'new':
+            # 新笔要求分型之间有独立的原始K线
+            start_pos, end_pos = src[pos - 1], src[pos + 1]
+        elif self.bi_mode == 'old':
+            start_pos, end_pos = pos - 1, pos + 1
+        else:
+            raise ValueError
+        fx_ = np.where(mark == 1, kn_high[pos], kn_low[pos])
+        fx_high = np.where((mark == 1) | gap, kn_high[pos], kn_high[pos - 1])
+        fx_low = np.where((mark == -1) | gap, kn_low[pos], kn_low[pos - 1])
+        self.bi_list = [BI.from_fx(self.fx_list[i]) for i in find_bi(mark, fx_, fx_high, fx_low, start_pos, end_pos)]
+
     def _update_kline_new(self):
         """更新去除包含关系的K线序列"""
         if len(self.kline_new) < 4:
-            for x in self.kline_raw[:4]:
-                self.kline_new.append(dict(x))
-
-        # 新K线只会对最后一个去除包含关系K线的结果产生影响
-        self.kline_new = self.kline_new[:-2]
-        if len(self.kline_new) <= 4:
-            right_k = [x for x in self.kline_raw if x['dt'] > self.kline_new[-1]['dt']]
+            # 无包含K线不足4根时，从前两根原始K线开始重新识别
+            del self.kline_new[:len(self.kline_new)]
+            for x in self.kline_raw[:2]:
+                self.kline_new.append(NewBar.from_bar(x))
         else:
-            right_k = [x for x in self.kline_raw[-100:] if x['dt'] > self.kline_new[-1]['dt']]
+            # 新K线只会对最后一个去除包含关系K线的结果产生影响
+            del self.kline_new[-2:]
+        # 在此之前的无包含K线不会变化
+        self._kn_stable_dt = self.kline_new[-1].dt
+        right_k = get_tail(self.kline_raw, self.kline_new[-1].dt)
 
         if len(right_k) == 0:
             return
 
         for k in right_k:
-            k = dict(k)
+            k = NewBar.from_bar(k)
             last_kn = self.kline_new[-1]
-            if self.kline_new[-1]['high'] > self.kline_new[-2]['high']:
+            if self.kline_new[-1].high > self.kline_new[-2].high:
                 direction = "up"
             else:
                 direction = "down"
 
             # 判断是否存在包含关系
-            cur_h, cur_l = k['high'], k['low']
-            last_h, last_l = last_kn['high'], last_kn['low']
+            cur_h, cur_l = k.high, k.low
+            last_h, last_l = last_kn.high, last_kn.low
             if (cur_h <= last_h and cur_l >= last_l) or (cur_h >= last_h and cur_l <= last_l):
                 self.kline_new.pop(-1)
                 # 有包含关系，按方向分别处理
@@ -314,12 +730,12 @@ class KlineAnalyze:
                 else:
                     raise ValueError
 
-                k.update({"high": last_h, "low": last_l})
+                k.high, k.low = last_h, last_l
                 # 保留红绿不变
-                if k['open'] >= k['close']:
-                    k.update({"open": last_h, "close": last_l})
+                if k.open >= k.close:
+                    k.open, k.close = last_h, last_l
                 else:
-                    k.update({"open": last_l, "close": last_h})
+                    k.open, k.close = last_l, last_h
             self.kline_new.append(k)
 
     def _update_fx_list(self):
@@ -343,49 +759,57 @@ class KlineAnalyze:
           'fx_low': 141.6}
         """
         if len(self.kline_new) < 3:
+            self._mark_tail("fx_list", 0)
+            self.fx_list = []
             return
 
-        self.fx_list = self.fx_list[:-1]
+        # 最后一个分型，以及右侧K线发生了变化的分型，需要重新识别
+        keep = max(len(self.fx_list) - 1, 0)
+        while keep > 0 and self.fx_list[keep - 1].end_dt > self._kn_stable_dt:
+            keep -= 1
+        self._mark_tail("fx_list", keep)
+        del self.fx_list[keep:]
+
         if len(self.fx_list) == 0:
             kn = self.kline_new
         else:
-            kn = [x for x in self.kline_new[-100:] if x['dt'] >= self.fx_list[-1]['dt']]
+            kn = get_tail(self.kline_new, self.fx_list[-1].dt, include=True)
 
         i = 1
         while i <= len(kn) - 2:
             k1, k2, k3 = kn[i - 1: i + 2]
 
-            if k1['high'] < k2['high'] > k3['high']:
+            if k1.high < k2.high > k3.high:
                 if self.verbose:
-                    print("顶分型：{} - {} - {}".format(k1['dt'], k2['dt'], k3['dt']))
-                fx = {
-                    "dt": k2['dt'],
-                    "fx_mark": "g",
-                    "fx": k2['high'],
-                    "start_dt": k1['dt'],
-                    "end_dt": k3['dt'],
-                    "fx_high": k2['high'],
-                    "fx_low": k2['low'] if has_gap(k1, k2) else k1['low'],
-                }
+                    print("顶分型：{} - {} - {}".format(k1.dt, k2.dt, k3.dt))
+                fx = FX(
+                    dt=k2.dt,
+                    fx_mark="g",
+                    fx=k2.high,
+                    start_dt=k1.dt,
+                    end_dt=k3.dt,
+                    fx_high=k2.high,
+                    fx_low=k2.low if has_gap(k1, k2) else k1.low,
+                )
                 self.fx_list.append(fx)
 
-            elif k1['low'] > k2['low'] < k3['low']:
+            elif k1.low > k2.low < k3.low:
                 if self.verbose:
-                    print("底分型：{} - {} - {}".format(k1['dt'], k2['dt'], k3['dt']))
-                fx = {
-                    "dt": k2['dt'],
-                    "fx_mark": "d",
-                    "fx": k2['low'],
-                    "start_dt": k1['dt'],
-                    "end_dt": k3['dt'],
-                    "fx_high": k2['high'] if has_gap(k1, k2) else k1['high'],
-                    "fx_low": k2['low'],
-                }
+                    print("底分型：{} - {} - {}".format(k1.dt, k2.dt, k3.dt))
+                fx = FX(
+                    dt=k2.dt,
+                    fx_mark="d",
+                    fx=k2.low,
+                    start_dt=k1.dt,
+                    end_dt=k3.dt,
+                    fx_high=k2.high if has_gap(k1, k2) else k1.high,
+                    fx_low=k2.low,
+                )
                 self.fx_list.append(fx)
 
             else:
                 if self.verbose:
-                    print("无分型：{} - {} - {}".format(k1['dt'], k2['dt'], k3['dt']))
+                    print("无分型：{} - {} - {}".format(k1.dt, k2.dt, k3.dt))
             i += 1
 
     def _update_bi_list(self):
@@ -409,56 +833,63 @@ class KlineAnalyze:
           'bi': 150.67}
         """
         if len(self.fx_list) < 2:
+            self._mark_tail("bi_list", 0)
+            self.bi_list = []
             return
 
-        self.bi_list = self.bi_list[:-2]
-        if len(self.bi_list) == 0:
+        # 最后两个笔标记，以及由需要重新识别的分型得到的笔标记，都要重新计算
+        keep = max(len(self.bi_list) - 2, 0)
+        while keep > 0 and self.bi_list[keep - 1].end_dt > self._kn_stable_dt:
+            keep -= 1
+        if keep < 2:
+            keep = 0
+        # 保留的最后一个笔标记可能被移动，从它开始记录
+        self._mark_tail("bi_list", max(keep - 1, 0))
+        del self.bi_list[keep:]
+
+        if len(self.bi_list) < 2:
+            # 与从头识别一致，总是以前两个分型作为起点
             for fx in self.fx_list[:2]:
-                bi = dict(fx)
-                bi['bi'] = bi.pop('fx')
-                self.bi_list.append(bi)
-
-        if len(self.bi_list) <= 2:
-            right_fx = [x for x in self.fx_list if x['dt'] > self.bi_list[-1]['dt']]
-            if self.bi_mode == "old":
-                right_kn = [x for x in self.kline_new if x['dt'] >= self.bi_list[-1]['dt']]
-            elif self.bi_mode == 'new':
-                right_kn = [x for x in self.kline_raw if x['dt'] >= self.bi_list[-1]['dt']]
-            else:
-                raise ValueError
-        else:
-            right_fx = [x for x in self.fx_list[-50:] if x['dt'] > self.bi_list[-1]['dt']]
-            if self.bi_mode == "old":
-                right_kn = [x for x in self.kline_new[-300:] if x['dt'] >= self.bi_list[-1]['dt']]
-            elif self.bi_mode == 'new':
-                right_kn = [x for x in self.kline_raw[-300:] if x['dt'] >= self.bi_list[-1]['dt']]
-            else:
-                raise ValueError
+                self.bi_list.append(BI.from_fx(fx))
+
+        if self.bi_mode not in ['new', 'old']:
+            raise ValueError
+        right_fx = get_tail(self.fx_list, self.bi_list[-1].dt)
 
         for fx in right_fx:
             last_bi = self.bi_list[-1]
-            bi = dict(fx)
-            bi['bi'] = bi.pop('fx')
-            if last_bi['fx_mark'] == fx['fx_mark']:
-                if (last_bi['fx_mark'] == 'g' and last_bi['bi'] < bi['bi']) \
-                        or (last_bi['fx_mark'] == 'd' and last_bi['bi'] > bi['bi']):
+            bi = BI.from_fx(fx)
+            if last_bi.fx_mark == fx.fx_mark:
+                if (last_bi.fx_mark == 'g' and last_bi.bi < bi.bi) \
+                        or (last_bi.fx_mark == 'd' and last_bi.bi > bi.bi):
                     if self.verbose:
                         print("笔标记移动：from {} to {}".format(self.bi_list[-1], bi))
                     self.bi_list[-1] = bi
             else:
-                kn_inside = [x for x in right_kn if last_bi['end_dt'] < x['dt'] < bi['start_dt']]
-                if len(kn_inside) <= 0:
+                if not self._has_kline_between(last_bi.end_dt, bi.start_dt):
                     continue
 
                 # 确保相邻两个顶底之间不存在包含关系
-                if (last_bi['fx_mark'] == 'g' and bi['fx_low'] < last_bi['fx_low']
-                    and bi['fx_high'] < last_bi['fx_high']) or \
-                        (last_bi['fx_mark'] == 'd' and bi['fx_high'] > last_bi['fx_high']
-                         and bi['fx_low'] > last_bi['fx_low']):
+                if (last_bi.fx_mark == 'g' and bi.fx_low < last_bi.fx_low
+                    and bi.fx_high < last_bi.fx_high) or \
+                        (last_bi.fx_mark == 'd' and bi.fx_high > last_bi.fx_high
+                         and bi.fx_low > last_bi.fx_low):
                     if self.verbose:
                         print("新增笔标记：{}".format(bi))
                     self.bi_list.append(bi)
 
+    def _has_kline_between(self, start_dt, end_dt):
+        """判断 start_dt 与 end_dt 之间（不含两端）是否有K线；bi_mode 为 new 时看原始K线，为 old 时看无包含K线"""
+        if self.bi_mode == 'new':
+            return self._power_index.count_between(start_dt, end_dt) > 0
+
+        i = len(self.kline_new) - 1
+        while i >= 0 and self.kline_new[i].dt > start_dt:
+            if self.kline_new[i].dt < end_dt:
+                return True
+            i -= 1
+        return False
+
     def _update_xd_list(self):
         """更新线段序列
 
@@ -478,44 +909,249 @@ class KlineAnalyze:
           'fx_high': 142.38,
           'fx_low': 135.0,
           'xd': 135.0}
+
+        线段识别是增量进行的：除最后几笔外，笔标记已经确定，由它们得到的线段标记也不会再变化，
+        所以在这个位置保存一个检查点 (checkpoint)，下次更新时先恢复到检查点，再只对检查点之后的
+        笔标记重新识别，结果与用全部笔标记从头识别一致。
         """
         if len(self.bi_list) < 4:
+            self._mark_tail("xd_list", 0)
+            self.xd_list = []
+            self._xd_checkpoint = None
             return
 
-        self.xd_list = []
-        if len(self.xd_list) == 0:
+        if self._xd_checkpoint is None:
+            # 没有检查点，从头识别
+            self._mark_tail("xd_list", 0)
+            self.xd_list = []
             for i in range(3):
-                xd = dict(self.bi_list[i])
-                xd['xd'] = xd.pop('bi')
-                self.xd_list.append(xd)
+                self.xd_list.append(XD.from_bi(self.bi_list[i]))
+            start = 2
+            cp_dt = None
+        else:
+            # 恢复到检查点的状态
+            cp_dt, cp_xd = self._xd_checkpoint
+            keep = len(self.xd_list)
+            while keep > 0 and self.xd_list[keep - 1].dt >= cp_xd.dt:
+                keep -= 1
+            self._mark_tail("xd_list", keep)
+            del self.xd_list[keep:]
+            self.xd_list.append(cp_xd)
+
+            start = len(self.bi_list)
+            while start > 0 and self.bi_list[start - 1].dt > cp_dt:
+                start -= 1
+            # 判断潜在线段标记需要左侧相邻的同类笔标记
+            start = max(start - 2, 0)
+
+        right_bi = self.bi_list[start:]
+        xd_p = get_potential_xd(right_bi)
+        if cp_dt is not None:
+            xd_p = [x for x in xd_p if x.dt > cp_dt]
+        position = {id(x): start + i for i, x in enumerate(right_bi)}
 
-        right_bi = [x for x in self.bi_list if x['dt'] >= self.xd_list[-1]['dt']]
+        # 倒数第 8 笔之前的潜在线段标记不会再变化，作为新的检查点
+        new_cp_dt = None
+        if len(self.bi_list) >= 8 and (cp_dt is not None or len(self.bi_list) >= 11):
+            new_cp_dt = self.bi_list[-8].dt
+            if cp_dt is not None and new_cp_dt < cp_dt:
+                new_cp_dt = cp_dt
 
-        xd_p = get_potential_xd(right_bi)
         for xp in xd_p:
-            xd = dict(xp)
-            xd['xd'] = xd.pop('bi')
+            if new_cp_dt is not None and xp.dt > new_cp_dt:
+                self._xd_checkpoint = (new_cp_dt, self.xd_list[-1])
+                new_cp_dt = None
+
+            xd = XD.from_bi(xp)
             last_xd = self.xd_list[-1]
-            if last_xd['fx_mark'] == xd['fx_mark']:
-                if (last_xd['fx_mark'] == 'd' and last_xd['xd'] > xd['xd']) \
-                        or (last_xd['fx_mark'] == 'g' and last_xd['xd'] < xd['xd']):
+            if last_xd.fx_mark == xd.fx_mark:
+                if (last_xd.fx_mark == 'd' and last_xd.xd > xd.xd) \
+                        or (last_xd.fx_mark == 'g' and last_xd.xd < xd.xd):
                     if self.verbose:
                         print("更新线段标记：from {} to {}".format(last_xd, xd))
                     self.xd_list[-1] = xd
             else:
-                if (last_xd['fx_mark'] == 'd' and last_xd['xd'] > xd['xd']) \
-                        or (last_xd['fx_mark'] == 'g' and last_xd['xd'] < xd['xd']):
+                if (last_xd.fx_mark == 'd' and last_xd.xd > xd.xd) \
+                        or (last_xd.fx_mark == 'g' and last_xd.xd < xd.xd):
                     continue
 
-                bi_inside = [x for x in right_bi if last_xd['dt'] <= x['dt'] <= xd['dt']]
-                if len(bi_inside) < 4:
+                # 笔标记按时间排序，last_xd 到 xd 之间（含两端）至少有4个笔标记
+                i = position[id(xp)]
+                if i < 3 or self.bi_list[i - 3].dt < last_xd.dt:
                     if self.verbose:
-                        print("{} - {} 之间笔标记数量少于4，跳过".format(last_xd['dt'], xd['dt']))
+                        print("{} - {} 之间笔标记数量少于4，跳过".format(last_xd.dt, xd.dt))
                     continue
                 else:
                     self.xd_list.append(xd)
 
-    def update(self, k):
+        if new_cp_dt is not None:
+            self._xd_checkpoint = (new_cp_dt, self.xd_list[-1])
+
+    def _update_zs(self):
+        """用最新的笔标记、线段标记更新中枢"""
+        self.bi_zs.update(self.bi_list)
+        if self.use_xd:
+            self.xd_zs.update(self.xd_list)
+
+    def subscribe(self, callback, events=None):
+        """订阅结构变化事件
+
+        每次 update / update_many 之后，分型、笔、线段发生变化时依次调用 callback(ka, event, data)，
+        没有订阅者时不做任何额外计算。事件及 data 如下：
+
+            fx_removed    {"fx_list": 被撤销的分型}
+            fx_added      {"fx_list": 新增的分型}
+            bi_extended   {"old": 原来的最后一个笔标记, "new": 移动后的笔标记}
+            bi_removed    {"bi_list": 被撤销的笔标记}
+            bi_added      {"bi_list": 新增的笔标记}
+            bi_confirmed  {"start": 笔的起点, "end": 笔的终点}，新增笔标记后，前一笔不再延伸
+            xd_changed    {"removed": 被撤销的线段标记, "added": 新增的线段标记}
+
+        :param callback: callable
+            回调函数，参数为 (ka, event, data)
+        :param events: list of str
+            订阅的事件，默认订阅全部事件
+        :return: callback
+        """
+        self._subscribers.append((callback, None if events is None else frozenset(events)))
+        return callback
+
+    def unsubscribe(self, callback):
+        """取消订阅"""
+        self._subscribers = [x for x in self._subscribers if x[0] is not callback]
+
+    def _mark_tail(self, key, start):
+        """改动序列之前调用，记录下标 start 之后的元素，之后对该序列的改动都在 start 之后
+
+        只复制被改动的尾部，单次更新的开销与序列长度无关
+        """
+        self._tails[key] = (start, getattr(self, key)[start:])
+
+    @staticmethod
+    def _diff_tail(old, new):
+        """比较更新前后的序列，序列只会在尾部发生变化，返回 (被撤销的元素, 新增的元素)"""
+        i = min(len(old), len(new))
+        while i > 0 and not (old[i - 1] is new[i - 1] or old[i - 1] == new[i - 1]):
+            i -= 1
+        return old[i:], new[i:]
+
+    def _update_versions(self):
+        """根据 _mark_tail 记录的尾部更新结构版本号，返回分型、笔、线段序列的变化 [(被撤销的元素, 新增的元素), ...]"""
+        self.versions['kline_new'] += 1
+        diffs = []
+        for key in ("fx_list", "bi_list", "xd_list"):
+            seq = getattr(self, key)
+            start, old = self._tails.get(key, (len(seq), []))
+            removed, added = self._diff_tail(old, seq[start:])
+            if removed or added:
+                self.versions[key] += 1
+            diffs.append((removed, added))
+        return diffs
+
+    def _diff_events(self, diffs):
+        """根据分型、笔、线段序列的变化，得到结构变化事件列表 [(event, data), ...]"""
+        events = []
+        (fx_removed, fx_added), (bi_removed, bi_added), (xd_removed, xd_added) = diffs
+
+        removed, added = fx_removed, fx_added
+        if removed:
+            events.append(("fx_removed", {"fx_list": removed}))
+        if added:
+            events.append(("fx_added", {"fx_list": added}))
+
+        removed, added = bi_removed, bi_added
+        if removed and added and removed[0].fx_mark == added[0].fx_mark:
+            events.append(("bi_extended", {"old": removed[0], "new": added[0]}))
+            removed, added = removed[1:], added[1:]
+        if removed:
+            events.append(("bi_removed", {"bi_list": removed}))
+        if added:
+            events.append(("bi_added", {"bi_list": added}))
+            n = len(self.bi_list)
+            for i in range(max(n - len(added), 2), n):
+                events.append(("bi_confirmed", {"start": self.bi_list[i - 2], "end": self.bi_list[i - 1]}))
+
+        if xd_removed or xd_added:
+            events.append(("xd_changed", {"removed": xd_removed, "added": xd_added}))
+        return events
+
+    def _emit(self, events):
+        """把结构变化事件发送给订阅者"""
+        for event, data in events:
+            for callback, names in self._subscribers:
+                if names is None or event in names:
+                    callback(self, event, data)
+
+    def _trim_history(self, keep):
+        """淘汰超出 max_count 的历史数据，只保留最近的 keep 根原始K线
+
+        每次淘汰都多淘汰 max_count // 10 根K线，之后要再经过这么多次更新才会触发下一次淘汰；
+        头部删除的开销均摊到每次更新上是常数，单次更新的耗时不随 max_count 增大。
+        各序列都按时间淘汰，结果与淘汰的时机无关。
+        """
+        if len(self.kline_raw) <= keep:
+            return
+        # 被淘汰的最后一根K线的时间，各序列都删除 dt <= last_dt 的元素，与 kline_raw 保持同一个边界
+        last_dt = self.kline_raw[-keep - 1]['dt']
+        self._power_index.drop_head(len(self.kline_raw) - keep)
+        del self.kline_raw[:-keep]
+        trim_head(self.kline_new, last_dt)
+        trim_head(self.ma, last_dt)
+        trim_head(self.macd, last_dt)
+        trim_head(self.fx_list, last_dt)
+        trim_head(self.bi_list, last_dt)
+        if self.use_xd:
+            trim_head(self.xd_list, last_dt)
+        self.bi_zs.trim(last_dt)
+        self.xd_zs.trim(last_dt)
+        for key in self.versions:
+            self.versions[key] += 1
+
+    def _update_structure(self, timer=None):
+        """识别无包含K线、分型、笔、线段以及中枢，返回结构变化事件"""
+        self._tails = {}
+        self._update_kline_new()
+        if timer is not None:
+            timer.lap('kline_new')
+        self._update_fx_list()
+        if timer is not None:
+            timer.lap('fx')
+        self._update_bi_list()
+        if timer is not None:
+            timer.lap('bi')
+
+        if self.use_xd:
+            self._update_xd_list()
+            if timer is not None:
+                timer.lap('xd')
+        self._update_zs()
+        if timer is not None:
+            timer.lap('zs')
+        diffs = self._update_versions()
+        events = self._diff_events(diffs) if self._subscribers else []
+        if timer is not None:
+            timer.lap('events')
+        return events
+
+    def enable_timer(self, sink=None):
+        """开启分阶段耗时统计
+
+        开启后 update / update_many 按阶段（kline_raw、ta、power_index、kline_new、fx、bi、xd、zs、
+        events、trim、emit）以及总耗时（total）统计调用次数、累计耗时和 p50/p99，结果见 timer.summary()；
+        没有开启时只有几次 None 判断的开销。
+
+        :param sink: callable
+            每次更新结束后调用 sink(name, timings)，timings 为本次各阶段的耗时（秒）
+        :return: StageTimer
+        """
+        self.timer = StageTimer(sink)
+        return self.timer
+
+    def disable_timer(self):
+        """关闭分阶段耗时统计"""
+        self.timer = None
+
+    def update(self, k, is_new=None):
         """更新分析结果
 
         :param k: dict
@@ -527,90 +1163,235 @@ class KlineAnalyze:
              'high': 3373.53,
              'low': 3209.76,
              'vol': 486366915.0}
+        :param is_new: bool
+            k 是否是一根新K线，False 表示替换最后一根未完成的K线；默认为 None，开盘价与最后一根K线不同时视为新K线
         """
+        timer = self.timer
+        if timer is not None:
+            timer.start()
         if self.verbose:
             print("=" * 100)
             print("输入新K线：{}".format(k))
-        if not self.kline_raw or k['open'] != self.kline_raw[-1]['open']:
+        if is_new is None:
+            is_new = not self.kline_raw or k['open'] != self.kline_raw[-1]['open']
+        else:
+            is_new = is_new or not self.kline_raw
+        if is_new:
             self.kline_raw.append(k)
         else:
             if self.verbose:
                 print("输入K线处于未完成状态，更新：replace {} with {}".format(self.kline_raw[-1], k))
             self.kline_raw[-1] = k
+        if timer is not None:
+            timer.lap('kline_raw')
 
         if self.use_ta:
             self._update_ta()
+            if timer is not None:
+                timer.lap('ta')
+        self._update_power_index(is_new)
+        if timer is not None:
+            timer.lap('power_index')
 
-        self._update_kline_new()
-        self._update_fx_list()
-        self._update_bi_list()
-
-        if self.use_xd:
-            self._update_xd_list()
-
+        events = self._update_structure(timer)
         self.end_dt = self.kline_raw[-1]['dt']
         self.latest_price = self.kline_raw[-1]['close']
 
         if len(self.kline_raw) > self.max_count:
-            last_dt = self.kline_raw[-self.max_count:][0]['dt']
-            self.kline_raw = self.kline_raw[-self.max_count:]
-            self.kline_new = self.kline_new[-self.max_count:]
-            self.ma = [x for x in self.ma if x['dt'] > last_dt]
-            self.macd = [x for x in self.macd if x['dt'] > last_dt]
-            self.fx_list = [x for x in self.fx_list if x['dt'] > last_dt]
-            self.bi_list = [x for x in self.bi_list if x['dt'] > last_dt]
-            if self.use_xd:
-                self.xd_list = [x for x in self.xd_list if x['dt'] > last_dt]
+            self._trim_history(self.max_count - self.max_count // 10)
+            if timer is not None:
+                timer.lap('trim')
+        self._emit(events)
+        if timer is not None:
+            timer.lap('emit')
+            timer.stop(self.name)
 
         if self.verbose:
             print("更新结束\n\n")
 
+    def update_many(self, bars, is_new=None):
+        """批量更新分析结果，结果与逐根调用 update 完全一致
+
+        原始K线、技术指标逐根更新，无包含K线、分型、笔、线段只在最后统一识别一次，
+        历史数据的淘汰也只在最后执行一次；适合回放历史数据或者一次性补齐多根K线。
+
+        :param bars: list of dict or pd.DataFrame
+            按时间升序排列的K线，K线格式与 update 相同
+        :param is_new: list of bool
+            每根K线是否是新K线，含义与 update 的 is_new 相同；默认为 None，按开盘价判断
+        """
+        if isinstance(bars, pd.DataFrame):
+            bars = bars.to_dict("records")
+        if len(bars) == 0:
+            return
+
+        timer = self.timer
+        if timer is not None:
+            timer.start()
+        # 模拟逐根更新时的淘汰过程，得到最后一次淘汰后保留的K线数量
+        keep = self.max_count - self.max_count // 10
+        length = len(self.kline_raw)
+        trimmed = False
+        for i, k in enumerate(bars):
+            if is_new is None:
+                new = not self.kline_raw or k['open'] != self.kline_raw[-1]['open']
+            else:
+                new = is_new[i] or not self.kline_raw
+            if new:
+                self.kline_raw.append(k)
+                length += 1
+                if length > self.max_count:
+                    length = keep
+                    trimmed = True
+            else:
+                self.kline_raw[-1] = k
+            if timer is not None:
+                timer.lap('kline_raw')
+
+            if self.use_ta:
+                self._update_ta()
+                if timer is not None:
+                    timer.lap('ta')
+            self._update_power_index(new)
+            if timer is not None:
+                timer.lap('power_index')
+
+        events = self._update_structure(timer)
+        self.end_dt = self.kline_raw[-1]['dt']
+        self.latest_price = self.kline_raw[-1]['close']
+
+        if trimmed:
+            self._trim_history(length)
+            if timer is not None:
+                timer.lap('trim')
+        self._emit(events)
+        if timer is not None:
+            timer.lap('emit')
+            timer.stop(self.name)
+
+    def save_state(self, file_state):
+        """把分析结果、技术指标的计算状态、参数保存成二进制文件，用于重启后快速恢复
+
+        文件由文件头、格式版本号以及 pickle 数据组成；K线、分型、笔、线段等序列按列打包保存。
+
+        :param file_state: str
+            状态文件路径
+        """
+        state = dict(self.__dict__)
+        state.pop('_subscribers', None)
+        state.pop('_tails', None)
+        state['timer'] = None
+        records = {}
+        for key in ('_kline_raw', 'kline_new', 'ma', 'macd', 'fx_list', 'bi_list', 'xd_list'):
+            if isinstance(state[key], list):
+                records[key] = pack_records(state.pop(key))
+        data = {"class": self.__class__.__name__, "state": state, "records": records}
+        with open(file_state, "wb") as f:
+            f.write(STATE_MAGIC + struct.pack("<I", STATE_VERSION))
+            pickle.dump(data, f, protocol=4)
+
+    @classmethod
+    def load_state(cls, file_state):
+        """从 save_state 保存的文件恢复分析对象，恢复后可以继续调用 update
+
+        状态文件中只能出现 czsc、numpy、pandas 中的数据类型以及少数内置类型，引用其他函数、类时
+        抛出 pickle.UnpicklingError；即便如此，也只应加载自己保存或者来源可信的状态文件。
+
+        :param file_state: str
+            状态文件路径
+        :return: KlineAnalyze
+        """
+        with open(file_state, "rb") as f:
+            head = f.read(len(STATE_MAGIC) + 4)
+            if head[:len(STATE_MAGIC)] != STATE_MAGIC:
+                raise ValueError("{} 不是 KlineAnalyze 状态文件".format(file_state))
+            version = struct.unpack("<I", head[len(STATE_MAGIC):])[0]
+            if version != STATE_VERSION:
+                raise ValueError("状态文件版本为 {}，当前只支持版本 {}".format(version, STATE_VERSION))
+            data = _StateUnpickler(f).load()
+
+        if data['class'] != cls.__name__:
+            raise ValueError("状态文件保存的是 {} 对象，不能恢复为 {}".format(data['class'], cls.__name__))
+        ka = cls.__new__(cls)
+        ka.__dict__.update(data['state'])
+        ka._subscribers = []
+        ka.timer = None
+        if 'versions' not in ka.__dict__:
+            ka.versions = {"kline_new": 0, "fx_list": 0, "bi_list": 0, "xd_list": 0}
+        dt_cache = {}
+        for key, packed in data['records'].items():
+            ka.__dict__[key] = unpack_records(packed, dt_cache)
+        return ka
+
+    def _bar_columns(self, mode, max_count):
+        """获取最近 max_count 根K线各列的数组，dt 列为 int64 纳秒时间戳"""
+        fields = ('dt', 'open', 'close', 'high', 'low', 'vol')
+        if mode == "raw":
+            return {f: self._raw_values(f, max_count) for f in fields}
+        if isinstance(self.kline_new, ColumnStore):
+            return {f: self.kline_new.values(f)[-max_count:] for f in fields}
+        bars = self.kline_new[-max_count:]
+        columns = {f: np.array([x[f] for x in bars], dtype=np.double) for f in fields[1:]}
+        columns['dt'] = np.array([to_ns(x['dt']) for x in bars], dtype=np.int64)
+        return {f: columns[f] for f in fields}
+
+    @staticmethod
+    def _align_points(points, key, dt):
+        """把标记点按时间对齐到K线上，返回与 dt 等长的数组，没有对应标记点的K线为空值
+
+        :param points: list
+            分型、笔或线段标记点
+        :param key: str
+            要取的字段
+        :param dt: np.array
+            按时间升序排列的K线时间，int64 纳秒时间戳
+        :return: np.array
+        """
+        values = np.full(len(dt), np.nan) if key != 'fx_mark' else np.full(len(dt), "o", dtype=object)
+        if len(dt) == 0:
+            return values
+        points = get_tail(points, pd.Timestamp(int(dt[0])), include=True)
+        if not points:
+            return values
+        points_dt = np.array([to_ns(x['dt']) for x in points], dtype=np.int64)
+        pos = np.searchsorted(dt, points_dt).clip(max=len(dt) - 1)
+        ok = dt[pos] == points_dt
+        values[pos[ok]] = np.array([x[key] for x in points], dtype=values.dtype)[ok]
+        return values
+
     def to_df(self, ma_params=(5, 20), use_macd=False, max_count=1000, mode="raw"):
         """整理成 df 输出
 
+        按列构造 DataFrame，分型、笔、线段标记按时间对齐到K线上，不会修改 kline_raw 等分析结果
+
         :param ma_params: tuple of int
             均线系统参数
         :param use_macd: bool
         :param max_count: int
+            最多输出的K线数量
         :param mode: str
             使用K线类型， raw = 原始K线，new = 去除包含关系的K线
         :return: pd.DataFrame
         """
-        if mode == "raw":
-            bars = self.kline_raw[-max_count:]
-        elif mode == "new":
-            bars = self.kline_raw[-max_count:]
-        else:
-            raise ValueError
-
-        fx_list = {x["dt"]: {"fx_mark": x["fx_mark"], "fx": x['fx']} for x in self.fx_list[-(max_count // 2):]}
-        bi_list = {x["dt"]: {"fx_mark": x["fx_mark"], "bi": x['bi']} for x in self.bi_list[-(max_count // 4):]}
-        xd_list = {x["dt"]: {"fx_mark": x["fx_mark"], "xd": x['xd']} for x in self.xd_list[-(max_count // 8):]}
-        results = []
-        for k in bars:
-            k['fx_mark'], k['fx'], k['bi'], k['xd'] = "o", None, None, None
-            fx_ = fx_list.get(k['dt'], None)
-            bi_ = bi_list.get(k['dt'], None)
-            xd_ = xd_list.get(k['dt'], None)
-            if fx_:
-                k['fx_mark'] = fx_["fx_mark"]
-                k['fx'] = fx_["fx"]
-
-            if bi_:
-                k['bi'] = bi_["bi"]
-
-            if xd_:
-                k['xd'] = xd_["xd"]
-
-            results.append(k)
-        df = pd.DataFrame(results)
+        if mode not in ("raw", "new"):
+            raise ValueError("mode 必须是 raw 或 new")
+
+        columns = self._bar_columns(mode, max_count)
+        dt = columns['dt']
+        df = pd.DataFrame({"symbol": self.symbol, "dt": pd.to_datetime(dt)})
+        for f in ('open', 'close', 'high', 'low', 'vol'):
+            df[f] = columns[f]
+        df['fx_mark'] = self._align_points(self.fx_list, 'fx_mark', dt)
+        df['fx'] = self._align_points(self.fx_list, 'fx', dt)
+        df['bi'] = self._align_points(self.bi_list, 'bi', dt)
+        df['xd'] = self._align_points(self.xd_list, 'xd', dt)
+
+        close_ = columns['close'].astype(np.double)
         for p in ma_params:
-            df.loc[:, "ma{}".format(p)] = ta.SMA(df.close.values, p)
+            df["ma{}".format(p)] = ta.SMA(close_, p)
         if use_macd:
-            diff, dea, macd = ta.MACD(df.close.values)
-            df.loc[:, "diff"] = diff
-            df.loc[:, "dea"] = diff
-            df.loc[:, "macd"] = diff
+            diff, dea, macd = ta.MACD(close_)
+            df["diff"], df["dea"], df["macd"] = diff, dea, macd
         return df
 
     def to_image(self, file_image, mav=(5, 20, 120, 250), max_k_count=1000, dpi=50):
@@ -646,15 +1427,13 @@ class KlineAnalyze:
             warnings.warn("没有进行辅助技术指标的计算，macd_power 返回 0")
             return 0
 
-        fd_macd = [x for x in self.macd if end_dt >= x['dt'] >= start_dt]
-
         if mode == 'bi':
-            power = sum([abs(x['macd']) for x in fd_macd])
+            power = self._power_index.sum("macd_abs", start_dt, end_dt)
         elif mode == 'xd':
             if direction == 'up':
-                power = sum([abs(x['macd']) for x in fd_macd if x['macd'] > 0])
+                power = self._power_index.sum("macd_pos", start_dt, end_dt)
             elif direction == 'down':
-                power = sum([abs(x['macd']) for x in fd_macd if x['macd'] < 0])
+                power = self._power_index.sum("macd_neg", start_dt, end_dt)
             else:
                 raise ValueError
         else:
@@ -671,8 +1450,7 @@ class KlineAnalyze:
         :return: float
             走势力度
         """
-        fd_vol = [x for x in self.kline_raw if end_dt >= x['dt'] >= start_dt]
-        power = sum([x['vol'] for x in fd_vol])
+        power = self._power_index.sum("vol", start_dt, end_dt)
         return int(power)
 
     def get_bi_fd(self, n=6):
@@ -698,24 +1476,23 @@ class KlineAnalyze:
         """
         points = self.bi_list[-(n + 1):]
         assert len(points) == n + 1
+        bi = [p['bi'] for p in points]
+        dt = [p['dt'] for p in points]
 
         res = []
         for i in range(len(points) - 1):
-            p1 = points[i]
-            p2 = points[i + 1]
-            direction = "up" if p1["bi"] < p2["bi"] else "down"
-            # macd_power = self.calculate_macd_power(start_dt=p1['dt'], end_dt=p2['dt'], mode="bi", direction=direction)
-            vol_power = self.calculate_vol_power(start_dt=p1['dt'], end_dt=p2['dt'])
+            b1, b2 = bi[i], bi[i + 1]
+            # macd_power = self.calculate_macd_power(start_dt=dt[i], end_dt=dt[i + 1], mode="bi", direction=direction)
             res.append({
-                "start_dt": p1['dt'],
-                "end_dt": p2['dt'],
-                "start_mark": p1,
-                "end_mark": p2,
-                "price_power": abs(p1['bi'] - p2['bi']),
-                "vol_power": vol_power,
-                "direction": direction,
-                "high": max(p1["bi"], p2["bi"]),
-                "low": min(p1["bi"], p2["bi"]),
+                "start_dt": dt[i],
+                "end_dt": dt[i + 1],
+                "start_mark": points[i],
+                "end_mark": points[i + 1],
+                "price_power": abs(b1 - b2),
+                "vol_power": self.calculate_vol_power(start_dt=dt[i], end_dt=dt[i + 1]),
+                "direction": "up" if b1 < b2 else "down",
+                "high": max(b1, b2),
+                "low": min(b1, b2),
                 "mode": "bi"
             })
         return res
@@ -167,7 +167,7 @@ def get_all_securities(code, date=None) -> pd.DataFrame:
     r = requests.post(url, data=json.dumps(data))
     return text2df(r.text)
 
-def get_kline(symbol,  end_date, freq, start_date=None, count=None):
+def get_kline(symbol,  end_date, freq, start_date=None, count=None, token=None, timeout=None):
     """获取K线数据
 
     :param symbol: str
@@ -180,6 +180,10 @@ def get_kline(symbol,  end_date, freq, start_date=None, count=None):
         K线级别，可选值 ['1min', '5min', '30min', '60min', 'D', 'W', 'M']
     :param count: int
         K线数量，最大值为 5000
+    :param token: str
+        调用凭证，为 None 时调用 get_token 获取；连续获取多个级别时可以共用一个凭证
+    :param timeout: float
+        请求的超时时间（秒），为 None 时不限制
     :return: pd.DataFrame
 
     >>> start_date = datetime.strptime("20200701", "%Y%m%d")
@@ -196,11 +200,12 @@ def get_kline(symbol,  end_date, freq, start_date=None, count=None):
     freq_convert = {"1min": "1m", "5min": '5m', '15min': '15m',
                     "30min": "30m", "60min": '60m', "D": "1d", "W": '1w', "M": "1M"}
     end_date = pd.to_datetime(end_date)
+    token = token or get_token()
     if start_date:
         start_date = pd.to_datetime(start_date)
         data = {
             "method": "get_price_period",
-            "token": get_token(),
+            "token": token,
             "code": symbol,
             "unit": freq_convert[freq],
             "date": start_date.strftime("%Y-%m-%d"),
@@ -210,7 +215,7 @@ def get_kline(symbol,  end_date, freq, start_date=None, count=None):
     elif count:
         data = {
             "method": "get_price",
-            "token": get_token(),
+            "token": token,
             "code": symbol,
             "count": count,
             "unit": freq_convert[freq],
@@ -220,7 +225,7 @@ def get_kline(symbol,  end_date, freq, start_date=None, count=None):
     else:
         raise ValueError("start_date 和 count 不能同时为空")
 
-    r = requests.post(url, data=json.dumps(data))
+    r = requests.post(url, data=json.dumps(data), timeout=timeout)
     df = text2df(r.text)
     df['symbol'] = symbol
     df.rename({'date': 'dt', 'volume': 'vol'}, axis=1, inplace=True)
@@ -0,0 +1,297 @@
+# coding: utf-8
+"""
+
+多级别联立分析
+
+MultiLevelAnalyze 持有一个 KlineGeneratorBy1Min 以及每个级别一个分析对象。每输入一根1分钟K线，
+K线生成器更新各级别的最后一根K线，然后直接把这根K线交给对应级别的分析对象，
+不需要通过 get_klines 复制K线，也不需要重新初始化分析对象。
+
+replay_signals 在此基础上对历史1分钟K线做逐根回放，按列收集每根K线结束时的全部信号。
+"""
+import warnings
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+
+from .analyze import KlineAnalyze
+from .signals import KlineSignals
+from .utils.kline_generator import KlineGeneratorBy1Min
+from .utils.store import save_frame
+
+# 创建分析对象所需的最少K线数量
+MIN_COUNT = 3
+
+# K线生成器中各级别K线序列的属性名
+FREQ_ATTRS = {"1分钟": "m1", "5分钟": "m5", "15分钟": "m15", "30分钟": "m30",
+              "60分钟": "m60", "日线": "D", "周线": "W"}
+
+
+class MultiLevelAnalyze:
+    """多级别联立分析：一根1分钟K线同时更新全部级别"""
+
+    def __init__(self, bars, freqs=None, max_count=1000, ka_cls=KlineAnalyze, **kwargs):
+        """
+
+        :param bars: list of dict or pd.DataFrame
+            用于初始化的1分钟K线，按时间升序排列
+        :param freqs: list of str
+            级别列表，默认值为 ['1分钟', '5分钟', '30分钟', '日线']
+        :param max_count: int
+            每个级别的分析对象保留的最大K线数量，也是K线生成器每个级别保留的最大K线数量；
+            K线数量少于 MIN_COUNT 的级别，等K线足够之后再创建分析对象
+        :param ka_cls: type
+            各级别使用的分析类，如 KlineAnalyze、KlineSignals
+        :param kwargs: dict
+            其他传给 ka_cls 的参数，如 use_xd、bi_mode
+        """
+        if freqs is None:
+            freqs = ['1分钟', '5分钟', '30分钟', '日线']
+        unknown = [x for x in freqs if x not in FREQ_ATTRS]
+        if unknown:
+            raise ValueError("不支持的级别：{}".format(unknown))
+        if isinstance(bars, pd.DataFrame):
+            bars = bars.to_dict("records")
+        if len(bars) == 0:
+            raise ValueError("初始化至少需要一根1分钟K线")
+
+        self.freqs = list(freqs)
+        self.max_count = max_count
+        self.kg = KlineGeneratorBy1Min(max_count=max_count, freqs=self.freqs)
+        for k in bars:
+            self.kg.update(k)
+
+        self.ka_cls = ka_cls
+        self.kwargs = kwargs
+        self.kas = dict()
+        for freq in self.freqs:
+            self._create(freq)
+        self.symbol = self.kg.symbol
+        self.end_dt = self.kg.end_dt
+
+    @classmethod
+    def from_kas(cls, kas, max_count=1000):
+        """用已经创建好的各级别分析对象创建，如分别获取各级别K线创建的分析对象；
+        K线生成器用各分析对象中的K线初始化，之后的更新与直接创建的对象相同
+
+        :param kas: dict
+            {级别: 分析对象}，分析对象的K线需要截止到同一时间
+        :param max_count: int
+            K线生成器每个级别保留的最大K线数量
+        :return: MultiLevelAnalyze
+        """
+        unknown = [x for x in kas if x not in FREQ_ATTRS]
+        if unknown:
+            raise ValueError("不支持的级别：{}".format(unknown))
+        mla = cls.__new__(cls)
+        mla.freqs = list(kas)
+        mla.max_count = max_count
+        mla.kg = KlineGeneratorBy1Min(max_count=max_count, freqs=mla.freqs)
+        for freq, ka in kas.items():
+            mla.kg.init_kline(freq, [dict(x) for x in ka.kline_raw])
+        mla.ka_cls = type(next(iter(kas.values())))
+        mla.kwargs = dict()
+        mla.kas = dict(kas)
+        mla.symbol = mla.kg.symbol
+        mla.end_dt = mla.kg.end_dt
+        return mla
+
+    def __repr__(self):
+        return "<MultiLevelAnalyze for {}; freqs={}; latest_dt={}>".format(self.symbol, self.freqs, self.end_dt)
+
+    def _bars(self, freq):
+        return getattr(self.kg, FREQ_ATTRS[freq])
+
+    def _create(self, freq):
+        """级别的K线数量达到 MIN_COUNT 之后，用K线生成器中的K线创建分析对象"""
+        bars = self._bars(freq)
+        if len(bars) >= MIN_COUNT:
+            self.kas[freq] = self.ka_cls(bars, name=freq, max_count=self.max_count, **self.kwargs)
+
+    def _step(self, k):
+        """用一根1分钟K线更新K线生成器，返回每个级别的 (最后一根K线, 是否是新K线)；K线被忽略时返回 None"""
+        if self.kg.end_dt is not None and k['dt'] < self.kg.end_dt:
+            warnings.warn("输入1分钟K时间小于最近一个更新时间，{} < {}，不进行K线更新".format(k['dt'], self.kg.end_dt))
+            return None
+
+        last = {freq: self._bars(freq)[-1] if self._bars(freq) else None for freq in self.freqs}
+        self.kg.update(k)
+        res = dict()
+        for freq in self.freqs:
+            bars = self._bars(freq)
+            # 最后一根K线之前的K线是原来的最后一根，说明生成了新K线；否则是替换了最后一根K线
+            is_new = last[freq] is None or (len(bars) > 1 and bars[-2] is last[freq])
+            res[freq] = (bars[-1], is_new)
+        self.end_dt = self.kg.end_dt
+        return res
+
+    def update(self, k):
+        """输入一根1分钟K线，更新K线生成器以及全部级别的分析结果
+
+        :param k: dict
+            1分钟K线，格式与 KlineGeneratorBy1Min.update 相同
+        """
+        res = self._step(k)
+        if res is None:
+            return
+        for freq, (bar, is_new) in res.items():
+            if freq in self.kas:
+                self.kas[freq].update(bar, is_new=is_new)
+            else:
+                self._create(freq)
+
+    def update_many(self, bars):
+        """批量输入1分钟K线，结果与逐根调用 update 一致
+
+        K线生成器逐根更新，每个级别的K线变化收集起来之后，调用一次分析对象的 update_many；
+        还没有分析对象的级别，最后用K线生成器中的K线创建
+
+        :param bars: list of dict or pd.DataFrame
+            按时间升序排列的1分钟K线
+        """
+        if isinstance(bars, pd.DataFrame):
+            bars = bars.to_dict("records")
+        changes = {freq: ([], []) for freq in self.kas}
+        for k in bars:
+            res = self._step(k)
+            if res is None:
+                continue
+            for freq, (freq_bars, is_new) in changes.items():
+                bar, new = res[freq]
+                freq_bars.append(bar)
+                is_new.append(new)
+        for freq, (freq_bars, is_new) in changes.items():
+            if freq_bars:
+                self.kas[freq].update_many(freq_bars, is_new=is_new)
+        for freq in self.freqs:
+            if freq not in self.kas:
+                self._create(freq)
+
+    def get_signals(self):
+        """合并全部级别的信号，需要各级别的分析类实现 get_signals"""
+        signals = {"symbol": self.symbol}
+        for ka in self.kas.values():
+            signals.update(ka.get_signals())
+        return signals
+
+    def get_signal_vectors(self):
+        """各级别信号的数值形式 {级别: np.void}，需要各级别的分析类实现 get_signal_vector"""
+        return {freq: ka.get_signal_vector() for freq, ka in self.kas.items()}
+
+
+def _iter_records(bars, symbol=None):
+    """把1分钟K线逐根转换成 dict，避免 DataFrame.iterrows 以及一次性创建全部 dict
+
+    :param bars: pd.DataFrame or dict of np.array or list of dict
+        DataFrame 与 dict 需要包含 dt/open/close/high/low/vol 列，symbol 列可选
+    :param symbol: str
+        bars 中没有 symbol 列时使用的标的代码
+    """
+    if isinstance(bars, (list, tuple)):
+        yield from bars
+        return
+
+    dt = pd.DatetimeIndex(pd.to_datetime(bars['dt']))
+    columns = [np.asarray(bars[f], dtype=np.float64).tolist() for f in ('open', 'close', 'high', 'low', 'vol')]
+    if 'symbol' in bars:
+        symbols = list(bars['symbol'])
+    else:
+        symbols = [symbol] * len(dt)
+    # 分块创建 Timestamp，一年的1分钟K线也只占用少量内存
+    chunk = 10000
+    for i in range(0, len(dt), chunk):
+        for row in zip(symbols[i: i + chunk], dt[i: i + chunk], *[c[i: i + chunk] for c in columns]):
+            yield dict(zip(('symbol', 'dt', 'open', 'close', 'high', 'low', 'vol'), row))
+
+
+def replay_signals(bars, freqs=None, init_count=1000, start_dt=None, max_count=1000,
+                   symbol=None, file_output=None, **kwargs):
+    """历史回放：逐根输入1分钟K线，记录每根K线结束时全部级别的信号
+
+    K线生成器、各级别 KlineSignals 都是增量更新，不会重新初始化；start_dt 之前的K线用 update_many 批量输入，
+    不计算信号。每根K线只记录各级别信号的编码值，最后按列还原成 DataFrame，字符串信号为 category 类型以减少内存占用。
+
+    耗时：4个级别时每根1分钟K线约 0.4 毫秒，与 max_count 基本无关（benchmarks/bench_suite.py --only replay）；
+    其中大部分是各级别分析对象的 update，每根1分钟K线都会替换更高级别的最后一根K线，需要重新识别尾部的结构；
+    信号按分型、笔序列的版本号缓存，结构没有变化的级别不会重新计算笔信号。
+
+    :param bars: pd.DataFrame or dict of np.array or list of dict
+        按时间升序排列的1分钟K线，包含 dt/open/close/high/low/vol，symbol 可选
+    :param freqs: list of str
+        级别列表，默认值为 ['1分钟', '5分钟', '30分钟', '日线']
+    :param init_count: int
+        用于初始化 MultiLevelAnalyze 的K线数量
+    :param start_dt: datetime
+        开始记录信号的时间，默认从初始化之后的第一根K线开始
+    :param max_count: int
+        每个级别保留的最大K线数量
+    :param symbol: str
+        bars 中没有 symbol 列时使用的标的代码
+    :param file_output: str
+        结果文件路径，按后缀保存为 parquet / feather / pkl / csv；为 None 时不保存
+    :param kwargs: dict
+        其他传给 KlineSignals 的参数，如 use_xd、bi_mode
+    :return: pd.DataFrame
+        每行对应一根1分钟K线，列为 dt 以及全部信号；级别的分析对象创建之前，该级别的信号为空值
+    """
+    records = _iter_records(bars, symbol)
+    init = list(islice(records, init_count))
+    ml = MultiLevelAnalyze(init, freqs=freqs, max_count=max_count, ka_cls=KlineSignals, **kwargs)
+
+    k = None
+    if start_dt is not None:
+        start_dt = pd.Timestamp(start_dt)
+        warm = []
+        for k in records:
+            if k['dt'] >= start_dt:
+                break
+            warm.append(k)
+            if len(warm) == 10000:
+                ml.update_many(warm)
+                warm = []
+        else:
+            k = None
+        if warm:
+            ml.update_many(warm)
+        records = chain([k], records) if k is not None else records
+
+    # 每个级别按信号结构的字段顺序记录编码值，最后按列还原，不需要逐根K线构造字符串信号 dict
+    dts = []
+    rows = {}
+    starts = {}
+    for k in records:
+        ml.update(k)
+        if len(ml.kas) != len(rows):
+            # 新创建的级别，之前的行为空值
+            for freq in ml.kas:
+                if freq not in rows:
+                    rows[freq] = []
+                    starts[freq] = len(dts)
+        dts.append(k['dt'])
+        for freq, ka in ml.kas.items():
+            rows[freq].append(ka._signal_row())
+
+    n = len(dts)
+    columns = {"symbol": [ml.symbol] * n} if n else {}
+    for freq, level_rows in rows.items():
+        schema, start = ml.kas[freq].schema, starts[freq]
+        for key, c, values in zip(schema.keys, schema.categories, zip(*level_rows)):
+            if c is None:
+                columns[key] = [None] * start + list(values)
+            else:
+                codes = np.full(n, -1, dtype=np.int8)
+                codes[start:] = values
+                cat = pd.Categorical.from_codes(codes, c).remove_unused_categories()
+                columns[key] = cat.reorder_categories(sorted(cat.categories))
+
+    df = pd.DataFrame(columns, index=pd.RangeIndex(n))
+    df.insert(0, 'dt', pd.DatetimeIndex(dts))
+    # 补了空值的 bool 信号等其他非数值列
+    for key in df.columns:
+        if df[key].dtype == object:
+            df[key] = df[key].astype('category')
+
+    if file_output:
+        save_frame(df, file_output)
+    return df
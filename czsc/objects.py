@@ -0,0 +1,139 @@
+# coding: utf-8
+"""
+
+K线、分型、笔、线段对象
+
+这些对象使用 __slots__ 保存字段，内存占用比 dict 小，创建也更快；同时实现了只读 Mapping 的全部接口
+并支持按键赋值，x['fx_mark']、x.get('bi')、dict(x)、pd.DataFrame(list_of_x) 等原有的 dict 用法都可以继续使用。
+"""
+from collections.abc import Mapping
+from operator import attrgetter
+
+
+class Record(Mapping):
+    """带有固定字段的轻量对象，兼容 dict 的读取方式"""
+    __slots__ = ()
+    _fields = ()
+    _keys = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._keys = frozenset(cls._fields)
+        cls._values = attrgetter(*cls._fields) if cls._fields else None
+
+    def __getitem__(self, key):
+        if key in self._keys:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            raise KeyError("{} 没有字段 {}".format(self.__class__.__name__, key))
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self._values(self) == self._values(other)
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.to_dict())
+
+    def __getstate__(self):
+        return tuple(getattr(self, f) for f in self._fields)
+
+    def __setstate__(self, state):
+        for f, v in zip(self._fields, state):
+            setattr(self, f, v)
+
+    def to_dict(self):
+        """转换成 dict"""
+        return {f: getattr(self, f) for f in self._fields}
+
+
+class RawBar(Record):
+    """原始K线"""
+    __slots__ = ('symbol', 'dt', 'open', 'close', 'high', 'low', 'vol')
+    _fields = __slots__
+
+    def __init__(self, symbol, dt, open, close, high, low, vol):
+        self.symbol = symbol
+        self.dt = dt
+        self.open = open
+        self.close = close
+        self.high = high
+        self.low = low
+        self.vol = vol
+
+    @classmethod
+    def from_bar(cls, k):
+        """从 dict 或者其他K线对象创建"""
+        return cls(k.get('symbol'), k['dt'], k['open'], k['close'], k['high'], k['low'], k['vol'])
+
+
+class NewBar(RawBar):
+    """去除包含关系的K线"""
+    __slots__ = ()
+
+
+class FX(Record):
+    """分型标记"""
+    __slots__ = ('dt', 'fx_mark', 'fx', 'start_dt', 'end_dt', 'fx_high', 'fx_low')
+    _fields = __slots__
+
+    def __init__(self, dt, fx_mark, fx, start_dt, end_dt, fx_high, fx_low):
+        self.dt = dt
+        self.fx_mark = fx_mark
+        self.fx = fx
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.fx_high = fx_high
+        self.fx_low = fx_low
+
+
+class BI(Record):
+    """笔标记"""
+    __slots__ = ('dt', 'fx_mark', 'start_dt', 'end_dt', 'fx_high', 'fx_low', 'bi')
+    _fields = __slots__
+
+    def __init__(self, dt, fx_mark, start_dt, end_dt, fx_high, fx_low, bi):
+        self.dt = dt
+        self.fx_mark = fx_mark
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.fx_high = fx_high
+        self.fx_low = fx_low
+        self.bi = bi
+
+    @classmethod
+    def from_fx(cls, fx):
+        """由分型标记创建笔标记"""
+        return cls(fx.dt, fx.fx_mark, fx.start_dt, fx.end_dt, fx.fx_high, fx.fx_low, fx.fx)
+
+
+class XD(Record):
+    """线段标记"""
+    __slots__ = ('dt', 'fx_mark', 'start_dt', 'end_dt', 'fx_high', 'fx_low', 'xd')
+    _fields = __slots__
+
+    def __init__(self, dt, fx_mark, start_dt, end_dt, fx_high, fx_low, xd):
+        self.dt = dt
+        self.fx_mark = fx_mark
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.fx_high = fx_high
+        self.fx_low = fx_low
+        self.xd = xd
+
+    @classmethod
+    def from_bi(cls, bi):
+        """由笔标记创建线段标记"""
+        return cls(bi.dt, bi.fx_mark, bi.start_dt, bi.end_dt, bi.fx_high, bi.fx_low, bi.bi)
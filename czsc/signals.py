@@ -1,5 +1,8 @@
 # coding: utf-8
-from .analyze import KlineAnalyze
+import numpy as np
+import pandas as pd
+from .analyze import KlineAnalyze, frame_to_records
+from .utils import signal_kernel as sk
 
 
 def check_jing(fd1, fd2, fd3, fd4, fd5) -> str:
@@ -158,282 +161,423 @@ def check_dynamic(fd1, fd3, fd5):
     return v
 
 
-class KlineSignals(KlineAnalyze):
-    """适用于纯缠论逻辑推理的单级别信号计算"""
+# 字符串信号的全部取值，编码为取值在元组中的下标，下标 0 都是默认值 other
+FX_MARK = ("other", "g", "d")
+TRI_MARK = ("other", "g", "d", "up", "down")
+DIRECTION = ("other", "up", "down")
+DYNAMIC = ("other", "向上笔不创新高", "向上笔新高无背", "向上笔新高盘背", "向下笔不创新低", "向下笔新低无背", "向下笔新低盘背")
+THIRD_BS = ("other", "三买", "三卖")
+JING = ("other", "向上大井", "向上小井", "向下大井", "向下小井")
 
-    def __init__(self, kline, name="本级别", bi_mode="new", max_count=300, use_xd=False, use_ta=False):
-        super().__init__(kline, name, bi_mode, max_count, use_xd, use_ta,
-                         ma_params=(5, 13, 21, 34, 55, 89, 144, 233), verbose=False)
-
-    def get_signals(self):
-        """获取单级别信号"""
-        methods = [self.fx_signals, self.bi_signals, self.bd_signals]
-        signals = dict()
-        for method in methods:
-            signals.update(method())
-        return signals
-
-    def fx_signals(self):
-        """辅助判断的信号"""
-        s = {
-            "最近一个分型类型": "other",
-            "最近三根无包含K线形态": "other",
-            "最近一个底分型上边沿": 0,
-            "最近一个顶分型下边沿": 0,
-        }
-
-        if len(self.fx_list) > 2:
-            s['最近一个分型类型'] = self.fx_list[-1]['fx_mark']
-            last_d = [x for x in self.fx_list[-4:] if x['fx_mark'] == 'd'][-1]
-            last_g = [x for x in self.fx_list[-4:] if x['fx_mark'] == 'g'][-1]
-            s['最近一个底分型上边沿'] = last_d['fx_high']
-            s['最近一个顶分型下边沿'] = last_g['fx_low']
-
-        def __tri_mark(x1, x2, x3):
-            if x1 < x2 > x3:
-                v = "g"
-            elif x1 > x2 < x3:
-                v = "d"
-            elif x1 > x2 > x3:
-                v = "down"
-            elif x1 < x2 < x3:
-                v = "up"
-            else:
-                v = 'other'
-            return v
 
-        if len(self.kline_new) > 6:
-            k3 = self.kline_new[-3:]
-            assert len(k3) == 3
-            s['最近三根无包含K线形态'] = __tri_mark(k3[-3]['high'], k3[-2]['high'], k3[-1]['high'])
+class SignalSchema:
+    """单级别信号的固定结构：字段顺序、数值类型、默认值，以及字符串取值的整数编码
 
-        return {"{}_{}".format(self.name, k): v for k, v in s.items()}
+    字段的类型为取值元组（编码为 int8）、bool、int（int8）或者 float（float64）；
+    带级别名称前缀的信号名称只在创建时构造一次。
+    """
 
-    def bi_signals(self):
-        """笔相关信号"""
-        s = {
-            "五笔趋势类背驰": "other",  # other 表示默认值， up 表示向上五笔类趋势背驰， down 表示向下
-
-            "第N笔涨跌力度": "other",  # other 表示默认值
-            "第N笔向下新低": False,
-            "第N笔向上新高": False,
-            "第N笔结束标记的上边沿": 0,
-            "第N笔结束标记的下边沿": 0,
-
-            "第N-1笔涨跌力度": "other",
-            "第N-2笔涨跌力度": "other",
-
-            "第N笔第三买卖": "other",  # other 表示默认值
-            "第N-2笔第三买卖": "other",
-
-            "最近一个笔中枢ZD": 0,
-            "最近一个笔中枢ZG": 0,
-
-            "第N笔出井": "other",
-            "第N-1笔出井": "other",
-            "第N-2笔出井": "other",
-        }
-
-        if len(self.bi_list) > 12:
-            bis = self.get_bi_fd(n=10)
-            s['第N笔结束标记的上边沿'] = bis[-1]['end_mark']['fx_high']
-            s['第N笔结束标记的下边沿'] = bis[-1]['end_mark']['fx_low']
-
-            last_k = self.kline_new[-1]
-            if bis[-1]['price_power'] < bis[-3]['price_power'] and bis[-1]['vol_power'] < bis[-3]['vol_power']:
-                if bis[-5]['low'] > bis[-3]['low'] > bis[-1]['low'] \
-                        and bis[-5]['high'] > bis[-3]['high'] > bis[-1]['high'] \
-                        and bis[-1]['direction'] == 'down' and bis[-2]['high'] < bis[-4]['low']:
-                    s['五笔趋势类背驰'] = 'down'
-
-                if bis[-5]['low'] < bis[-3]['low'] < bis[-1]['low'] \
-                        and bis[-5]['high'] < bis[-3]['high'] < bis[-1]['high'] \
-                        and bis[-1]['direction'] == 'up' and bis[-2]['low'] > bis[-4]['high']:
-                    s['五笔趋势类背驰'] = 'up'
-
-            if bis[-1]['direction'] == 'down' and last_k['low'] < bis[-1]['low']:
-                s['第N笔向下新低'] = True
-
-            if bis[-1]['direction'] == 'up' and last_k['high'] > bis[-1]['high']:
-                s['第N笔向上新高'] = True
-
-            s['第N笔涨跌力度'] = check_dynamic(bis[-5], bis[-3], bis[-1])
-            s['第N-1笔涨跌力度'] = check_dynamic(bis[-6], bis[-4], bis[-2])
-            s['第N-2笔涨跌力度'] = check_dynamic(bis[-7], bis[-5], bis[-3])
-
-            s['第N笔第三买卖'] = check_third_bs(bis[-5], bis[-4], bis[-3], bis[-2], bis[-1])
-            s['第N-2笔第三买卖'] = check_third_bs(bis[-7], bis[-6], bis[-5], bis[-4], bis[-3])
-
-            s['第N笔出井'] = check_jing(bis[-5], bis[-4], bis[-3], bis[-2], bis[-1])
-            s['第N-1笔出井'] = check_jing(bis[-6], bis[-5], bis[-4], bis[-3], bis[-2])
-            s['第N-2笔出井'] = check_jing(bis[-7], bis[-6], bis[-5], bis[-4], bis[-3])
-
-            zd = max(bis[-5]['low'], bis[-4]['low'], bis[-3]['low'])
-            zg = min(bis[-5]['high'], bis[-4]['high'], bis[-3]['high'])
-            if zg < zd:
-                zd = max(bis[-4]['low'], bis[-3]['low'], bis[-2]['low'])
-                zg = min(bis[-4]['high'], bis[-3]['high'], bis[-2]['high'])
-
-            s['最近一个笔中枢ZD'] = zd
-            s['最近一个笔中枢ZG'] = zg
-        return {"{}_{}".format(self.name, k): v for k, v in s.items()}
-
-    def bd_signals(self):
-        """由笔进行同级别分解的信号"""
-        s = {
-            "三笔回调构成第三买卖点": "other",
-        }
+    def __init__(self, fields, name="本级别"):
+        """
+
+        :param fields: tuple
+            ((信号名称, 类型), ...) 或 ((信号名称, 类型, 默认值), ...)，顺序与 get_signals 一致；
+            没有给出默认值时，取值元组为下标 0（other），bool 为 False，int、float 为 0
+        :param name: str
+            级别名称
+        """
+        self.name = name
+        self.fields = tuple(fields)
+        self.names = [f[0] for f in self.fields]
+        self.keys = ["{}_{}".format(name, k) for k in self.names]
+        self.key_of = dict(zip(self.names, self.keys))
+        self.index = {k: i for i, k in enumerate(self.names)}
+        self.categories = [f[1] if isinstance(f[1], tuple) else None for f in self.fields]
+        self.codes = [{v: i for i, v in enumerate(c)} if c else None for c in self.categories]
+        self.defaults = [f[2] if len(f) > 2 else (False if f[1] is bool else 0) for f in self.fields]
+        types = {bool: np.bool_, int: np.int8, float: np.float64}
+        self.dtype = np.dtype([(key, np.int8 if c else types[f[1]])
+                               for key, f, c in zip(self.keys, self.fields, self.categories)])
+
+    def __repr__(self):
+        return "<SignalSchema for {}; {} fields>".format(self.name, len(self.fields))
+
+    def encode(self, values):
+        """把按字段顺序排列的字符串信号值编码成 tuple，可以直接赋值给 dtype 数组的一行"""
+        return tuple(v if c is None else c[v] for c, v in zip(self.codes, values))
+
+    def empty(self, n):
+        """预分配 n 行信号数组"""
+        return np.zeros(n, dtype=self.dtype)
+
+    def decode(self, record):
+        """把一行信号还原成字符串信号 dict
+
+        :param record: np.void or list
+            信号数组的一行，或者按字段顺序排列的编码值
+        """
+        if isinstance(record, np.void):
+            record = record.item()
+        return {key: v if c is None else c[v] for key, c, v in zip(self.keys, self.categories, record)}
+
+    def to_frame(self, array):
+        """把信号数组转换成 DataFrame，字符串信号为 category 类型"""
+        return pd.DataFrame({key: array[key] if c is None else pd.Categorical.from_codes(array[key], c)
+                             for key, c in zip(self.keys, self.categories)})
+
+
+class _SignalsBase(KlineAnalyze):
+    """单级别信号计算的公共部分
+
+    信号直接以编码形式计算：按信号结构的字段顺序排列，字符串信号为取值下标，各字段按名称赋值；
+    get_signals 等字符串 dict 只是编码的一种展示形式。只依赖分型、笔序列的部分按结构版本号缓存。
+
+    各子类只定义信号结构以及如何从 bi_kernel 的结果中读取自己的信号；bi_kernel 的结果按笔序列版本号缓存在分析对象上，
+    与信号类无关，所以一个分析对象可以同时输出多个信号类（view）的信号，最近 10 笔只计算一次，
+    如 ks.get_signals(view=MachineKlineSignals)。共用只发生在同一个分析对象上，分别创建的分析对象
+    （如分别用 KlineSignals、MachineKlineSignals 构造的两个对象）各自计算，需要多个信号类时应使用 view 参数。
+
+    子类定义 SIGNALS 以及以下三个类方法，row 为按字段顺序排列的编码列表，ix 为字段名到下标的映射：
+
+        _fill_fx(ka, row, ix)                       只依赖分型序列的信号
+        _fill_bi(ka, row, ix, codes, zs, last)      只依赖笔序列的信号，codes、zs、last 见 _bi_kernel
+        _fill_current(ka, row, ix)                  依赖最后几根无包含K线的信号，每次都重新计算
+    """
+    FX_SIGNALS = ()
+    BI_SIGNALS = ()
+    BD_SIGNALS = (
+        ("三笔回调构成第三买卖点", THIRD_BS),
+    )
+    SIGNALS = ()
+
+    def schema_of(self, view=None):
+        """信号类 view 在本级别的信号结构，默认为当前分析对象的类；第一次读取时创建"""
+        view = view or type(self)
+        schemas = self.__dict__.setdefault('_schemas', dict())
+        schema = schemas.get(view)
+        if schema is None or schema.name != self.name:
+            schema = schemas[view] = SignalSchema(view.SIGNALS, self.name)
+        return schema
+
+    @property
+    def schema(self):
+        """本级别的信号结构"""
+        return self.schema_of()
+
+    def _cached(self, group, version, func):
+        """返回 func() 的结果，version 没有变化时使用缓存"""
+        cache = self.__dict__.setdefault('_signal_cache', dict())
+        hit = cache.get(group)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        value = func()
+        cache[group] = (version, value)
+        return value
+
+    def _bi_kernel(self):
+        """最近 10 笔的全部笔信号，按笔序列版本号缓存，同一个分析对象上的全部信号类共用；笔标记不足 13 个时为 None
+
+        :return: tuple
+            (codes, zs, last)：codes、zs 见 czsc.utils.signal_kernel.bi_kernel，last 为第N笔的 (是否向上, 最高价, 最低价)
+        """
+        return self._cached("kernel", self.versions['bi_list'], self.__bi_kernel)
+
+    def __bi_kernel(self):
+        if len(self.bi_list) <= 12:
+            return None
+        points = self.bi_list[-11:]
+        bi = [x['bi'] for x in points]
+        dt = [x['dt'] for x in points]
+        vol_power = [self.calculate_vol_power(dt[i], dt[i + 1]) for i in range(10)]
+        codes, zs = sk.bi_kernel(np.array(bi, dtype=np.float64), np.array(vol_power, dtype=np.float64))
+        return codes.tolist(), zs.tolist(), (bi[-2] < bi[-1], max(bi[-2:]), min(bi[-2:]))
+
+    def _bd_code(self):
+        """三笔回调构成第三买卖点，THIRD_BS 中的下标；按笔序列版本号缓存"""
+        return self._cached("bd", self.versions['bi_list'], self.__bd_code)
+
+    def __bd_code(self):
         if len(self.bi_list) > 16 and self.bi_list[-1]['fx_mark'] == 'd':
-            points = self.bi_list[-16:]
-            fd1_points = [x['bi'] for x in points[0: 4]]
-            fd2_points = [x['bi'] for x in points[3: 7]]
-            fd3_points = [x['bi'] for x in points[6: 10]]
-            fd4_points = [x['bi'] for x in points[9: 13]]
-            fd5_points = [x['bi'] for x in points[12: 16]]
-            fd1 = {"high": max(fd1_points), "low": min(fd1_points)}
-            fd2 = {"high": max(fd2_points), "low": min(fd2_points)}
-            fd3 = {"high": max(fd3_points), "low": min(fd3_points)}
-            fd4 = {"high": max(fd4_points), "low": min(fd4_points)}
-            fd5 = {"high": max(fd5_points), "low": min(fd5_points)}
+            return int(sk.bd_kernel(np.array([x['bi'] for x in self.bi_list[-16:]], dtype=np.float64)))
+        return 0
+
+    def _tri_mark(self):
+        """最近三根无包含K线形态，TRI_MARK 中的下标"""
+        if len(self.kline_new) <= 6:
+            return 0
+        k3 = self.kline_new[-3:]
+        x1, x2, x3 = k3[0]['high'], k3[1]['high'], k3[2]['high']
+        if x1 < x2 > x3:
+            v = "g"
+        elif x1 > x2 < x3:
+            v = "d"
+        elif x1 > x2 > x3:
+            v = "down"
+        elif x1 < x2 < x3:
+            v = "up"
+        else:
+            v = 'other'
+        return TRI_MARK.index(v)
+
+    @classmethod
+    def _structure_row(cls, ka, schema):
+        """只依赖分型、笔序列的信号编码，按字段顺序排列"""
+        row = list(schema.defaults)
+        ix = schema.index
+        cls._fill_fx(ka, row, ix)
+        res = ka._bi_kernel()
+        if res is not None:
+            cls._fill_bi(ka, row, ix, *res)
+        row[ix['三笔回调构成第三买卖点']] = ka._bd_code()
+        return tuple(row)
+
+    def _signal_row(self, view=None):
+        """按信号结构的字段顺序排列的编码值
+
+        :param view: type
+            信号类，默认为当前分析对象的类
+        :return: list
+        """
+        view = view or type(self)
+        schema = self.schema_of(view)
+        versions = (self.versions['fx_list'], self.versions['bi_list'])
+        row = list(self._cached((view, "row"), versions, lambda: view._structure_row(self, schema)))
+        view._fill_current(self, row, schema.index)
+        return row
+
+    def _signals_of(self, fields, view=None):
+        key_of = self.schema_of(view).key_of
+        s = self.get_signals(view)
+        return {key_of[f[0]]: s[key_of[f[0]]] for f in fields}
+
+    def fx_signals(self, view=None):
+        """分型相关信号"""
+        return self._signals_of((view or type(self)).FX_SIGNALS, view)
 
-            s['三笔回调构成第三买卖点'] = check_third_bs(fd1, fd2, fd3, fd4, fd5)
-        return {"{}_{}".format(self.name, k): v for k, v in s.items()}
+    def bi_signals(self, view=None):
+        """笔相关信号"""
+        return self._signals_of((view or type(self)).BI_SIGNALS, view)
 
+    def bd_signals(self, view=None):
+        """由笔进行同级别分解的信号"""
+        return self._signals_of(self.BD_SIGNALS, view)
+
+    def get_signals(self, view=None):
+        """获取单级别信号，由编码值还原成字符串
+
+        :param view: type
+            信号类，默认为当前分析对象的类；可以是其他 _SignalsBase 子类，与当前类共用 bi_kernel 的计算结果
+        :return: dict
+        """
+        return self.schema_of(view).decode(self._signal_row(view))
+
+    def get_signal_vector(self, out=None, i=0, view=None):
+        """获取单级别信号的数值形式，字符串信号编码为整数，编码表见 schema
+
+        :param out: np.array
+            schema.empty(n) 预分配的数组，不为 None 时把信号写入第 i 行
+        :param i: int
+        :param view: type
+            信号类，默认为当前分析对象的类
+        :return: np.void
+            一行 schema.dtype 类型的记录
+        """
+        if out is None:
+            out = self.schema_of(view).empty(1)
+            i = 0
+        out[i] = tuple(self._signal_row(view))
+        return out[i]
+
+    @classmethod
+    def signal_panel(cls, kline, name="本级别", bi_mode="new", max_count=300, use_xd=False, use_ta=False,
+                     init_count=3, as_array=False):
+        """一次前向遍历，得到每根K线结束时的信号
+
+        用前 init_count 根K线初始化之后逐根 update，每根K线的信号编码直接写入预分配的数组；结构识别是增量的，
+        信号中只依赖分型、笔序列的部分按结构版本号缓存，总耗时与K线数量成正比，
+        不需要对每根K线重新创建分析对象。
+
+        :param kline: pd.DataFrame or list of dict
+            按时间升序排列的K线
+        :param name: str
+        :param bi_mode: str
+        :param max_count: int
+        :param use_xd: bool
+        :param use_ta: bool
+        :param init_count: int
+            用于初始化的K线数量，面板从第 init_count 根K线开始
+        :param as_array: bool
+            为 True 时返回 (dt, 信号数组, schema)，dt 为 datetime64 数组
+        :return: pd.DataFrame
+            每行对应一根K线，列为 dt 以及全部信号；字符串信号为 category，bool 信号为 bool，
+            -1/0/1 之类的整数信号为 int8，价格类信号为 float64
+        """
+        bars = frame_to_records(kline) if isinstance(kline, pd.DataFrame) else list(kline)
+        if len(bars) < init_count:
+            raise ValueError("K线数量少于 init_count：{} < {}".format(len(bars), init_count))
+
+        ka = cls(bars[:init_count], name=name, bi_mode=bi_mode, max_count=max_count, use_xd=use_xd, use_ta=use_ta)
+        schema = ka.schema
+        array = schema.empty(len(bars) - init_count + 1)
+        array[0] = tuple(ka._signal_row())
+        for i, k in enumerate(bars[init_count:], 1):
+            ka.update(k, is_new=True)
+            array[i] = tuple(ka._signal_row())
+
+        dt = pd.DatetimeIndex([x['dt'] for x in bars[init_count - 1:]])
+        if as_array:
+            return dt.values, array, schema
+        df = schema.to_frame(array)
+        df.insert(0, 'dt', dt)
+        return df
+
+
+class KlineSignals(_SignalsBase):
+    """适用于纯缠论逻辑推理的单级别信号计算
+
+    信号中只依赖分型序列、笔序列的部分，按结构版本号 versions 缓存，序列没有变化时直接复用；
+    每次只重新计算依赖最后几根无包含K线的少数信号，所以结构变化之间每根K线都计算信号的开销很小。
+    """
 
-class MachineKlineSignals(KlineAnalyze):
-    """适用于训练机器学习（多因子）模型的单级别信号计算"""
+    FX_SIGNALS = (
+        ("最近一个分型类型", FX_MARK),
+        ("最近三根无包含K线形态", TRI_MARK),
+        ("最近一个底分型上边沿", float),
+        ("最近一个顶分型下边沿", float),
+    )
+
+    BI_SIGNALS = (
+        ("五笔趋势类背驰", DIRECTION),  # other 表示默认值， up 表示向上五笔类趋势背驰， down 表示向下
+        ("第N笔涨跌力度", DYNAMIC),
+        ("第N笔向下新低", bool),
+        ("第N笔向上新高", bool),
+        ("第N笔结束标记的上边沿", float),
+        ("第N笔结束标记的下边沿", float),
+        ("第N-1笔涨跌力度", DYNAMIC),
+        ("第N-2笔涨跌力度", DYNAMIC),
+        ("第N笔第三买卖", THIRD_BS),
+        ("第N-2笔第三买卖", THIRD_BS),
+        ("最近一个笔中枢ZD", float),
+        ("最近一个笔中枢ZG", float),
+        ("第N笔出井", JING),
+        ("第N-1笔出井", JING),
+        ("第N-2笔出井", JING),
+    )
+
+    SIGNALS = FX_SIGNALS + BI_SIGNALS + _SignalsBase.BD_SIGNALS
 
     def __init__(self, kline, name="本级别", bi_mode="new", max_count=300, use_xd=False, use_ta=False):
         super().__init__(kline, name, bi_mode, max_count, use_xd, use_ta,
                          ma_params=(5, 13, 21, 34, 55, 89, 144, 233), verbose=False)
 
-    def get_signals(self):
-        """获取单级别信号"""
-        methods = [self.fx_signals, self.bi_signals, self.bd_signals]
-        signals = dict()
-        for method in methods:
-            signals.update(method())
-        return signals
+    @classmethod
+    def _fill_fx(cls, ka, row, ix):
+        if len(ka.fx_list) > 2:
+            row[ix['最近一个分型类型']] = FX_MARK.index(ka.fx_list[-1]['fx_mark'])
+            last_d = [x for x in ka.fx_list[-4:] if x['fx_mark'] == 'd'][-1]
+            last_g = [x for x in ka.fx_list[-4:] if x['fx_mark'] == 'g'][-1]
+            row[ix['最近一个底分型上边沿']] = last_d['fx_high']
+            row[ix['最近一个顶分型下边沿']] = last_g['fx_low']
 
-    def fx_signals(self):
-        """分型相关信号"""
-        s = {
-            "最近一个分型类型": "other",
-            "最近三根无包含K线形态": "other",
-        }
-        if len(self.fx_list) > 2:
-            s['最近一个分型类型'] = self.fx_list[-1]['fx_mark']
-
-        def __tri_mark(x1, x2, x3):
-            if x1 < x2 > x3:
-                v = "g"
-            elif x1 > x2 < x3:
-                v = "d"
-            elif x1 > x2 > x3:
-                v = "down"
-            elif x1 < x2 < x3:
-                v = "up"
-            else:
-                v = 'other'
-            return v
+    @classmethod
+    def _fill_bi(cls, ka, row, ix, codes, zs, last):
+        row[ix['五笔趋势类背驰']] = codes[sk.BC]
+        row[ix['第N笔结束标记的上边沿']] = ka.bi_list[-1]['fx_high']
+        row[ix['第N笔结束标记的下边沿']] = ka.bi_list[-1]['fx_low']
 
-        if len(self.kline_new) > 6:
-            k3 = self.kline_new[-3:]
-            assert len(k3) == 3
-            s['最近三根无包含K线形态'] = __tri_mark(k3[-3]['high'], k3[-2]['high'], k3[-1]['high'])
+        row[ix['第N笔涨跌力度']] = codes[sk.DYN]
+        row[ix['第N-1笔涨跌力度']] = codes[sk.DYN + 1]
+        row[ix['第N-2笔涨跌力度']] = codes[sk.DYN + 2]
 
-        return {"{}_{}".format(self.name, k): v for k, v in s.items()}
+        row[ix['第N笔第三买卖']] = codes[sk.TBS]
+        row[ix['第N-2笔第三买卖']] = codes[sk.TBS + 2]
 
-    def bi_signals(self):
-        """笔相关信号"""
-        s = {
-            "当下笔方向": "other",  # other 表示默认值
-            "五笔趋势类背驰": "other",  # other 表示默认值， up 表示向上五笔类趋势背驰， down 表示向下
-
-            "第N笔涨跌力度": "other",  # other 表示默认值
-            "第N笔第三买卖": "other",  # other 表示默认值
-
-            "第N-1笔涨跌力度": "other",
-            "第N-1笔第三买卖": "other",
-
-            "第N-2笔涨跌力度": "other",
-            "第N-2笔第三买卖": "other",
-
-            "第N-3笔涨跌力度": "other",
-            "第N-3笔第三买卖": "other",
-
-            "最近一个笔中枢ZD": 0,
-            "最近一个笔中枢ZG": 0,
-
-            "第N-1笔创近6笔新高": False,
-            "第N-1笔创近6笔新低": False,
-
-            # 止损信号
-            "当下笔向下新低": -1,  # -1 表示默认值， 0 表示 False， 1 表示 True
-            "当下笔向上新高": -1,  # -1 表示默认值， 0 表示 False， 1 表示 True
-        }
-
-        if len(self.bi_list) > 12:
-            bis = self.get_bi_fd(n=10)
-            s['当下笔方向'] = bis[-1]['direction']
-            last_k = self.kline_new[-1]
-            if bis[-1]['price_power'] < bis[-3]['price_power'] and bis[-1]['vol_power'] < bis[-3]['vol_power']:
-                if bis[-5]['low'] > bis[-3]['low'] > bis[-1]['low'] \
-                        and bis[-5]['high'] > bis[-3]['high'] > bis[-1]['high'] \
-                        and bis[-1]['direction'] == 'down' and bis[-2]['high'] < bis[-4]['low']:
-                    s['五笔趋势类背驰'] = 'down'
-
-                if bis[-5]['low'] < bis[-3]['low'] < bis[-1]['low'] \
-                        and bis[-5]['high'] < bis[-3]['high'] < bis[-1]['high'] \
-                        and bis[-1]['direction'] == 'up' and bis[-2]['low'] > bis[-4]['high']:
-                    s['五笔趋势类背驰'] = 'up'
-
-            if bis[-1]['direction'] == 'down':
-                s['当下笔向下新低'] = 1 if last_k['low'] < bis[-1]['low'] else 0
-
-            if bis[-1]['direction'] == 'up':
-                s['当下笔向上新高'] = 1 if last_k['high'] > bis[-1]['high'] else 0
-
-            s['第N-1笔创近6笔新高'] = max([x['high'] for x in bis[-7:-1]]) == bis[-2]['high'] and bis[-2]['direction'] == 'up'
-            s['第N-1笔创近6笔新低'] = min([x['low'] for x in bis[-7:-1]]) == bis[-2]['low'] and bis[-2]['direction'] == 'down'
-
-            s['第N笔涨跌力度'] = check_dynamic(bis[-5], bis[-3], bis[-1])
-            s['第N-1笔涨跌力度'] = check_dynamic(bis[-6], bis[-4], bis[-2])
-            s['第N-2笔涨跌力度'] = check_dynamic(bis[-7], bis[-5], bis[-3])
-            s['第N-3笔涨跌力度'] = check_dynamic(bis[-8], bis[-6], bis[-4])
-
-            s['第N笔第三买卖'] = check_third_bs(bis[-5], bis[-4], bis[-3], bis[-2], bis[-1])
-            s['第N-1笔第三买卖'] = check_third_bs(bis[-6], bis[-5], bis[-4], bis[-3], bis[-2])
-            s['第N-2笔第三买卖'] = check_third_bs(bis[-7], bis[-6], bis[-5], bis[-4], bis[-3])
-            s['第N-3笔第三买卖'] = check_third_bs(bis[-8], bis[-7], bis[-6], bis[-5], bis[-4])
-
-            zd = max(bis[-5]['low'], bis[-4]['low'], bis[-3]['low'])
-            zg = min(bis[-5]['high'], bis[-4]['high'], bis[-3]['high'])
-            if zg < zd:
-                zd = max(bis[-4]['low'], bis[-3]['low'], bis[-2]['low'])
-                zg = min(bis[-4]['high'], bis[-3]['high'], bis[-2]['high'])
-
-            s['最近一个笔中枢ZD'] = zd
-            s['最近一个笔中枢ZG'] = zg
-        return {"{}_{}".format(self.name, k): v for k, v in s.items()}
-
-    def bd_signals(self):
-        """由笔进行同级别分解的信号"""
-        s = {
-            "三笔回调构成第三买卖点": "other",
-        }
-        if len(self.bi_list) > 16 and self.bi_list[-1]['fx_mark'] == 'd':
-            points = self.bi_list[-16:]
-            fd1_points = [x['bi'] for x in points[0: 4]]
-            fd2_points = [x['bi'] for x in points[3: 7]]
-            fd3_points = [x['bi'] for x in points[6: 10]]
-            fd4_points = [x['bi'] for x in points[9: 13]]
-            fd5_points = [x['bi'] for x in points[12: 16]]
-            fd1 = {"high": max(fd1_points), "low": min(fd1_points)}
-            fd2 = {"high": max(fd2_points), "low": min(fd2_points)}
-            fd3 = {"high": max(fd3_points), "low": min(fd3_points)}
-            fd4 = {"high": max(fd4_points), "low": min(fd4_points)}
-            fd5 = {"high": max(fd5_points), "low": min(fd5_points)}
-
-            s['三笔回调构成第三买卖点'] = check_third_bs(fd1, fd2, fd3, fd4, fd5)
-        return {"{}_{}".format(self.name, k): v for k, v in s.items()}
+        row[ix['第N笔出井']] = codes[sk.JING]
+        row[ix['第N-1笔出井']] = codes[sk.JING + 1]
+        row[ix['第N-2笔出井']] = codes[sk.JING + 2]
+
+        row[ix['最近一个笔中枢ZD']], row[ix['最近一个笔中枢ZG']] = zs
+
+    @classmethod
+    def _fill_current(cls, ka, row, ix):
+        row[ix['最近三根无包含K线形态']] = ka._tri_mark()
+        res = ka._bi_kernel()
+        if res is not None:
+            up, high, low = res[2]
+            last_k = ka.kline_new[-1]
+            if not up and last_k['low'] < low:
+                row[ix['第N笔向下新低']] = True
+
+            if up and last_k['high'] > high:
+                row[ix['第N笔向上新高']] = True
+
+
+class MachineKlineSignals(_SignalsBase):
+    """适用于训练机器学习（多因子）模型的单级别信号计算
+
+    与 KlineSignals 一样按结构版本号缓存信号；signal_panel 可以一次得到全部历史K线的信号，用于构造训练集
+    """
+
+    FX_SIGNALS = (
+        ("最近一个分型类型", FX_MARK),
+        ("最近三根无包含K线形态", TRI_MARK),
+    )
+
+    BI_SIGNALS = (
+        ("当下笔方向", DIRECTION),
+        ("五笔趋势类背驰", DIRECTION),  # other 表示默认值， up 表示向上五笔类趋势背驰， down 表示向下
+        ("第N笔涨跌力度", DYNAMIC),
+        ("第N笔第三买卖", THIRD_BS),
+        ("第N-1笔涨跌力度", DYNAMIC),
+        ("第N-1笔第三买卖", THIRD_BS),
+        ("第N-2笔涨跌力度", DYNAMIC),
+        ("第N-2笔第三买卖", THIRD_BS),
+        ("第N-3笔涨跌力度", DYNAMIC),
+        ("第N-3笔第三买卖", THIRD_BS),
+        ("最近一个笔中枢ZD", float),
+        ("最近一个笔中枢ZG", float),
+        ("第N-1笔创近6笔新高", bool),
+        ("第N-1笔创近6笔新低", bool),
+
+        # 止损信号：-1 表示默认值， 0 表示 False， 1 表示 True
+        ("当下笔向下新低", int, -1),
+        ("当下笔向上新高", int, -1),
+    )
+
+    SIGNALS = FX_SIGNALS + BI_SIGNALS + _SignalsBase.BD_SIGNALS
+
+    def __init__(self, kline, name="本级别", bi_mode="new", max_count=300, use_xd=False, use_ta=False):
+        super().__init__(kline, name, bi_mode, max_count, use_xd, use_ta,
+                         ma_params=(5, 13, 21, 34, 55, 89, 144, 233), verbose=False)
+
+    @classmethod
+    def _fill_fx(cls, ka, row, ix):
+        if len(ka.fx_list) > 2:
+            row[ix['最近一个分型类型']] = FX_MARK.index(ka.fx_list[-1]['fx_mark'])
+
+    @classmethod
+    def _fill_bi(cls, ka, row, ix, codes, zs, last):
+        row[ix['当下笔方向']] = codes[sk.DIR]
+        row[ix['五笔趋势类背驰']] = codes[sk.BC]
+
+        row[ix['第N-1笔创近6笔新高']] = bool(codes[sk.NEW_HIGH])
+        row[ix['第N-1笔创近6笔新低']] = bool(codes[sk.NEW_LOW])
+
+        for i, n in enumerate(("第N笔", "第N-1笔", "第N-2笔", "第N-3笔")):
+            row[ix[n + '涨跌力度']] = codes[sk.DYN + i]
+            row[ix[n + '第三买卖']] = codes[sk.TBS + i]
+
+        row[ix['最近一个笔中枢ZD']], row[ix['最近一个笔中枢ZG']] = zs
+
+    @classmethod
+    def _fill_current(cls, ka, row, ix):
+        row[ix['最近三根无包含K线形态']] = ka._tri_mark()
+        res = ka._bi_kernel()
+        if res is not None:
+            up, high, low = res[2]
+            last_k = ka.kline_new[-1]
+            if not up:
+                row[ix['当下笔向下新低']] = 1 if last_k['low'] < low else 0
+
+            if up:
+                row[ix['当下笔向上新高']] = 1 if last_k['high'] > high else 0
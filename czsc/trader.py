@@ -1,43 +1,93 @@
 # coding: utf-8
 from datetime import datetime
+import time
 import traceback
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import pandas as pd
 from pyecharts.charts import Tab
 from pyecharts.components import Table
 from pyecharts.options import ComponentTitleOpts
 
 from .signals import KlineSignals
-from .data.jq import get_kline
+from .engine import MultiLevelAnalyze
+from .data.jq import get_kline, get_token
 from .data import freq_map
 from .utils.plot import ka_to_echarts
 
 
 class CzscTrader:
     """缠中说禅股票 选股/择时"""
-    def __init__(self, symbol):
+    def __init__(self, symbol, timeout=30, token=None):
         """
         :param symbol:
+        :param timeout: float
+            每个级别获取K线的超时时间（秒）
+        :param token: str
+            聚宽调用凭证，为 None 时调用 get_token 获取；批量创建时可以共用一个凭证
         """
         self.symbol = symbol
+        self.timeout = timeout
+        self.token = token
+        self.mla = None
         self.__generate_signals()
         self.freqs = ['1分钟', '5分钟', '30分钟', '日线']
 
+    def __load(self, freq, token):
+        """获取一个级别的K线并创建信号对象"""
+        kline = get_kline(symbol=self.symbol, end_date=datetime.now(), freq=freq, count=300,
+                          token=token, timeout=self.timeout)
+        return KlineSignals(kline, name=freq_map.get(freq, "本级别"), bi_mode="new", max_count=300, use_xd=False)
+
     def __generate_signals(self):
+        """各级别共用一个调用凭证，在线程池中同时获取K线、计算信号；总耗时约等于最慢的一个级别"""
         self.signals = {"symbol": self.symbol}
         self.kas = dict()
-        for freq in ['1min', '5min', '30min', 'D']:
+        freqs = ['1min', '5min', '30min', 'D']
+        token = self.token or get_token()
+        deadline = time.monotonic() + self.timeout
+        executor = ThreadPoolExecutor(max_workers=len(freqs))
+        futures = [executor.submit(self.__load, freq, token) for freq in freqs]
+        for freq, future in zip(freqs, futures):
             try:
-                kline = get_kline(symbol=self.symbol, end_date=datetime.now(), freq=freq, count=300)
-                ks = KlineSignals(kline, name=freq_map.get(freq, "本级别"), bi_mode="new", max_count=300, use_xd=False)
-                self.signals.update(ks.get_signals())
-                self.kas[freq_map.get(freq, "本级别")] = ks
-            except:
+                self.kas[freq_map.get(freq, "本级别")] = future.result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                warnings.warn("{} {} 超过 {} 秒没有返回结果，忽略这个级别".format(self.symbol, freq, self.timeout))
+            except Exception:
                 traceback.print_exc()
+        # 超时的级别不等待，后台线程结束后自动退出
+        executor.shutdown(wait=False)
+        if '1分钟' not in self.kas:
+            raise ValueError("{} 的 1分钟 K线获取失败，无法确定最新时间与价格".format(self.symbol))
+        self.__update_signals()
+
+    def __update_signals(self):
+        self.signals = {"symbol": self.symbol}
+        for ks in self.kas.values():
+            self.signals.update(ks.get_signals())
         self.end_dt = self.kas['1分钟'].end_dt
-        self.latest_price = self.kas['1分钟'].kline_raw[-1]['close']
+        self.latest_price = self.kas['1分钟'].latest_price
+
+    def update(self, bars):
+        """输入最新的1分钟K线，增量更新各级别的分析对象以及 self.signals，不重新获取K线
+
+        第一次调用时用各级别的分析对象创建 MultiLevelAnalyze，之后由它合成各级别的最后一根K线并批量更新；
+        盘中监控大量标的时，每分钟只需要对每个标的调用一次 update
+
+        :param bars: dict or list of dict or pd.DataFrame
+            一根或多根按时间升序排列的1分钟K线，时间与最后一根1分钟K线相同时替换最后一根
+        """
+        if isinstance(bars, dict):
+            bars = [bars]
+        if self.mla is None:
+            self.mla = MultiLevelAnalyze.from_kas(self.kas, max_count=300)
+        self.mla.update_many(bars)
+        self.__update_signals()
 
     def run_selector(self):
-        """执行选股：优先输出大级别的机会"""
-        s = self.signals
+        """执行选股：优先输出大级别的机会；获取K线失败的级别没有信号，依赖这些信号的条件不成立"""
+        s = defaultdict(lambda: None, self.signals)
         if s['30分钟_第N笔涨跌力度'] == '向下笔新低盘背' or s['5分钟_五笔趋势类背驰'] == 'down':
             if s['日线_三笔回调构成第三买卖点'] == '三买':
                 return "日线三笔回调构成第三买点"
@@ -67,8 +117,9 @@ class CzscTrader:
 
     def take_snapshot(self, file_html, width="950px", height="480px"):
         tab = Tab(page_title="{}的交易快照@{}".format(self.symbol, self.end_dt.strftime("%Y-%m-%d %H:%M")))
-        for freq in self.freqs:
-            chart = ka_to_echarts(self.kas[freq], width, height)
+        # 只输出获取到K线的级别
+        for freq, ka in self.kas.items():
+            chart = ka_to_echarts(ka, width, height)
             tab.add(chart, freq)
 
         headers = ["名称", "数据"]
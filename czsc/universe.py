@@ -0,0 +1,264 @@
+# coding: utf-8
+"""
+
+全市场批量分析：把大量标的、多个级别的K线分片交给进程池计算
+
+K线不随任务序列化传给子进程：主进程先把全部K线拼接成两个连续数组（dt 为 int64 纳秒时间戳，
+open/close/high/low/vol 为 float64），写入临时目录中的 .npy 文件，子进程以内存映射的方式打开，
+任务中只传递每个标的、每个级别在数组中的起止位置。子进程返回的分型、笔、线段用 pack_records 按列打包，
+主进程收到后再还原，因此进程间传递的数据量很小。
+
+screen_universe 面向实盘选股：每个标的创建一个 CzscTrader，耗时主要是等待网络请求，所以在线程池中同时完成
+获取K线、计算信号以及 run_selector；每完成一个标的就追加写入检查点文件，中断之后再次运行会跳过已完成的标的。
+"""
+import os
+import pickle
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from .signals import KlineSignals
+from .trader import CzscTrader
+from .data.jq import get_token
+from .utils.store import pack_records, unpack_records, save_frame
+
+FIELDS = ('open', 'close', 'high', 'low', 'vol')
+
+DEFAULT_CONFIG = {
+    "cls": KlineSignals,
+    "bi_mode": "new",
+    "max_count": 1000,
+    "use_xd": False,
+    "use_ta": False,
+}
+
+# 子进程中内存映射打开的K线数组：(dt, values)
+_shared = None
+
+
+def pack_universe(bars_by_symbol, name="本级别"):
+    """把全部标的、全部级别的K线拼接成连续数组
+
+    :param bars_by_symbol: dict
+        symbol -> K线；K线可以是 DataFrame 或 list of dict，多个级别时为 {级别名称: K线}
+    :param name: str
+        只有一个级别时使用的级别名称
+    :return: (np.array, np.array, list)
+        dt - int64 纳秒时间戳；values - float64 二维数组，列依次为 open/close/high/low/vol；
+        index - [(symbol, [(级别名称, start, end), ...]), ...]
+    """
+    dts, values, index = [], [], []
+    n = 0
+    for symbol, levels in bars_by_symbol.items():
+        if not isinstance(levels, dict):
+            levels = {name: levels}
+        spans = []
+        for level, bars in levels.items():
+            df = bars if isinstance(bars, pd.DataFrame) else pd.DataFrame(list(bars))
+            dts.append(pd.to_datetime(df['dt']).values.view(np.int64))
+            values.append(df[list(FIELDS)].values.astype(np.float64))
+            spans.append((level, n, n + len(df)))
+            n += len(df)
+        index.append((symbol, spans))
+
+    if not dts:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(FIELDS))), index
+    return np.concatenate(dts), np.concatenate(values), index
+
+
+def _attach(file_dt, file_values):
+    """子进程初始化：以内存映射的方式打开K线数组"""
+    global _shared
+    _shared = (np.load(file_dt, mmap_mode='r'), np.load(file_values, mmap_mode='r'))
+
+
+def _analyze_symbol(symbol, spans, config):
+    """分析单个标的的全部级别，分型、笔、线段按列打包返回"""
+    dt, values = _shared
+    config = dict(config)
+    cls = config.pop("cls")
+    res = {"symbol": symbol, "levels": {}, "signals": {"symbol": symbol}, "error": None}
+    try:
+        for level, start, end in spans:
+            kline = pd.DataFrame({"symbol": symbol, "dt": dt[start: end].view("datetime64[ns]")})
+            for i, f in enumerate(FIELDS):
+                kline[f] = values[start: end, i]
+            ka = cls(kline, name=level, **config)
+            res['levels'][level] = {
+                "end_dt": ka.end_dt,
+                "latest_price": ka.latest_price,
+                "fx_list": pack_records(list(ka.fx_list)),
+                "bi_list": pack_records(list(ka.bi_list)),
+                "xd_list": pack_records(list(ka.xd_list)),
+            }
+            if hasattr(ka, "get_signals"):
+                res['signals'].update(ka.get_signals())
+    except Exception:
+        res['error'] = traceback.format_exc()
+    return res
+
+
+def _analyze_chunk(tasks, config):
+    """分析一批标的"""
+    return [_analyze_symbol(symbol, spans, config) for symbol, spans in tasks]
+
+
+def _unpack(res, dt_cache):
+    """在主进程中还原子进程返回的结果"""
+    for level in res['levels'].values():
+        for key in ("fx_list", "bi_list", "xd_list"):
+            level[key] = unpack_records(level[key], dt_cache)
+    return res
+
+
+def iter_universe(bars_by_symbol, config=None, workers=None, chunk_size=None, name="本级别"):
+    """批量分析全部标的，按完成顺序逐个返回结果
+
+    :param bars_by_symbol: dict
+        symbol -> K线；K线可以是 DataFrame 或 list of dict，多个级别时为 {级别名称: K线}
+    :param config: dict
+        分析参数；cls 为使用的分析类，默认 KlineSignals，其余参数原样传给 cls。
+        cls 有 get_signals 方法时，同时计算各级别信号
+    :param workers: int
+        进程数量，默认为 CPU 数量；workers <= 1 时在当前进程中计算
+    :param chunk_size: int
+        每个任务包含的标的数量，默认让每个进程分到约 4 个任务
+    :param name: str
+        只有一个级别时使用的级别名称
+    :return: iterator of dict
+        {"symbol": 标的, "signals": 全部级别的信号, "error": 异常信息或 None,
+         "levels": {级别名称: {"end_dt", "latest_price", "fx_list", "bi_list", "xd_list"}}}
+    """
+    cfg = dict(DEFAULT_CONFIG)
+    cfg.update(config or {})
+    workers = workers or os.cpu_count() or 1
+
+    global _shared
+    dt, values, index = pack_universe(bars_by_symbol, name=name)
+    dt_cache = {}
+    if workers <= 1 or len(index) <= 1:
+        _shared = (dt, values)
+        try:
+            for symbol, spans in index:
+                yield _unpack(_analyze_symbol(symbol, spans, cfg), dt_cache)
+        finally:
+            _shared = None
+        return
+
+    chunk_size = chunk_size or max(1, len(index) // (workers * 4))
+    chunks = [index[i: i + chunk_size] for i in range(0, len(index), chunk_size)]
+    with tempfile.TemporaryDirectory(prefix="czsc_") as path:
+        file_dt, file_values = os.path.join(path, "dt.npy"), os.path.join(path, "values.npy")
+        np.save(file_dt, dt)
+        np.save(file_values, values)
+        del dt, values
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_attach,
+                                 initargs=(file_dt, file_values)) as executor:
+            futures = [executor.submit(_analyze_chunk, chunk, cfg) for chunk in chunks]
+            for future in as_completed(futures):
+                for res in future.result():
+                    yield _unpack(res, dt_cache)
+
+
+def analyze_universe(bars_by_symbol, config=None, workers=None, chunk_size=None, name="本级别"):
+    """批量分析全部标的，参数见 iter_universe
+
+    :return: dict
+        symbol -> 分析结果，顺序与 bars_by_symbol 一致
+    """
+    results = {res['symbol']: res for res in iter_universe(bars_by_symbol, config, workers, chunk_size, name)}
+    return {symbol: results[symbol] for symbol in bars_by_symbol}
+
+
+def _screen_symbol(symbol, timeout, token):
+    """对单个标的执行 CzscTrader 选股"""
+    res = {"symbol": symbol, "selector": None, "end_dt": None, "latest_price": None, "error": None}
+    try:
+        ct = CzscTrader(symbol, timeout=timeout, token=token)
+        res.update({"selector": ct.run_selector(), "end_dt": ct.end_dt, "latest_price": ct.latest_price})
+    except Exception:
+        res['error'] = traceback.format_exc()
+    return res
+
+
+def _load_checkpoint(file_checkpoint):
+    """读取检查点文件中已完成的结果
+
+    :return: (dict, int)
+        symbol -> 结果，以及最后一条完整记录结束的位置；之后的内容是中断时没有写完的记录，继续写入之前需要截掉
+    """
+    done, offset = {}, 0
+    if not os.path.exists(file_checkpoint):
+        return done, offset
+    with open(file_checkpoint, 'rb') as f:
+        while True:
+            try:
+                res = pickle.load(f)
+                done[res['symbol']] = res
+            except Exception:
+                break
+            offset = f.tell()
+    return done, offset
+
+
+def screen_universe(symbols, file_output, workers=16, timeout=30, file_checkpoint=None, verbose=False):
+    """全市场选股：在线程池中对每个标的执行 CzscTrader.run_selector
+
+    获取K线的耗时远大于计算信号的耗时，主要是等待网络请求，使用线程池即可，不需要在每个子进程中重新导入依赖、
+    序列化结果；全部标的共用一个调用凭证。每完成一个标的，结果立即追加到检查点文件；
+    中断之后用相同参数再次运行，只处理没有完成或者出错的标的。全部结果写入 file_output 之后删除检查点文件。
+
+    :param symbols: list of str
+        聚宽标的代码，如 get_index_stocks("000300.XSHG") 的返回值
+    :param file_output: str
+        结果文件路径，按后缀保存为 parquet / feather / pkl / csv
+    :param workers: int
+        同时处理的标的数量；workers <= 1 时在当前线程中逐个处理
+    :param timeout: float
+        每个级别获取K线的超时时间（秒）
+    :param file_checkpoint: str
+        检查点文件路径，默认为 file_output + ".ckpt"
+    :param verbose: bool
+        是否输出进度
+    :return: pd.DataFrame
+        每行对应一个标的，顺序与 symbols 一致，列为 symbol/selector/end_dt/latest_price/error
+    """
+    file_checkpoint = file_checkpoint or file_output + ".ckpt"
+    done, offset = _load_checkpoint(file_checkpoint)
+    todo = [x for x in dict.fromkeys(symbols) if x not in done or done[x]['error'] is not None]
+    if verbose:
+        print("全部标的 {} 个，已完成 {} 个，本次处理 {} 个".format(len(symbols), len(symbols) - len(todo), len(todo)))
+
+    if todo:
+        token = get_token()
+        with open(file_checkpoint, 'ab') as f:
+            # 截掉上次中断时没有写完的记录，新记录紧接在最后一条完整记录之后
+            f.truncate(offset)
+
+            def save(res):
+                done[res['symbol']] = res
+                pickle.dump(res, f)
+                f.flush()
+
+            if workers <= 1:
+                for symbol in todo:
+                    save(_screen_symbol(symbol, timeout, token))
+            else:
+                with ThreadPoolExecutor(max_workers=min(workers, len(todo))) as executor:
+                    futures = [executor.submit(_screen_symbol, symbol, timeout, token) for symbol in todo]
+                    for future in as_completed(futures):
+                        save(future.result())
+
+    df = pd.DataFrame([done[x] for x in dict.fromkeys(symbols)],
+                      columns=["symbol", "selector", "end_dt", "latest_price", "error"])
+    df['end_dt'] = pd.to_datetime(df['end_dt'])
+    df['latest_price'] = df['latest_price'].astype(float)
+    df['selector'] = df['selector'].astype('category')
+    save_frame(df, file_output)
+    if os.path.exists(file_checkpoint):
+        os.remove(file_checkpoint)
+    return df
@@ -4,4 +4,6 @@ from .plot import ka_to_echarts, ka_to_image
 from .echarts_plot import kline_pro, heat_map
 from .kline_generator import KlineGeneratorBy1Min, KlineGeneratorByTick
 from .ta import KDJ, MACD, EMA, SMA
+from .store import ColumnStore
+from .perf import StageTimer
 
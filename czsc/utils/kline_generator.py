@@ -34,6 +34,11 @@ class KlineGeneratorBase:
             self.end_dt = self.m1[-1]['dt']
             self.symbol = self.m1[-1]['symbol']
 
+    def _trim(self, bars):
+        """原地淘汰超出 max_count 的K线"""
+        if len(bars) > self.max_count:
+            del bars[:len(bars) - self.max_count]
+
     def init_kline(self, freq, kline):
         """输入K线进行初始化
 
@@ -184,7 +189,7 @@ class KlineGeneratorByTick(KlineGeneratorBase):
                     next_bar = self.__update_from_tick(last, tick)
                     next_bar['dt'] = next_end_dt
                     m[-1] = next_bar
-            fm_map[minute] = m[-self.max_count:]
+            self._trim(m)
 
     def __update_d(self, tick=None):
         if "日线" not in self.freqs:
@@ -198,7 +203,7 @@ class KlineGeneratorByTick(KlineGeneratorBase):
                 self.D.append(self.__init_bar_from_tick(tick))
             else:
                 self.D[-1] = self.__update_from_tick(last, tick)
-        self.D = self.D[-self.max_count:]
+        self._trim(self.D)
 
     def __update_w(self, tick=None):
         if "周线" not in self.freqs:
@@ -212,7 +217,7 @@ class KlineGeneratorByTick(KlineGeneratorBase):
                 self.W.append(self.__init_bar_from_tick(tick))
             else:
                 self.W[-1] = self.__update_from_tick(last, tick)
-        self.W = self.W[-self.max_count:]
+        self._trim(self.W)
 
     def update(self, tick=None):
         """输入1分钟最新K线 或 tick，更新其他级别K线
@@ -280,7 +285,7 @@ class KlineGeneratorBy1Min(KlineGeneratorBase):
             else:
                 raise ValueError("1分钟新K线的时间必须大于等于最后一根K线的时间")
 
-        self.m1 = self.m1[-self.max_count:]
+        self._trim(self.m1)
 
     def __update_minutes(self, k=None, minutes=(5, 15, 30, 60)):
         # 更新分钟线
@@ -300,7 +305,7 @@ class KlineGeneratorBy1Min(KlineGeneratorBase):
                 else:
                     next_bar = self.__update_from_1min(last, k)
                     m[-1] = next_bar
-            fm_map[minute] = m[-self.max_count:]
+            self._trim(m)
 
     def __update_d(self, k=None):
         if "日线" not in self.freqs:
@@ -314,7 +319,7 @@ class KlineGeneratorBy1Min(KlineGeneratorBase):
         else:
             self.D[-1] = self.__update_from_1min(last, k)
 
-        self.D = self.D[-self.max_count:]
+        self._trim(self.D)
 
     def __update_w(self, k=None):
         if "周线" not in self.freqs:
@@ -327,7 +332,7 @@ class KlineGeneratorBy1Min(KlineGeneratorBase):
         else:
             self.W[-1] = self.__update_from_1min(last, k)
 
-        self.W = self.W[-self.max_count:]
+        self._trim(self.W)
 
     def update(self, k=None):
         """输入1分钟最新K线，更新其他级别K线
@@ -0,0 +1,118 @@
+# coding: utf-8
+"""
+
+分阶段耗时统计
+
+用于定位 KlineAnalyze.update 的耗时来自哪个阶段。每个阶段记录调用次数、累计耗时、最大耗时，
+以及按对数分桶的耗时直方图（每翻一倍分 8 个桶，误差约 9%），内存占用固定，用于估计 p50/p99。
+"""
+import math
+import time
+import pandas as pd
+
+BUCKETS_PER_DOUBLING = 8
+
+
+def _bucket(seconds):
+    ns = seconds * 1e9
+    return int(math.log2(ns) * BUCKETS_PER_DOUBLING) if ns >= 1 else 0
+
+
+def _bucket_value(bucket):
+    """桶的上界，单位：秒"""
+    return 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) / 1e9
+
+
+class StageStats:
+    """单个阶段的耗时统计"""
+    __slots__ = ('count', 'total', 'max', 'hist')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hist = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        b = _bucket(seconds)
+        self.hist[b] = self.hist.get(b, 0) + 1
+
+    def percentile(self, q):
+        """耗时的 q 分位数（0 ~ 100），单位：秒"""
+        if not self.count:
+            return float('nan')
+        rank = q / 100 * self.count
+        n = 0
+        for b in sorted(self.hist):
+            n += self.hist[b]
+            if n >= rank:
+                return min(_bucket_value(b), self.max)
+        return self.max
+
+
+class StageTimer:
+    """分阶段计时器
+
+    用法：start() 开始一次计时，之后每完成一个阶段调用一次 lap(stage)，最后 stop() 结束本次计时并记录总耗时。
+    设置了 sink 时，每次 stop() 都会调用 sink(name, timings)，timings 为本次各阶段的耗时（秒），
+    可以把数据推送到日志或者监控系统。
+    """
+
+    def __init__(self, sink=None):
+        """
+
+        :param sink: callable
+            接收每次计时结果的函数，参数为 (name, timings)
+        """
+        self.sink = sink
+        self.stats = {}
+        self._t0 = None
+        self._t = None
+        self._laps = None
+
+    def start(self):
+        """开始一次计时"""
+        self._laps = {} if self.sink is not None else None
+        self._t0 = self._t = time.perf_counter()
+
+    def lap(self, stage):
+        """记录从上一个阶段结束到现在的耗时"""
+        t = time.perf_counter()
+        self.record(stage, t - self._t)
+        self._t = time.perf_counter()
+
+    def stop(self, name=None, stage="total"):
+        """结束本次计时，记录总耗时，并把本次结果发送给 sink"""
+        self.record(stage, time.perf_counter() - self._t0)
+        if self._laps is not None:
+            laps, self._laps = self._laps, None
+            self.sink(name, laps)
+
+    def record(self, stage, seconds):
+        """记录某个阶段的一次耗时"""
+        stats = self.stats.get(stage)
+        if stats is None:
+            stats = self.stats[stage] = StageStats()
+        stats.add(seconds)
+        if self._laps is not None:
+            self._laps[stage] = self._laps.get(stage, 0.0) + seconds
+
+    def reset(self):
+        """清空统计结果"""
+        self.stats = {}
+
+    def summary(self):
+        """各阶段的耗时统计，耗时单位为微秒
+
+        :return: pd.DataFrame
+        """
+        rows = []
+        for stage, s in self.stats.items():
+            rows.append({"stage": stage, "count": s.count, "total": s.total * 1e6,
+                         "mean": s.total / s.count * 1e6, "p50": s.percentile(50) * 1e6,
+                         "p99": s.percentile(99) * 1e6, "max": s.max * 1e6})
+        return pd.DataFrame(rows, columns=["stage", "count", "total", "mean", "p50", "p99", "max"])
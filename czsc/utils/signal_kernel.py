@@ -0,0 +1,161 @@
+# coding: utf-8
+"""
+
+单级别信号的 numba 内核：一次计算最近 10 笔的全部信号
+
+KlineSignals、MachineKlineSignals 的笔信号都来自最近 10 笔（get_bi_fd(n=10)）的涨跌力度、第三类买卖点、井、
+五笔趋势类背驰以及笔中枢，两者的信号有大量重叠；bd 信号两者完全相同。这里一次计算两者的并集，
+每个信号类只读取自己需要的部分。结果与 czsc.signals 中的 check_dynamic、check_third_bs、check_jing 完全一致，
+字符串取值按 czsc.signals 中 DYNAMIC、THIRD_BS、JING、DIRECTION 的顺序编码为整数。
+"""
+import numpy as np
+import numba
+
+# bi_kernel 返回的 codes 中各信号的位置
+DIR = 0             # 第N笔方向
+BC = 1              # 五笔趋势类背驰
+DYN = 2             # 第N、N-1、N-2、N-3笔涨跌力度，占 4 个位置
+TBS = 6             # 第N、N-1、N-2、N-3笔第三买卖，占 4 个位置
+JING = 10           # 第N、N-1、N-2笔出井，占 3 个位置
+NEW_HIGH = 13       # 第N-1笔创近6笔新高
+NEW_LOW = 14        # 第N-1笔创近6笔新低
+N_CODES = 15
+
+
+@numba.njit()
+def _dynamic(high, low, pp, vp, up, i1, i3, i5):
+    """与 check_dynamic(fd1, fd3, fd5) 一致，返回 DYNAMIC 中的下标"""
+    stronger = pp[i5] > pp[i3] and pp[i5] > pp[i1] and vp[i5] > vp[i3] and vp[i5] > vp[i1]
+    if up[i5]:
+        if high[i5] < high[i3] or high[i5] < high[i1]:
+            return 1
+        return 2 if stronger else 3
+    if low[i5] > low[i3] or low[i5] > low[i1]:
+        return 4
+    return 5 if stronger else 6
+
+
+@numba.njit()
+def _third_bs(high, low, i1, i2, i3, i4, i5):
+    """与 check_third_bs(fd1, ..., fd5) 一致，返回 THIRD_BS 中的下标"""
+    zs_d = max(low[i1], low[i2], low[i3])
+    zs_g = min(high[i1], high[i2], high[i3])
+    v = 0
+    if high[i5] < zs_d < zs_g and low[i4] < min(low[i1], low[i3]):
+        v = 2
+    if low[i5] > zs_g > zs_d and high[i4] > max(high[i1], high[i3]):
+        v = 1
+    return v
+
+
+@numba.njit()
+def _jing(high, low, pp, vp, up, i1, i2, i3, i4, i5):
+    """与 check_jing(fd1, ..., fd5) 一致，返回 JING 中的下标"""
+    zs_g = min(high[i2], high[i3], high[i4])
+    zs_d = max(low[i2], low[i3], low[i4])
+
+    if pp[i1] < pp[i5] < pp[i3] and vp[i1] < vp[i5] < vp[i3]:
+        return 0
+
+    v = 0
+    if zs_d < zs_g:
+        if up[i1] and high[i5] > min(high[i3], high[i1]):
+            if high[i5] > high[i3] > high[i1] and pp[i5] < pp[i3] < pp[i1] and vp[i5] < vp[i3] < vp[i1]:
+                v = 1
+            if high[i1] < high[i5] < high[i3] and pp[i5] < pp[i1] and vp[i5] < vp[i1]:
+                v = 2
+            if high[i5] > high[i3] > high[i1] and pp[i1] > pp[i5] > pp[i3] and vp[i1] > vp[i5] > vp[i3]:
+                v = 2
+
+        if not up[i1] and low[i5] < max(low[i3], low[i1]):
+            if low[i5] < low[i3] < low[i1] and pp[i5] < pp[i3] < pp[i1] and vp[i5] < vp[i3] < vp[i1]:
+                v = 3
+            if low[i1] > low[i5] > low[i3] and pp[i5] < pp[i1] and vp[i5] < vp[i1]:
+                v = 4
+            if low[i5] < low[i3] < low[i1] and pp[i1] > pp[i5] > pp[i3] and vp[i1] > vp[i5] > vp[i3]:
+                v = 4
+    else:
+        if pp[i1] > pp[i3] > pp[i5] and vp[i1] > vp[i3] > vp[i5]:
+            if up[i1] and high[i5] > high[i3] > high[i1]:
+                v = 2
+            if not up[i1] and low[i5] < low[i3] < low[i1]:
+                v = 4
+    return v
+
+
+@numba.njit()
+def bi_kernel(bi: np.array, vol_power: np.array):
+    """计算最近 10 笔的全部笔信号
+
+    :param bi: np.array
+        最近 11 个笔标记的价格，第 i 笔为 bi[i] -> bi[i + 1]
+    :param vol_power: np.array
+        10 笔各自的成交量力度，与 KlineAnalyze.calculate_vol_power 一致
+    :return: tuple of np.array
+        codes - int8 数组，各信号的位置见模块中的常量；zs - [最近一个笔中枢ZD, 最近一个笔中枢ZG]
+    """
+    n = len(bi) - 1
+    high = np.empty(n)
+    low = np.empty(n)
+    pp = np.empty(n)
+    up = np.empty(n, dtype=np.bool_)
+    for i in range(n):
+        b1, b2 = bi[i], bi[i + 1]
+        high[i] = max(b1, b2)
+        low[i] = min(b1, b2)
+        pp[i] = abs(b1 - b2)
+        up[i] = b1 < b2
+    vp = vol_power
+
+    codes = np.zeros(N_CODES, dtype=np.int8)
+    k = n - 1  # 第N笔
+    codes[DIR] = 1 if up[k] else 2
+
+    if pp[k] < pp[k - 2] and vp[k] < vp[k - 2]:
+        if low[k - 4] > low[k - 2] > low[k] and high[k - 4] > high[k - 2] > high[k] \
+                and not up[k] and high[k - 1] < low[k - 3]:
+            codes[BC] = 2
+        if low[k - 4] < low[k - 2] < low[k] and high[k - 4] < high[k - 2] < high[k] \
+                and up[k] and low[k - 1] > high[k - 3]:
+            codes[BC] = 1
+
+    for j in range(4):
+        e = k - j
+        codes[DYN + j] = _dynamic(high, low, pp, vp, up, e - 4, e - 2, e)
+        codes[TBS + j] = _third_bs(high, low, e - 4, e - 3, e - 2, e - 1, e)
+    for j in range(3):
+        e = k - j
+        codes[JING + j] = _jing(high, low, pp, vp, up, e - 4, e - 3, e - 2, e - 1, e)
+
+    h6 = high[k - 6]
+    l6 = low[k - 6]
+    for i in range(k - 5, k):
+        h6 = max(h6, high[i])
+        l6 = min(l6, low[i])
+    codes[NEW_HIGH] = h6 == high[k - 1] and up[k - 1]
+    codes[NEW_LOW] = l6 == low[k - 1] and not up[k - 1]
+
+    zs = np.empty(2)
+    zs[0] = max(low[k - 4], low[k - 3], low[k - 2])
+    zs[1] = min(high[k - 4], high[k - 3], high[k - 2])
+    if zs[1] < zs[0]:
+        zs[0] = max(low[k - 3], low[k - 2], low[k - 1])
+        zs[1] = min(high[k - 3], high[k - 2], high[k - 1])
+    return codes, zs
+
+
+@numba.njit()
+def bd_kernel(bi: np.array):
+    """由最近 16 个笔标记组成 5 段相互重叠的走势，判断第三类买卖点
+
+    :param bi: np.array
+        最近 16 个笔标记的价格
+    :return: int
+        THIRD_BS 中的下标
+    """
+    high = np.empty(5)
+    low = np.empty(5)
+    for i in range(5):
+        high[i] = bi[3 * i: 3 * i + 4].max()
+        low[i] = bi[3 * i: 3 * i + 4].min()
+    return _third_bs(high, low, 0, 1, 2, 3, 4)
@@ -0,0 +1,404 @@
+# coding: utf-8
+"""
+列式存储：用预分配的 numpy 数组保存 K 线、均线、MACD 等按时间排列的序列；
+以及用于快速计算区间和的前缀和索引
+
+dt 列保存为 int64（纳秒时间戳），其余列保存为 float64；按下标读取时临时构造 dict，
+这些 dict 只是兼容层视图，修改它们不会影响存储中的数据。
+"""
+import os
+from bisect import bisect_left, bisect_right
+import numpy as np
+import pandas as pd
+from ..objects import Record
+
+
+def to_ns(dt):
+    """把时间转换成 int64 纳秒时间戳"""
+    if isinstance(dt, pd.Timestamp):
+        return dt.value
+    return pd.Timestamp(dt).value
+
+
+class ColumnStore:
+    """列式序列存储，支持 list of dict 的常用操作
+
+    数据保存在 [start, end) 区间内：头部淘汰只移动 start 指针；尾部空间不足时，
+    如果头部空出的空间足够就整体前移，否则按 1.5 倍扩容。因此 append 与头部删除都是均摊 O(1)，
+    同时每一列始终是一段连续内存，可以直接切片用于向量化计算。
+    """
+
+    def __init__(self, fields, symbol=None, capacity=256, row_type=None):
+        """
+
+        :param fields: tuple of str
+            除 dt 之外的列名，如 ('open', 'close', 'high', 'low', 'vol')
+        :param symbol: str
+            标的代码，不为 None 时，读取出的 dict 中会带上 symbol
+        :param capacity: int
+            初始容量
+        :param row_type: type
+            按下标读取时构造的对象类型，如 czsc.objects.RawBar，按 (symbol, dt, *fields) 的顺序传参；
+            为 None 时构造 dict
+        """
+        self.fields = tuple(fields)
+        self.symbol = symbol
+        self.row_type = row_type
+        capacity = max(int(capacity), 8)
+        self._dt = np.empty(capacity, dtype=np.int64)
+        self._cols = {f: np.empty(capacity, dtype=np.float64) for f in self.fields}
+        self._start = 0
+        self._end = 0
+
+    @classmethod
+    def from_records(cls, records, fields, symbol=None, row_type=None):
+        """从 list of dict 创建"""
+        store = cls(fields, symbol=symbol, capacity=len(records) * 3 // 2, row_type=row_type)
+        for r in records:
+            store.append(r)
+        return store
+
+    @classmethod
+    def from_arrays(cls, dt, columns, symbol=None, row_type=None):
+        """从数组创建
+
+        :param dt: np.array
+            int64 纳秒时间戳，或者 datetime64 数组
+        :param columns: dict
+            列名 -> 数组
+        :param symbol: str
+        :param row_type: type
+        :return: ColumnStore
+        """
+        store = cls(columns.keys(), symbol=symbol, capacity=len(dt) * 3 // 2, row_type=row_type)
+        store.extend_arrays(dt, columns)
+        return store
+
+    def __repr__(self):
+        return "<ColumnStore fields={}; length={}>".format(self.fields, len(self))
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __iter__(self):
+        for i in range(self._start, self._end):
+            yield self._row(i)
+
+    @property
+    def capacity(self):
+        return len(self._dt)
+
+    @property
+    def nbytes(self):
+        """存储占用的字节数"""
+        return self._dt.nbytes + sum(x.nbytes for x in self._cols.values())
+
+    def _row(self, i):
+        if self.row_type is not None:
+            return self.row_type(self.symbol, pd.Timestamp(int(self._dt[i])),
+                                 *[float(self._cols[f][i]) for f in self.fields])
+        row = {"symbol": self.symbol} if self.symbol is not None else {}
+        row['dt'] = pd.Timestamp(int(self._dt[i]))
+        for f in self.fields:
+            row[f] = float(self._cols[f][i])
+        return row
+
+    def _index(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("ColumnStore index out of range")
+        return self._start + i
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            return [self._row(self._start + i) for i in range(start, stop, step)]
+        return self._row(self._index(item))
+
+    def __setitem__(self, item, row):
+        if isinstance(item, slice):
+            raise TypeError("ColumnStore 不支持切片赋值")
+        self._write(self._index(item), row)
+
+    def __delitem__(self, item):
+        """只支持删除头部或尾部的连续区间，如 del s[:10]、del s[-2:]"""
+        n = len(self)
+        if isinstance(item, slice):
+            start, stop, step = item.indices(n)
+            if step != 1:
+                raise ValueError("ColumnStore 只支持删除连续区间")
+            if stop <= start:
+                return
+            if start == 0:
+                self._start += stop
+            elif stop == n:
+                self._end = self._start + start
+            else:
+                raise ValueError("ColumnStore 只支持删除头部或尾部的区间")
+        else:
+            i = item + n if item < 0 else item
+            if i == 0:
+                self._start += 1
+            elif i == n - 1:
+                self._end -= 1
+            else:
+                raise ValueError("ColumnStore 只支持删除头部或尾部的元素")
+
+    def _write(self, i, row):
+        self._dt[i] = to_ns(row['dt'])
+        for f in self.fields:
+            self._cols[f][i] = row[f]
+
+    def _reserve(self, count):
+        """确保尾部至少还有 count 个空位"""
+        if self._end + count <= self.capacity:
+            return
+        n = len(self)
+        capacity = self.capacity
+        if (n + count) * 4 > capacity * 3:
+            capacity = (n + count) * 3 // 2
+        dt = np.empty(capacity, dtype=np.int64)
+        dt[:n] = self._dt[self._start: self._end]
+        self._dt = dt
+        for f in self.fields:
+            col = np.empty(capacity, dtype=np.float64)
+            col[:n] = self._cols[f][self._start: self._end]
+            self._cols[f] = col
+        self._start, self._end = 0, n
+
+    def append(self, row):
+        self._reserve(1)
+        self._write(self._end, row)
+        self._end += 1
+
+    def extend_arrays(self, dt, columns):
+        """批量追加数组数据"""
+        dt = np.asarray(dt)
+        if dt.dtype.kind == 'M':
+            dt = dt.astype('datetime64[ns]').view(np.int64)
+        count = len(dt)
+        self._reserve(count)
+        self._dt[self._end: self._end + count] = dt
+        for f in self.fields:
+            self._cols[f][self._end: self._end + count] = columns[f]
+        self._end += count
+
+    def pop(self, i=-1):
+        row = self[i]
+        del self[i]
+        return row
+
+    def values(self, field):
+        """获取某一列的数组视图，dt 列返回 int64 纳秒时间戳"""
+        if field == 'dt':
+            return self._dt[self._start: self._end]
+        return self._cols[field][self._start: self._end]
+
+    def __getstate__(self):
+        # 只保存有效区间内的数据
+        state = dict(self.__dict__)
+        state['_dt'] = self._dt[self._start: self._end].copy()
+        state['_cols'] = {f: c[self._start: self._end].copy() for f, c in self._cols.items()}
+        state['_start'], state['_end'] = 0, len(self)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reserve(len(self) // 2 + 8)
+
+    def search(self, start_dt, end_dt):
+        """返回 start_dt <= dt <= end_dt 的下标区间 [i, j)"""
+        dt = self.values('dt')
+        i = np.searchsorted(dt, to_ns(start_dt), side='left')
+        j = np.searchsorted(dt, to_ns(end_dt), side='right')
+        return int(i), int(j)
+
+
+class PrefixSumIndex:
+    """按时间升序排列的前缀和索引，任意时间区间内各列之和的查询复杂度为 O(log n)
+
+    支持尾部追加、替换最后一个元素以及头部淘汰；头部淘汰只移动指针，
+    淘汰的元素超过一半时才整体前移，并把前缀和重新以 0 为基数，避免累计值无限增大。
+    时间统一保存为 int64 纳秒时间戳。
+    """
+
+    def __init__(self, fields):
+        """
+
+        :param fields: tuple of str
+            需要计算区间和的列名
+        """
+        self.fields = tuple(fields)
+        self._dt = []
+        # _cum[f][k] 为下标 k 之前所有元素的和，长度比 _dt 多 1
+        self._cum = {f: [0.0] for f in self.fields}
+        self._start = 0
+
+    @classmethod
+    def from_arrays(cls, dt, columns):
+        """从数组创建
+
+        :param dt: list or np.array
+            升序排列的时间，可以是 datetime 列表、datetime64 数组或者 int64 纳秒时间戳数组
+        :param columns: dict
+            列名 -> 数组，数组中的 nan 按 0 处理
+        :return: PrefixSumIndex
+        """
+        index = cls(columns.keys())
+        index._dt = pd.DatetimeIndex(dt).asi8.tolist()
+        for f in index.fields:
+            values = np.nan_to_num(np.asarray(columns[f], dtype=np.float64))
+            index._cum[f] = [0.0] + np.cumsum(values).tolist()
+        return index
+
+    def __len__(self):
+        return len(self._dt) - self._start
+
+    def append(self, dt, values):
+        """追加一个元素，values 为 列名 -> 数值"""
+        self._dt.append(to_ns(dt))
+        for f in self.fields:
+            cum = self._cum[f]
+            v = values[f]
+            cum.append(cum[-1] + (v if v == v else 0.0))
+
+    def replace_last(self, dt, values):
+        """替换最后一个元素"""
+        self._dt[-1] = to_ns(dt)
+        for f in self.fields:
+            cum = self._cum[f]
+            v = values[f]
+            cum[-1] = cum[-2] + (v if v == v else 0.0)
+
+    def drop_head(self, n):
+        """淘汰头部 n 个元素"""
+        self._start = min(self._start + n, len(self._dt))
+        if self._start > 64 and self._start * 2 > len(self._dt):
+            s = self._start
+            self._dt = self._dt[s:]
+            for f in self.fields:
+                base = self._cum[f][s]
+                self._cum[f] = [x - base for x in self._cum[f][s:]]
+            self._start = 0
+
+    def __getstate__(self):
+        # 以数组形式保存，体积更小，恢复更快；头部指针原样保存，保证恢复后的累计误差与原对象一致
+        return {
+            "fields": self.fields,
+            "dt": np.array(self._dt, dtype=np.int64),
+            "cum": {f: np.array(self._cum[f], dtype=np.float64) for f in self.fields},
+            "start": self._start,
+        }
+
+    def __setstate__(self, state):
+        self.fields = state['fields']
+        self._dt = state['dt'].tolist()
+        self._cum = {f: state['cum'][f].tolist() for f in self.fields}
+        self._start = state['start']
+
+    def count_between(self, start_dt, end_dt):
+        """计算 start_dt < dt < end_dt 范围内的元素数量"""
+        i = bisect_right(self._dt, to_ns(start_dt), self._start)
+        j = bisect_left(self._dt, to_ns(end_dt), self._start)
+        return max(j - i, 0)
+
+    def sum(self, field, start_dt, end_dt):
+        """计算 start_dt <= dt <= end_dt 范围内 field 列的和"""
+        i = bisect_left(self._dt, to_ns(start_dt), self._start)
+        j = bisect_right(self._dt, to_ns(end_dt), self._start)
+        if j <= i:
+            return 0.0
+        cum = self._cum[field]
+        return cum[j] - cum[i]
+
+
+def pack_records(records):
+    """把 list of dict（或 czsc.objects 中的对象）按列打包，用于紧凑地序列化
+
+    所有元素类型相同、字段相同时，时间列保存为 int64 纳秒时间戳，数值列保存为 float64 / int64 数组，
+    其余列保存为 list；否则原样保存。
+
+    :param records: list
+    :return: dict
+    """
+    if not records:
+        return {"row_type": None, "records": list(records)}
+    row_type = type(records[0])
+    if row_type is not dict and not issubclass(row_type, Record):
+        return {"row_type": None, "records": list(records)}
+    keys = list(records[0].keys())
+    if any(type(x) is not row_type or list(x.keys()) != keys for x in records):
+        return {"row_type": None, "records": list(records)}
+
+    columns = []
+    for key in keys:
+        values = [x[key] for x in records]
+        if all(type(v) is pd.Timestamp for v in values):
+            index = pd.DatetimeIndex(values)
+            columns.append(("dt", index.asi8, None if index.tz is None else str(index.tz)))
+        elif all(isinstance(v, float) for v in values):
+            columns.append(("float", np.array(values, dtype=np.float64), None))
+        elif all(type(v) is int for v in values) and -2 ** 63 <= min(values) and max(values) < 2 ** 63:
+            columns.append(("int", np.array(values, dtype=np.int64), None))
+        else:
+            columns.append(("object", values, None))
+    return {"row_type": row_type, "keys": keys, "columns": columns}
+
+
+def unpack_records(packed, dt_cache=None):
+    """还原 pack_records 打包的数据
+
+    :param packed: dict
+    :param dt_cache: dict
+        纳秒时间戳 -> 时间 的缓存，还原多个序列时传入同一个 dict，相同的时间只创建一次
+    :return: list
+    """
+    row_type = packed['row_type']
+    if row_type is None:
+        return packed['records']
+
+    if dt_cache is None:
+        dt_cache = {}
+    columns = []
+    for kind, values, tz in packed['columns']:
+        if kind == "dt":
+            cache = dt_cache.setdefault(tz, {})
+            values = values.tolist()
+            missing = [v for v in set(values) if v not in cache]
+            if missing:
+                index = pd.DatetimeIndex(np.array(missing, dtype=np.int64))
+                if tz:
+                    index = index.tz_localize("UTC").tz_convert(tz)
+                cache.update(zip(missing, index.tolist()))
+            columns.append([cache[v] for v in values])
+        elif kind == "object":
+            columns.append(values)
+        else:
+            columns.append(values.tolist())
+
+    if row_type is dict:
+        keys = packed['keys']
+        return [dict(zip(keys, row)) for row in zip(*columns)]
+    return [row_type(*row) for row in zip(*columns)]
+
+
+def save_frame(df, file_output):
+    """按文件后缀保存 DataFrame：parquet / feather / pkl / csv
+
+    :param df: pd.DataFrame
+    :param file_output: str
+        结果文件路径
+    """
+    suffix = os.path.splitext(file_output)[1].lower()
+    if suffix == '.parquet':
+        df.to_parquet(file_output)
+    elif suffix == '.feather':
+        df.to_feather(file_output)
+    elif suffix == '.pkl':
+        df.to_pickle(file_output)
+    elif suffix == '.csv':
+        df.to_csv(file_output, index=False, encoding="utf-8")
+    else:
+        raise ValueError("不支持的文件格式：{}".format(file_output))
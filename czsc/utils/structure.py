@@ -0,0 +1,140 @@
+# coding: utf-8
+"""
+
+缠论结构识别的 numba 内核：去除包含关系、分型识别、笔识别
+
+所有函数都只接受、返回 numpy 数组，结果与 KlineAnalyze 中逐根K线识别的 Python 实现完全一致，
+用于初始化时批量识别大量K线。返回的都是下标，由调用方根据下标取原始K线中的值构造 dict。
+"""
+import numpy as np
+import numba
+
+
+@numba.njit()
+def remove_include(high: np.array, low: np.array):
+    """去除包含关系
+
+    与 KlineAnalyze._update_kline_new 一致：前两根K线原样保留，从第三根开始按方向合并包含关系。
+
+    :param high: np.array
+        原始K线最高价序列
+    :param low: np.array
+        原始K线最低价序列
+    :return: tuple of np.array
+        src - 每根无包含K线对应的原始K线下标，dt、vol 等取自该K线
+        high_src - 每根无包含K线的最高价来自哪根原始K线
+        low_src - 每根无包含K线的最低价来自哪根原始K线
+        merged - 是否经过合并，合并过的K线按原始K线的红绿重新设置 open、close
+    """
+    n = len(high)
+    src = np.empty(n, dtype=np.int64)
+    high_src = np.empty(n, dtype=np.int64)
+    low_src = np.empty(n, dtype=np.int64)
+    merged = np.zeros(n, dtype=np.bool_)
+    m = min(n, 2)
+    for i in range(m):
+        src[i] = i
+        high_src[i] = i
+        low_src[i] = i
+
+    for i in range(m, n):
+        last_h, last_l = high[high_src[m - 1]], low[low_src[m - 1]]
+        cur_h, cur_l = high[i], low[i]
+        if (cur_h <= last_h and cur_l >= last_l) or (cur_h >= last_h and cur_l <= last_l):
+            up = last_h > high[high_src[m - 2]]
+            hs, ls = high_src[m - 1], low_src[m - 1]
+            m -= 1
+            if up:
+                if cur_h > last_h:
+                    hs = i
+                if cur_l > last_l:
+                    ls = i
+            else:
+                if cur_h < last_h:
+                    hs = i
+                if cur_l < last_l:
+                    ls = i
+            src[m], high_src[m], low_src[m], merged[m] = i, hs, ls, True
+        else:
+            src[m], high_src[m], low_src[m], merged[m] = i, i, i, False
+        m += 1
+    return src[:m], high_src[:m], low_src[:m], merged[:m]
+
+
+@numba.njit()
+def find_fx(high: np.array, low: np.array, min_gap=0.002):
+    """识别分型
+
+    与 KlineAnalyze._update_fx_list 一致，顶分型优先于底分型。
+
+    :param high: np.array
+        无包含K线最高价序列
+    :param low: np.array
+        无包含K线最低价序列
+    :param min_gap: float
+        判断缺口的阈值，与 has_gap 一致
+    :return: tuple of np.array
+        pos - 分型中间那根K线的下标
+        mark - 1 表示顶分型，-1 表示底分型
+        gap - 分型的第一、二根K线之间是否有缺口
+    """
+    n = len(high)
+    pos = np.empty(max(n - 2, 0), dtype=np.int64)
+    mark = np.empty(max(n - 2, 0), dtype=np.int8)
+    gap = np.empty(max(n - 2, 0), dtype=np.bool_)
+    m = 0
+    for i in range(1, n - 1):
+        if high[i - 1] < high[i] > high[i + 1]:
+            mark[m] = 1
+        elif low[i - 1] > low[i] < low[i + 1]:
+            mark[m] = -1
+        else:
+            continue
+        pos[m] = i
+        gap[m] = high[i - 1] < low[i] * (1 - min_gap) or high[i] < low[i - 1] * (1 - min_gap)
+        m += 1
+    return pos[:m], mark[:m], gap[:m]
+
+
+@numba.njit()
+def find_bi(mark: np.array, fx: np.array, fx_high: np.array, fx_low: np.array,
+            start_pos: np.array, end_pos: np.array):
+    """识别笔
+
+    与 KlineAnalyze._update_bi_list 一致：以前两个分型作为起点，同类分型取更极端的一个，
+    异类分型之间必须有独立K线，并且两个分型之间不存在包含关系。
+
+    :param mark: np.array
+        分型标记，1 表示顶分型，-1 表示底分型
+    :param fx: np.array
+        分型的价格
+    :param fx_high: np.array
+        分型区间的最高价
+    :param fx_low: np.array
+        分型区间的最低价
+    :param start_pos: np.array
+        分型第一根K线的位置；新笔按原始K线计数，老笔按无包含K线计数
+    :param end_pos: np.array
+        分型最后一根K线的位置，计数方式与 start_pos 相同
+    :return: np.array
+        构成笔端点的分型下标
+    """
+    n = len(mark)
+    res = np.empty(n, dtype=np.int64)
+    if n < 2:
+        return res[:0]
+    res[0], res[1] = 0, 1
+    m = 2
+    for i in range(2, n):
+        last = res[m - 1]
+        if mark[last] == mark[i]:
+            if (mark[i] == 1 and fx[last] < fx[i]) or (mark[i] == -1 and fx[last] > fx[i]):
+                res[m - 1] = i
+        else:
+            if start_pos[i] - end_pos[last] <= 1:
+                continue
+            if (mark[last] == 1 and fx_low[i] < fx_low[last] and fx_high[i] < fx_high[last]) or \
+                    (mark[last] == -1 and fx_high[i] > fx_high[last] and fx_low[i] > fx_low[last]):
+                res[m] = i
+                m += 1
+    return res[:m]
@@ -1,7 +1,11 @@
 # coding: utf-8
 import os
+import copy
+import pickle
+import struct
+import numpy as np
 import pandas as pd
-from czsc.analyze import KlineAnalyze, find_zs
+from czsc.analyze import KlineAnalyze, find_zs, ta
 
 cur_path = os.path.split(os.path.realpath(__file__))[0]
 
@@ -149,4 +153,419 @@ def test_find_zs():
     assert fd1[-1]['fx_mark'] == fd2[-1]['fx_mark'] == fd3[-1]['fx_mark'] == fd4[-1]['fx_mark'] == 'g'
 
 
+def test_columnar():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    kline1 = kline.iloc[:2000]
+    kline2 = kline.iloc[2000:]
+
+    ka1 = KlineAnalyze(kline1, name="日线", max_count=1000, use_xd=True)
+    ka2 = KlineAnalyze(kline1, name="日线", max_count=1000, use_xd=True, columnar=True)
+    for _, row in kline2.iterrows():
+        ka1.update(row.to_dict())
+        ka2.update(row.to_dict())
+
+    assert 900 <= len(ka1.kline_raw) == len(ka2.kline_raw) <= 1000
+    assert len(ka1.kline_new) == len(ka2.kline_new)
+    assert ka1.kline_new[-1] == ka2.kline_new[-1]
+    assert ka1.fx_list == ka2.fx_list
+    assert ka1.bi_list == ka2.bi_list
+    assert ka1.xd_list == ka2.xd_list
+    assert [round(x['macd'], 4) for x in ka1.macd[-100:]] == [round(x['macd'], 4) for x in ka2.macd[-100:]]
+    assert [round(x['ma5'], 4) for x in ka1.ma[-100:]] == [round(x['ma5'], 4) for x in ka2.ma[-100:]]
+
+    start_dt, end_dt = ka1.bi_list[-2]['dt'], ka1.bi_list[-1]['dt']
+    assert ka1.calculate_vol_power(start_dt, end_dt) == ka2.calculate_vol_power(start_dt, end_dt)
+    assert round(ka1.calculate_macd_power(start_dt, end_dt), 4) == round(ka2.calculate_macd_power(start_dt, end_dt), 4)
+
+    # 列式存储读取出的 dict 只是视图，修改不影响分析结果
+    k = ka2.kline_raw[-1]
+    k['close'] = 0
+    assert ka2.kline_raw[-1]['close'] == ka1.kline_raw[-1]['close']
+
+
+def test_trim_history():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    max_count = 500
+    ka1 = KlineAnalyze(bars[:max_count], name="日线", max_count=max_count, use_xd=True)
+    ka2 = KlineAnalyze(bars[:max_count], name="日线", max_count=100000, use_xd=True)
+    trimmed = 0
+    for k in bars[max_count:]:
+        n = len(ka1.kline_raw)
+        ka1.update(k)
+        ka2.update(k)
+        # 稳定状态下K线数量始终在 max_count 的 90% ~ 100% 之间
+        assert max_count - max_count // 10 <= len(ka1.kline_raw) <= max_count
+        trimmed += len(ka1.kline_raw) < n
+    assert trimmed > 10
+
+    # 各序列按同一个时间边界淘汰，保留下来的部分与不淘汰的结果一致
+    first_dt = ka1.kline_raw[0]['dt']
+    assert ka1.ma[0]['dt'] == ka1.macd[0]['dt'] == first_dt
+    assert len(ka1.ma) == len(ka1.macd) == len(ka1.kline_raw)
+    for key in ['kline_raw', 'kline_new', 'ma', 'macd', 'fx_list', 'bi_list', 'xd_list']:
+        seq1 = [dict(x) for x in getattr(ka1, key)]
+        seq2 = [dict(x) for x in getattr(ka2, key) if x['dt'] >= first_dt]
+        assert seq1 and min(x['dt'] for x in seq1) >= first_dt
+        assert seq1 == seq2, key
+
+
+def test_update_xd_incremental():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    ka = KlineAnalyze(bars[:100], name="日线", max_count=5000, use_xd=True, use_ta=False)
+    for i, k in enumerate(bars[100:]):
+        ka.update(k)
+        if i % 20 == 0 or i == len(bars) - 101:
+            # 与使用全部笔标记从头识别的结果一致
+            ka_full = copy.copy(ka)
+            ka_full._xd_checkpoint = None
+            ka_full._update_xd_list()
+            assert ka.xd_list == ka_full.xd_list
+    assert ka._xd_checkpoint is not None
+
+
+def test_update_ta_streaming():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    ma_params = (5, 13, 21, 34, 55, 89, 144, 233)
+    ka = KlineAnalyze(bars[:500], name="日线", max_count=5000, ma_params=ma_params)
+    for k in bars[500:]:
+        # 先输入未完成的K线，再用完成的K线替换
+        k_ = dict(k)
+        k_.update({"close": k['open'], "high": k['open'], "low": k['open']})
+        ka.update(k_)
+        ka.update(k)
+
+    close = np.array([x['close'] for x in ka.kline_raw], dtype=np.double)
+    diff, dea, macd = ta.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
+    assert np.allclose([x['diff'] for x in ka.macd[-1000:]], diff[-1000:])
+    assert np.allclose([x['dea'] for x in ka.macd[-1000:]], dea[-1000:])
+    assert np.allclose([x['macd'] for x in ka.macd[-1000:]], macd[-1000:])
+    for p in ma_params:
+        assert np.allclose([x['ma%i' % p] for x in ka.ma[-1000:]], ta.SMA(close, p)[-1000:])
+
+    # 历史很短时开始逐根更新，结果与用全部K线重新计算一致：MACD 完全相同，均线只有求和顺序带来的舍入误差
+    ka1 = KlineAnalyze(bars[:30], name="日线", max_count=5000, ma_params=ma_params)
+    for k in bars[30:600]:
+        ka1.update(k)
+    ka2 = KlineAnalyze(bars[:600], name="日线", max_count=5000, ma_params=ma_params)
+    assert [dict(x) for x in ka1.macd] == [dict(x) for x in ka2.macd]
+    for p in ma_params:
+        assert np.allclose([x['ma%i' % p] for x in ka1.ma], [x['ma%i' % p] for x in ka2.ma])
+
+
+def test_power_index():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    ka = KlineAnalyze(bars[:1000], name="日线", max_count=500, use_xd=True)
+    for k in bars[1000:]:
+        k_ = dict(k)
+        k_.update({"close": k['open'], "vol": k['vol'] / 2})
+        ka.update(k_)
+        ka.update(k)
+
+    def brute_power(start_dt, end_dt):
+        macd = [x['macd'] for x in ka.macd if end_dt >= x['dt'] >= start_dt]
+        vol = [x['vol'] for x in ka.kline_raw if end_dt >= x['dt'] >= start_dt]
+        return sum(abs(x) for x in macd), sum(x for x in macd if x > 0), \
+            -sum(x for x in macd if x < 0), int(sum(vol))
+
+    points = ka.bi_list[-10:] + ka.xd_list[-3:]
+    for p1 in points:
+        for p2 in points:
+            if p1['dt'] > p2['dt']:
+                continue
+            macd_abs, macd_pos, macd_neg, vol = brute_power(p1['dt'], p2['dt'])
+            assert round(ka.calculate_macd_power(p1['dt'], p2['dt']), 6) == round(macd_abs, 6)
+            assert round(ka.calculate_macd_power(p1['dt'], p2['dt'], 'xd', 'up'), 6) == round(macd_pos, 6)
+            assert round(ka.calculate_macd_power(p1['dt'], p2['dt'], 'xd', 'down'), 6) == round(macd_neg, 6)
+            assert ka.calculate_vol_power(p1['dt'], p2['dt']) == vol
+
+
+def test_update_many():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    # 每根K线之前先输入一根未完成的K线
+    rest = []
+    for k in bars[1000:]:
+        k_ = dict(k)
+        k_.update({"close": k['open'], "high": max(k['open'], k['low']), "vol": k['vol'] / 2})
+        rest.extend([k_, k])
+
+    for columnar in (False, True):
+        ka1 = KlineAnalyze(bars[:1000], name="日线", max_count=800, use_xd=True, columnar=columnar)
+        ka2 = KlineAnalyze(bars[:1000], name="日线", max_count=800, use_xd=True, columnar=columnar)
+        for k in rest:
+            ka1.update(k)
+        for i in range(0, len(rest), 333):
+            ka2.update_many(rest[i: i + 333])
+
+        for key in ['kline_raw', 'kline_new', 'fx_list', 'bi_list', 'xd_list']:
+            assert [dict(x) for x in getattr(ka1, key)] == [dict(x) for x in getattr(ka2, key)]
+        assert np.allclose([x['macd'] for x in ka1.macd[-200:]], [x['macd'] for x in ka2.macd[-200:]])
+        assert np.allclose([x['ma5'] for x in ka1.ma[-200:]], [x['ma5'] for x in ka2.ma[-200:]])
+        assert ka1.end_dt == ka2.end_dt and ka1.latest_price == ka2.latest_price
+
+
+def test_structure_kernel():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    for bi_mode in ['new', 'old']:
+        # 默认使用 numba 内核批量识别；verbose=True 时使用 Python 实现逐根识别
+        ka1 = KlineAnalyze(bars, name="日线", bi_mode=bi_mode, max_count=5000, use_xd=True)
+        ka2 = KlineAnalyze(bars, name="日线", bi_mode=bi_mode, max_count=5000, use_xd=True, verbose=True)
+        for key in ['kline_new', 'fx_list', 'bi_list', 'xd_list']:
+            assert getattr(ka1, key) == getattr(ka2, key)
+
+
+def test_dataframe_init():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    ka1 = KlineAnalyze(kline.iloc[:-100], name="日线", max_count=5000, use_xd=True)
+    ka2 = KlineAnalyze(bars[:-100], name="日线", max_count=5000, use_xd=True)
+    # 读取 kline_raw 之前不会构造 dict
+    assert ka1._frame is not None
+    for key in ['kline_new', 'fx_list', 'bi_list', 'xd_list']:
+        assert getattr(ka1, key) == getattr(ka2, key)
+    assert pd.DataFrame(ka1.macd).equals(pd.DataFrame(ka2.macd))
+    assert ka1.calculate_vol_power(ka1.bi_list[-3]['dt'], ka1.bi_list[-1]['dt']) == \
+        ka2.calculate_vol_power(ka2.bi_list[-3]['dt'], ka2.bi_list[-1]['dt'])
+    assert ka1.latest_price == ka2.latest_price and ka1.end_dt == ka2.end_dt
+    assert ka1._frame is not None
+
+    assert ka1.kline_raw == ka2.kline_raw
+    assert ka1._frame is None
+    for k in bars[-100:]:
+        ka1.update(k)
+        ka2.update(k)
+    assert ka1.bi_list == ka2.bi_list
+
+
+def test_save_state(tmp_path):
+    from czsc.signals import KlineSignals
+
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    file_state = str(tmp_path / "ka.state")
+    for cls, kwargs in [(KlineAnalyze, {"use_xd": True, "max_count": 1000}),
+                        (KlineAnalyze, {"use_xd": True, "max_count": 1000, "columnar": True}),
+                        (KlineSignals, {"use_xd": True, "max_count": 1000, "use_ta": True})]:
+        ka1 = cls(bars[:2000], **kwargs)
+        for k in bars[2000:2500]:
+            ka1.update(k)
+        ka1.save_state(file_state)
+        ka2 = cls.load_state(file_state)
+        assert type(ka2) is cls
+
+        for k in bars[2500:]:
+            ka1.update(k)
+            ka2.update(k)
+        for key in ['kline_raw', 'kline_new', 'fx_list', 'bi_list', 'xd_list']:
+            assert list(getattr(ka1, key)) == list(getattr(ka2, key))
+        assert pd.DataFrame(list(ka1.macd)).equals(pd.DataFrame(list(ka2.macd)))
+        assert ka1.calculate_macd_power(ka1.bi_list[-5]['dt'], ka1.bi_list[-1]['dt']) == \
+            ka2.calculate_macd_power(ka2.bi_list[-5]['dt'], ka2.bi_list[-1]['dt'])
+        if cls is KlineSignals:
+            assert ka1.get_signals() == ka2.get_signals()
+
+    # 类型不匹配、文件格式不正确
+    try:
+        KlineAnalyze.load_state(file_state)
+        assert False
+    except ValueError:
+        pass
+    with open(file_state, "wb") as f:
+        f.write(b"not a state file")
+    try:
+        KlineSignals.load_state(file_state)
+        assert False
+    except ValueError:
+        pass
+
+    # 用 DataFrame 初始化时保存的 pandas 对象可以恢复
+    ka1 = KlineAnalyze(kline, max_count=1000)
+    ka1.save_state(file_state)
+    assert KlineAnalyze.load_state(file_state).fx_list == ka1.fx_list
+
+    # 状态文件中引用了白名单之外的函数，拒绝加载，不执行其中的代码
+    class Evil:
+        def __reduce__(self):
+            return os.mkdir, (str(tmp_path / "evil"),)
+
+    from czsc.analyze import STATE_MAGIC, STATE_VERSION
+    for data in [Evil(), {"class": "KlineAnalyze", "state": {"x": Evil()}, "records": {}}]:
+        with open(file_state, "wb") as f:
+            f.write(STATE_MAGIC + struct.pack("<I", STATE_VERSION))
+            pickle.dump(data, f, protocol=4)
+        try:
+            KlineAnalyze.load_state(file_state)
+            assert False
+        except pickle.UnpicklingError:
+            pass
+        assert not os.path.exists(str(tmp_path / "evil"))
+
+
+def test_zs_tracker():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    def zs_key(zs):
+        return (zs['ZD'], zs['ZG'], zs['G'], zs['GG'], zs['D'], zs['DD'],
+                zs['start_point']['dt'], zs['end_point']['dt'] if zs['end_point'] else None,
+                zs.get('third_buy', {}).get('dt'), zs.get('third_sell', {}).get('dt'),
+                [x['dt'] for x in zs['points']], zs['zn'])
+
+    ka = KlineAnalyze(bars[:1000], name="日线", max_count=10000, use_xd=True)
+    for i, k in enumerate(bars[1000:]):
+        ka.update(k)
+        if i % 50 == 0 or i == len(bars) - 1001:
+            for tracker, points in ((ka.bi_zs, ka.bi_list), (ka.xd_zs, ka.xd_list)):
+                before = [dict(x) for x in points]
+                assert [zs_key(x) for x in tracker.all_zs] == [zs_key(x) for x in find_zs(points)]
+                assert [dict(x) for x in points] == before
+
+    # 超过 max_count 之后，已经完成的中枢随K线一起淘汰
+    ka = KlineAnalyze(bars[:1000], name="日线", max_count=800, use_xd=True)
+    ka.update_many(bars[1000:])
+    start_dt = ka.kline_raw[0]['dt']
+    assert all(zs['end_point'] is None or zs['end_point']['dt'] > start_dt for zs in ka.bi_zs.zs_list)
+
+
+def test_to_df():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    dfs = []
+    for columnar in (False, True):
+        ka = KlineAnalyze(bars, name="日线", max_count=5000, use_xd=True, columnar=columnar)
+        raw = [dict(x) for x in ka.kline_raw]
+        df = ka.to_df(use_macd=True, max_count=2000)
+        assert [dict(x) for x in ka.kline_raw] == raw
+        assert len(df) == 2000 and df['dt'].tolist() == [x['dt'] for x in raw[-2000:]]
+
+        start_dt = df['dt'].iloc[0]
+        fx_list = [x for x in ka.fx_list if x['dt'] >= start_dt]
+        assert df[df['fx_mark'] != 'o'][['dt', 'fx_mark', 'fx']].values.tolist() == \
+               [[x['dt'], x['fx_mark'], x['fx']] for x in fx_list]
+        assert df[df['bi'].notna()][['dt', 'bi']].values.tolist() == \
+               [[x['dt'], x['bi']] for x in ka.bi_list if x['dt'] >= start_dt]
+        assert df[df['xd'].notna()][['dt', 'xd']].values.tolist() == \
+               [[x['dt'], x['xd']] for x in ka.xd_list if x['dt'] >= start_dt]
+
+        df_new = ka.to_df(max_count=500, mode="new")
+        assert df_new['dt'].tolist() == [x['dt'] for x in ka.kline_new[-500:]]
+        dfs.append(df)
+
+    pd.testing.assert_frame_equal(dfs[0], dfs[1])
+
+
+def test_subscribe():
+    file_kline = os.path.join(cur_path, "data/000001.XSHG_1MIN.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    # 按事件维护的序列与分析结果一致
+    ka = KlineAnalyze(bars[:500], name="1分钟", max_count=5000, use_xd=True)
+    mirror = {"fx": list(ka.fx_list), "bi": list(ka.bi_list), "xd": list(ka.xd_list)}
+    counter = {}
+
+    def on_event(ka_, event, data):
+        assert ka_ is ka
+        counter[event] = counter.get(event, 0) + 1
+        if event == "fx_removed":
+            del mirror['fx'][-len(data['fx_list']):]
+        elif event == "fx_added":
+            mirror['fx'].extend(data['fx_list'])
+        elif event == "bi_extended":
+            i = [j for j, x in enumerate(mirror['bi']) if x == data['old']][-1]
+            assert data['old']['fx_mark'] == data['new']['fx_mark']
+            mirror['bi'][i] = data['new']
+        elif event == "bi_removed":
+            del mirror['bi'][-len(data['bi_list']):]
+        elif event == "bi_added":
+            mirror['bi'].extend(data['bi_list'])
+        elif event == "bi_confirmed":
+            assert data['start']['fx_mark'] != data['end']['fx_mark']
+        elif event == "xd_changed":
+            if data['removed']:
+                del mirror['xd'][-len(data['removed']):]
+            mirror['xd'].extend(data['added'])
+
+    ka.subscribe(on_event)
+    confirmed = []
+    ka.subscribe(lambda ka_, event, data: confirmed.append(data['end']), events=["bi_confirmed"])
+    for k in bars[500:1500]:
+        ka.update(k)
+        assert mirror['fx'] == ka.fx_list and mirror['bi'] == ka.bi_list and mirror['xd'] == ka.xd_list
+    ka.update_many(bars[1500:])
+    assert mirror['fx'] == ka.fx_list and mirror['bi'] == ka.bi_list and mirror['xd'] == ka.xd_list
+
+    for event in ["fx_added", "fx_removed", "bi_extended", "bi_added", "bi_confirmed", "xd_changed"]:
+        assert counter.get(event, 0) > 0
+    assert len(confirmed) == counter['bi_confirmed'] and confirmed[-1] in ka.bi_list[-3:-1]
+
+    # 取消订阅后不再收到事件
+    ka.unsubscribe(on_event)
+    n = sum(counter.values())
+    last = bars[-1]
+    ka.update(dict(last, dt=last['dt'] + pd.Timedelta(minutes=1), open=last['close'], high=last['high'] * 1.05))
+    assert sum(counter.values()) == n
+
+
+def test_timer():
+    file_kline = os.path.join(cur_path, "data/000001.SH_D.csv")
+    kline = pd.read_csv(file_kline, encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+
+    ka = KlineAnalyze(bars[:1000], name="日线", max_count=1000, use_xd=True, use_ta=True)
+    assert ka.timer is None
+    received = []
+    timer = ka.enable_timer(sink=lambda name, timings: received.append((name, timings)))
+    for k in bars[1000:1500]:
+        ka.update(k)
+    ka.update_many(bars[1500:1600])
+
+    df = timer.summary().set_index("stage")
+    assert df.loc['total', 'count'] == 501 and df.loc['bi', 'count'] == 501
+    assert df.loc['ta', 'count'] == df.loc['kline_raw', 'count'] == 600
+    assert (df['p50'] <= df['p99']).all() and (df['p99'] <= df['max']).all()
+    assert df.loc['total', 'total'] >= df.drop('total')['total'].sum() * 0.99
+    assert len(received) == 501 and received[0][0] == "日线"
+    assert 'total' in received[-1][1] and set(received[-1][1]) <= set(df.index)
 
+    ka.disable_timer()
+    ka.update(bars[1600])
+    assert timer.summary().set_index("stage").loc['total', 'count'] == 501
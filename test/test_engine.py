@@ -0,0 +1,69 @@
+# coding: utf-8
+import os
+import pandas as pd
+from czsc.analyze import KlineAnalyze
+from czsc.engine import MultiLevelAnalyze, replay_signals
+from czsc.signals import KlineSignals
+
+cur_path = os.path.split(os.path.realpath(__file__))[0]
+file_kline = os.path.join(cur_path, "data/000001.XSHG_1MIN.csv")
+kline = pd.read_csv(file_kline, encoding="utf-8")
+kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+bars = kline.to_dict("records")
+
+
+def test_multi_level_analyze():
+    freqs = ['1分钟', '5分钟', '15分钟', '30分钟', '60分钟', '日线', '周线']
+    ml1 = MultiLevelAnalyze(bars[:600], freqs=freqs, max_count=5000, use_xd=True, use_ta=True)
+    ml2 = MultiLevelAnalyze(bars[:600], freqs=freqs, max_count=5000, use_xd=True, use_ta=True)
+    # K线数量不足的级别，等K线足够之后再创建分析对象
+    assert '周线' not in ml1.kas
+
+    for k in bars[600:]:
+        ml1.update(k)
+    ml2.update_many(bars[600:1200])
+    ml2.update_many(bars[1200:])
+    assert ml1.end_dt == ml2.end_dt == bars[-1]['dt']
+
+    # 结果与直接用K线生成器中的K线初始化一致
+    for freq in freqs:
+        ref = KlineAnalyze(list(getattr(ml1.kg, {"日线": "D", "周线": "W"}.get(freq, "m" + freq[:-2]))),
+                           max_count=5000, use_xd=True, use_ta=True)
+        for ka in (ml1.kas[freq], ml2.kas[freq]):
+            for key in ['kline_raw', 'kline_new', 'fx_list', 'bi_list', 'xd_list']:
+                assert [dict(x) for x in getattr(ka, key)] == [dict(x) for x in getattr(ref, key)]
+            # 初始化时K线很少的级别，增量计算的 MACD 也与批量计算完全一致
+            assert [dict(x) for x in ka.macd] == [dict(x) for x in ref.macd]
+
+    # K线生成器与分析对象都只保留 max_count 根K线
+    ml = MultiLevelAnalyze(bars[:1000], freqs=['1分钟', '5分钟'], max_count=300)
+    ml.update_many(bars[1000:])
+    assert len(ml.kg.m1) == len(ml.kg.m5) == 300
+    assert len(ml.kas['5分钟'].kline_raw) <= 300
+    assert ml.kas['5分钟'].kline_raw[-1] is ml.kg.m5[-1]
+
+
+def test_replay_signals():
+    freqs = ['1分钟', '5分钟', '30分钟']
+    df = replay_signals(kline, freqs=freqs, init_count=500, max_count=1000)
+    assert len(df) == len(kline) - 500
+    assert df['dt'].tolist() == kline['dt'].iloc[500:].tolist()
+
+    # 与逐根 update 之后计算信号的结果一致
+    ml = MultiLevelAnalyze(bars[:500], freqs=freqs, max_count=1000, ka_cls=KlineSignals)
+    for i, k in enumerate(bars[500:]):
+        ml.update(k)
+        if i % 200 == 0 or i == len(bars) - 501:
+            row = df.iloc[i]
+            for key, v in ml.get_signals().items():
+                assert row[key] == v
+
+    # start_dt 之前的K线只更新，不记录信号
+    df2 = replay_signals(kline, freqs=freqs, init_count=500, start_dt=bars[1500]['dt'], max_count=1000)
+    assert df2['dt'].iloc[0] == bars[1500]['dt']
+    assert df2.iloc[-1].astype(str).tolist() == df.iloc[-1].astype(str).tolist()
+
+    # 数组输入
+    arrays = {x: kline[x].values for x in ['dt', 'open', 'close', 'high', 'low', 'vol']}
+    df3 = replay_signals(arrays, freqs=freqs, init_count=500, max_count=1000, symbol=bars[0]['symbol'])
+    assert df3.astype(str).values.tolist() == df.astype(str).values.tolist()
@@ -0,0 +1,34 @@
+# coding: utf-8
+import pickle
+import pandas as pd
+from czsc.objects import RawBar, FX, BI, XD
+
+
+def test_record():
+    fx = FX(dt=pd.Timestamp("2020-11-26"), fx_mark="d", fx=138.0, start_dt=pd.Timestamp("2020-11-25"),
+            end_dt=pd.Timestamp("2020-11-27"), fx_high=144.87, fx_low=138.0)
+    assert fx['fx_mark'] == fx.fx_mark == 'd'
+    assert fx.get('bi') is None and 'fx' in fx and 'bi' not in fx
+    assert dict(fx) == fx.to_dict() == fx
+    assert list(fx.keys()) == ['dt', 'fx_mark', 'fx', 'start_dt', 'end_dt', 'fx_high', 'fx_low']
+
+    bi = BI.from_fx(fx)
+    assert bi['bi'] == 138.0 and 'fx' not in bi
+    xd = XD.from_bi(bi)
+    assert xd['xd'] == 138.0 and xd.dt == fx.dt
+    xd['xd'] = 139.0
+    assert xd.xd == 139.0
+    try:
+        xd['bi'] = 1
+        assert False
+    except KeyError:
+        pass
+    assert not hasattr(xd, '__dict__')
+
+    assert pickle.loads(pickle.dumps(bi)) == bi
+    df = pd.DataFrame([bi, bi])
+    assert sorted(df.columns) == sorted(bi.keys()) and len(df) == 2
+
+    bar = RawBar.from_bar({"symbol": "000001.SH", "dt": pd.Timestamp("2020-11-26"), "open": 1, "close": 2,
+                           "high": 3, "low": 0.5, "vol": 100})
+    assert bar['high'] == 3 and bar.symbol == "000001.SH"
@@ -1,6 +1,13 @@
+import os
+import numpy as np
+import pandas as pd
 from czsc.data.jq import get_kline
 from czsc.data import freq_map
-from czsc.signals import KlineSignals
+from czsc.signals import KlineSignals, MachineKlineSignals, check_dynamic, check_third_bs, check_jing, \
+    DYNAMIC, THIRD_BS, JING
+from czsc.utils import signal_kernel as sk
+
+cur_path = os.path.split(os.path.realpath(__file__))[0]
 
 def test_signals():
     kline = get_kline(symbol="300033.XSHE", end_date="20201128", freq="5min", count=1000)
@@ -8,3 +15,113 @@ def test_signals():
     print(ks.get_signals())
 
 
+def test_signals_cache():
+    kline = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+    ks = KlineSignals(bars[:1000], name="1分钟", max_count=1200, use_xd=True)
+    versions = dict(ks.versions)
+    assert ks.get_signals() == ks.get_signals()
+
+    for k in bars[1000:]:
+        ks.update(k)
+        signals = ks.get_signals()
+        ks._signal_cache.clear()
+        assert signals == ks.get_signals()
+    # 结构变化、头部淘汰都会增加版本号
+    assert all(ks.versions[key] > versions[key] for key in versions)
+
+
+def test_signal_panel():
+    kline = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+    df = MachineKlineSignals.signal_panel(kline, name="1分钟", max_count=3000)
+    assert len(df) == len(bars) - 2
+    assert df['dt'].tolist() == kline['dt'].iloc[2:].tolist()
+    assert df['1分钟_当下笔向下新低'].dtype == 'int8'
+    assert df['1分钟_第N-1笔创近6笔新高'].dtype == bool
+    assert df['1分钟_最近一个笔中枢ZD'].dtype == 'float64'
+    assert df['1分钟_当下笔方向'].dtype == 'category'
+
+    # 与每根K线重新创建分析对象计算的信号一致
+    for i in range(2, len(bars), 150):
+        signals = MachineKlineSignals(bars[:i + 1], name="1分钟", max_count=3000).get_signals()
+        row = df.iloc[i - 2]
+        assert all(row[key] == v for key, v in signals.items())
+
+
+def test_signal_vector():
+    kline = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+    ks = KlineSignals(bars[:1000], name="1分钟", max_count=2000)
+    schema = ks.schema
+    assert schema.keys == list(ks.get_signals().keys())
+    assert schema.dtype['1分钟_第N笔涨跌力度'] == 'int8' and schema.dtype['1分钟_最近一个笔中枢ZD'] == 'float64'
+
+    out = schema.empty(len(bars) - 1000)
+    for i, k in enumerate(bars[1000:]):
+        ks.update(k)
+        record = ks.get_signal_vector(out, i)
+        assert schema.decode(record) == ks.get_signals()
+    assert schema.decode(out[-1]) == ks.get_signals()
+
+    # 编码与字符串取值一一对应
+    df = schema.to_frame(out)
+    assert df['1分钟_第N笔涨跌力度'].cat.categories.tolist() == list(schema.categories[schema.names.index('第N笔涨跌力度')])
+    assert df['1分钟_第N笔涨跌力度'].iloc[-1] == ks.get_signals()['1分钟_第N笔涨跌力度']
+
+    # 笔标记不足时各字段为信号结构中的默认值
+    ms = MachineKlineSignals(bars[:20], name="1分钟")
+    record = ms.get_signal_vector()
+    assert record['1分钟_当下笔向下新低'] == -1 and record['1分钟_第N笔涨跌力度'] == 0
+    assert ms.get_signals()['1分钟_当下笔向下新低'] == -1 and ms.get_signals()['1分钟_第N笔涨跌力度'] == "other"
+
+
+def test_signal_kernel():
+    rng = np.random.RandomState(2020)
+    for _ in range(3000):
+        # 随机生成方向交替的 11 个笔标记
+        bi = np.cumsum(rng.randint(1, 20, 11) * np.where(np.arange(11) % 2, 1, -1) * rng.choice([1, -1])) + 100.0
+        vol = rng.randint(1, 6, 10).astype(float)
+        fds = [{"high": max(bi[i], bi[i + 1]), "low": min(bi[i], bi[i + 1]), "vol_power": vol[i],
+                "price_power": abs(bi[i] - bi[i + 1]), "direction": "up" if bi[i] < bi[i + 1] else "down"}
+               for i in range(10)]
+        codes, zs = sk.bi_kernel(bi, vol)
+        for j in range(4):
+            e = 9 - j
+            assert DYNAMIC[codes[sk.DYN + j]] == check_dynamic(fds[e - 4], fds[e - 2], fds[e])
+            assert THIRD_BS[codes[sk.TBS + j]] == check_third_bs(*fds[e - 4: e + 1])
+            if j < 3:
+                assert JING[codes[sk.JING + j]] == check_jing(*fds[e - 4: e + 1])
+
+
+def test_signal_view(monkeypatch):
+    kline = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    kline.loc[:, "dt"] = pd.to_datetime(kline.dt)
+    bars = kline.to_dict("records")
+    calls = []
+    bi_kernel = sk.bi_kernel
+
+    def counted(*args):
+        calls.append(1)
+        return bi_kernel(*args)
+    monkeypatch.setattr(sk, "bi_kernel", counted)
+
+    # 一个分析对象同时输出两个信号类的信号，与各自独立计算的结果一致，bi_kernel 每个笔序列版本只计算一次
+    ks = KlineSignals(bars[:1000], name="1分钟", max_count=2000)
+    ms = MachineKlineSignals(bars[:1000], name="1分钟", max_count=2000)
+    versions = set()
+    for k in bars[1000:1600]:
+        ks.update(k)
+        ms.update(k)
+        expected = ms.get_signals(), ms.get_signal_vector().tolist(), ms.bi_signals()
+        n = len(calls)
+        ks.get_signals()
+        assert ks.get_signals(view=MachineKlineSignals) == expected[0]
+        assert ks.get_signal_vector(view=MachineKlineSignals).tolist() == expected[1]
+        assert ks.bi_signals(view=MachineKlineSignals) == expected[2]
+        assert len(calls) - n == (ks.versions['bi_list'] not in versions and len(ks.bi_list) > 12)
+        versions.add(ks.versions['bi_list'])
+    assert ks.schema_of(MachineKlineSignals).keys == ms.schema.keys
@@ -0,0 +1,101 @@
+# coding: utf-8
+import os
+import threading
+import pytest
+import pandas as pd
+from czsc import trader
+from czsc.engine import MultiLevelAnalyze
+from czsc.signals import KlineSignals
+
+cur_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+def test_trader_concurrent_load(monkeypatch, tmp_path):
+    kline_d = pd.read_csv(os.path.join(cur_path, "data/000001.SH_D.csv"), encoding="utf-8")
+    kline_m = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    for df in (kline_d, kline_m):
+        df['dt'] = pd.to_datetime(df['dt'])
+    klines = {"1min": kline_m.iloc[-300:], "5min": kline_m.iloc[-600:-300],
+              "30min": kline_m.iloc[-900:-600], "D": kline_d.iloc[-300:]}
+    # 四个级别都进入 get_kline 之后才一起返回，逐个获取时会超时失败
+    barrier = threading.Barrier(4, timeout=10)
+    # 阻塞在 release 上的级别，直到测试结束才返回
+    blocked = set()
+    release = threading.Event()
+    tokens = []
+
+    def get_token():
+        tokens.append(1)
+        return "token"
+
+    def get_kline(symbol, end_date, freq, count, token, timeout):
+        assert token == "token" and count == 300
+        if freq in blocked:
+            release.wait()
+        else:
+            barrier.wait()
+        return klines[freq].copy()
+
+    monkeypatch.setattr(trader, "get_token", get_token)
+    monkeypatch.setattr(trader, "get_kline", get_kline)
+
+    signals = {"symbol": "000001.XSHG"}
+    for freq, name in zip(klines, ['1分钟', '5分钟', '30分钟', '日线']):
+        ks = KlineSignals(klines[freq], name=name, bi_mode="new", max_count=300, use_xd=False)
+        signals.update(ks.get_signals())
+
+    ct = trader.CzscTrader("000001.XSHG", timeout=10)
+    assert len(tokens) == 1
+    assert ct.signals == signals and list(ct.kas) == ct.freqs
+    assert ct.end_dt == klines['1min']['dt'].iloc[-1]
+
+    try:
+        # 超时的级别不等待，其他级别正常返回
+        barrier = threading.Barrier(3, timeout=10)
+        blocked.add("D")
+        with pytest.warns(UserWarning, match="D 超过 0.5 秒"):
+            ct = trader.CzscTrader("000001.XSHG", timeout=0.5)
+        assert list(ct.kas) == ['1分钟', '5分钟', '30分钟']
+        assert not any(k.startswith("日线") for k in ct.signals)
+        # 缺少的级别不影响选股与快照
+        assert isinstance(ct.run_selector(), str)
+        ct.take_snapshot(str(tmp_path / "snapshot.html"))
+        assert os.path.exists(str(tmp_path / "snapshot.html"))
+
+        # 1分钟级别失败时给出明确的错误
+        barrier = threading.Barrier(3, timeout=10)
+        blocked.clear()
+        blocked.add("1min")
+        with pytest.raises(ValueError, match="000001.XSHG 的 1分钟"), pytest.warns(UserWarning):
+            trader.CzscTrader("000001.XSHG", timeout=0.5)
+    finally:
+        release.set()
+
+
+def test_trader_update(monkeypatch):
+    kline = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    kline['dt'] = pd.to_datetime(kline['dt'])
+    bars = kline.to_dict("records")
+    freq_names = {"1min": "1分钟", "5min": "5分钟", "30min": "30分钟", "D": "日线"}
+    ml = MultiLevelAnalyze(bars[:1500], freqs=list(freq_names.values()), max_count=300,
+                           ka_cls=KlineSignals, bi_mode="new", use_xd=False)
+
+    def get_kline(symbol, end_date, freq, count, token, timeout):
+        return pd.DataFrame(ml.kg.get_kline(freq_names[freq], count))
+
+    monkeypatch.setattr(trader, "get_token", lambda: "token")
+    monkeypatch.setattr(trader, "get_kline", get_kline)
+    ct = trader.CzscTrader("000001.XSHG")
+    assert ct.signals == ml.get_signals()
+
+    # 批量输入、逐根输入、DataFrame 输入的结果都与 MultiLevelAnalyze 一致
+    ct.update(bars[1500:2000])
+    for k in bars[2000:2100]:
+        ct.update(k)
+    ct.update(kline.iloc[2100:])
+    ml.update_many(bars[1500:])
+    assert ct.signals == ml.get_signals()
+    assert ct.end_dt == bars[-1]['dt'] and ct.latest_price == bars[-1]['close']
+    for freq, ka in ml.kas.items():
+        assert [dict(x) for x in ct.kas[freq].kline_raw] == [dict(x) for x in ka.kline_raw]
+        assert [dict(x) for x in ct.kas[freq].bi_list] == [dict(x) for x in ka.bi_list]
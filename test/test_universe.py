@@ -0,0 +1,113 @@
+# coding: utf-8
+import os
+import pickle
+import pandas as pd
+from czsc.analyze import KlineAnalyze
+from czsc.signals import KlineSignals
+from czsc.universe import analyze_universe, iter_universe
+
+cur_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+def test_analyze_universe():
+    kline_d = pd.read_csv(os.path.join(cur_path, "data/000001.SH_D.csv"), encoding="utf-8")
+    kline_m = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    bars_by_symbol = {}
+    for i in range(6):
+        bars_by_symbol["S{}".format(i)] = {
+            "日线": kline_d.iloc[i * 100: i * 100 + 1000],
+            "1分钟": kline_m.iloc[i * 50: i * 50 + 1000].to_dict("records"),
+        }
+    config = {"max_count": 1000, "use_xd": True}
+
+    res1 = analyze_universe(bars_by_symbol, config, workers=1)
+    res2 = analyze_universe(bars_by_symbol, config, workers=2, chunk_size=2)
+    assert list(res1.keys()) == list(res2.keys()) == list(bars_by_symbol.keys())
+
+    for symbol, levels in bars_by_symbol.items():
+        assert res1[symbol]['error'] is None and res1[symbol]['signals'] == res2[symbol]['signals']
+        signals = {"symbol": symbol}
+        for level, bars in levels.items():
+            kline = pd.DataFrame(bars)
+            kline['dt'] = pd.to_datetime(kline['dt'])
+            ks = KlineSignals(kline, name=level, **config)
+            signals.update(ks.get_signals())
+            for key in ['fx_list', 'bi_list', 'xd_list']:
+                expected = [dict(x) for x in getattr(ks, key)]
+                assert [dict(x) for x in res1[symbol]['levels'][level][key]] == expected
+                assert [dict(x) for x in res2[symbol]['levels'][level][key]] == expected
+            assert res2[symbol]['levels'][level]['end_dt'] == ks.end_dt
+        assert res1[symbol]['signals'] == signals
+
+    # 单个标的出错不影响其他标的
+    bad = {"S0": kline_d.iloc[:500], "S1": kline_d.iloc[:0]}
+    res = list(iter_universe(bad, {"cls": KlineAnalyze}, workers=1))
+    assert res[0]['error'] is None and res[0]['signals'] == {"symbol": "S0"}
+    assert res[0]['levels']['本级别']['bi_list']
+    assert res[1]['error'] is not None
+
+
+class Interrupt(BaseException):
+    pass
+
+
+def test_screen_universe(monkeypatch, tmp_path):
+    from czsc import trader, universe
+
+    kline_d = pd.read_csv(os.path.join(cur_path, "data/000001.SH_D.csv"), encoding="utf-8")
+    kline_m = pd.read_csv(os.path.join(cur_path, "data/000001.XSHG_1MIN.csv"), encoding="utf-8")
+    for df in (kline_d, kline_m):
+        df['dt'] = pd.to_datetime(df['dt'])
+    klines = {"1min": kline_m.iloc[-300:], "5min": kline_m.iloc[-600:-300],
+              "30min": kline_m.iloc[-900:-600], "D": kline_d.iloc[-300:]}
+    symbols = ["S{}".format(i) for i in range(6)]
+    loaded = []
+    stop = {"S3"}
+
+    def get_kline(symbol, end_date, freq, count, token, timeout):
+        assert token == "token"
+        if symbol in stop:
+            raise Interrupt()
+        if freq == "1min":
+            loaded.append(symbol)
+        if symbol == "S5":
+            raise ValueError("没有数据")
+        return klines[freq].copy()
+
+    monkeypatch.setattr(trader, "get_kline", get_kline)
+    monkeypatch.setattr(universe, "get_token", lambda: "token")
+    file_output = str(tmp_path / "screen.pkl")
+
+    # 运行中断，已完成的标的保存在检查点文件中
+    try:
+        universe.screen_universe(symbols, file_output, workers=1)
+    except Interrupt:
+        pass
+    assert loaded == ["S0", "S1", "S2"] and os.path.exists(file_output + ".ckpt")
+
+    # 模拟写入检查点时中断：最后一条记录只写了一半
+    with open(file_output + ".ckpt", 'ab') as f:
+        f.write(pickle.dumps({"symbol": "S3", "error": None})[:10])
+    stop.clear()
+    stop.add("S4")
+    loaded.clear()
+    try:
+        universe.screen_universe(symbols, file_output, workers=1)
+    except Interrupt:
+        pass
+    assert loaded == ["S3"]
+
+    stop.clear()
+    loaded.clear()
+    df = universe.screen_universe(symbols, file_output, workers=1)
+    assert loaded == ["S4", "S5"] and not os.path.exists(file_output + ".ckpt")
+    assert df['symbol'].tolist() == symbols
+    assert df['error'].isnull().tolist() == [True] * 5 + [False]
+
+    ct = trader.CzscTrader("S0", token="token")
+    assert (df['selector'][:5] == ct.run_selector()).all()
+    assert (df['end_dt'][:5] == ct.end_dt).all()
+    assert pd.read_pickle(file_output).equals(df)
+
+    df2 = universe.screen_universe(symbols, str(tmp_path / "screen.csv"), workers=2)
+    assert df2.drop(columns="error").equals(df.drop(columns="error"))